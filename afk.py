@@ -1,321 +1,390 @@
-import os
-import sys
-
-# Add single instance check at the very beginning
-try:
-    from single_instance import SingleInstance
-    instance = SingleInstance("AFKTracker")
-except ImportError:
-    # If import fails, continue running
-    pass
-
-import time
-import threading
-import datetime
-import getpass
-import platform
-from pynput import mouse, keyboard
-try:
-    import pygetwindow as gw
-except ImportError:
-    # 如果在 macOS 或 Linux 上運行，提供替代方案
-    gw = None
-
-# 導入 MongoDB 配置
-from database.mongo_config import get_database
-from logger_config import setup_logger
-import os
-
-# 設置記錄器
-logger = setup_logger('AFKTracker')
-
-# 記錄啟動信息
-logger.info('AFK Tracking service starting...')
-logger.info(f'User: {os.environ.get("USERNAME")}')
-logger.info(f'Computer name: {os.environ.get("COMPUTERNAME")}')
-
-class AFK:
-    #180
-    def __init__(self, idle_time=300):
-        """
-        初始化活動監控器
-        
-        參數:
-            idle_time (int): 判定為離開(AFK)的閒置秒數，預設為300秒
-        """
-        self.idle_time = idle_time
-        self.last_activity_time = time.time()
-        self.is_afk = False
-        self.afk_start_time = None
-        self.work_start_time = time.time()
-        self.current_window = self._get_current_window()
-        self.username = getpass.getuser()
-        self.sessions = []
-        self.running = False
-        self.mouse_listener = None
-        self.keyboard_listener = None
-        self.monitor_thread = None
-        
-        # 連接 MongoDB 並創建索引
-        try:
-            self.db = get_database()
-            if 'afk' not in self.db.list_collection_names():
-                self.db.create_collection('afk')
-                print("已創建 'afk' collection")
-                
-            # 創建複合索引
-            self.db.afk.create_index([
-                ("timestamp", 1),
-                ("username", 1),
-                ("date", 1),
-                ("status", 1)
-            ], name="activity_tracking_index")
-            
-            self.mongo_connected = True
-            # print("已成功連接到 MongoDB 並創建索引")
-        except Exception as e:
-            print(f"無法連接到 MongoDB: {e}")
-            print("將只在本地存儲會話數據")
-            self.mongo_connected = False
-        
-    def _get_current_window(self):
-        """獲取當前活動視窗名稱"""
-        try:
-            if platform.system() == "Windows" and gw:
-                active_window = gw.getActiveWindow()
-                return active_window.title if active_window else "Unknown"
-            else:
-                return "Unknown (非Windows系統)"
-        except Exception:
-            return "Unknown"
-    
-    def _save_to_mongodb(self, session_data):
-        """將會話數據存儲到 MongoDB"""
-        if not self.mongo_connected:
-            return
-            
-        try:
-            # 添加時間戳用於排序和查詢
-            session_data['timestamp'] = datetime.datetime.now()
-            # 插入數據到 MongoDB
-            self.db.afk.insert_one(session_data)
-        except Exception as e:
-            print(f"保存數據到 MongoDB 時出錯: {e}")
-    
-    def on_activity(self):
-        """當檢測到活動時呼叫"""
-        current_time = time.time()
-        self.last_activity_time = current_time
-        
-        # 檢查活動狀態是否從AFK變為非AFK
-        if self.is_afk:
-            self.is_afk = False
-            afk_end_time = datetime.datetime.now()
-            afk_duration = current_time - self.afk_start_time
-            
-            # 記錄AFK會話
-            session_data = {
-                'date': datetime.datetime.now().strftime('%Y-%m-%d'),
-                'username': self.username,
-                'window': self.current_window,
-                'type': 'afk',
-                'start_time': datetime.datetime.fromtimestamp(self.afk_start_time).strftime('%H:%M:%S'),
-                'end_time': afk_end_time.strftime('%H:%M:%S'),
-                'duration': self._format_duration(afk_duration)
-            }
-            
-            self.sessions.append(session_data)
-            # 保存到 MongoDB
-            self._save_to_mongodb(session_data)
-            
-            # 開始新的工作會話
-            self.work_start_time = current_time
-            self.current_window = self._get_current_window()
-    
-    def on_mouse_move(self, x, y):
-        self.on_activity()
-    
-    def on_mouse_click(self, x, y, button, pressed):
-        if pressed:  # 僅在按下時觸發，而不是釋放時
-            self.on_activity()
-    
-    def on_mouse_scroll(self, x, y, dx, dy):
-        self.on_activity()
-    
-    def on_key_press(self, key):
-        self.on_activity()
-    
-    def check_afk_status(self):
-        """檢查使用者是否已離開(AFK)"""
-        while self.running:
-            current_time = time.time()
-            idle_duration = current_time - self.last_activity_time
-            current_window = self._get_current_window()
-            
-            # 每秒記錄一次活動狀態
-            if not self.is_afk:  # 如果用戶不是AFK狀態
-                interim_end_time = datetime.datetime.now()
-                interim_duration = 5  # 固定為1秒
-                
-                session_data = {
-                    'date': datetime.datetime.now().strftime('%Y-%m-%d'),
-                    'username': self.username,
-                    'user_name': self.username,
-                    'window': self.current_window,
-                    'type': 'work',
-                    'status': 'Work',
-                    'start_time': datetime.datetime.fromtimestamp(current_time - 5).strftime('%H:%M:%S'),
-                    'end_time': interim_end_time.strftime('%H:%M:%S'),
-                    'duration': self._format_duration(interim_duration),
-                    'is_heartbeat': True
-                }
-                
-                # 保存到 MongoDB
-                self._save_to_mongodb(session_data)
-            
-            # 檢查是否已閒置超過閾值
-            if not self.is_afk and idle_duration >= self.idle_time:
-                self.is_afk = True
-                self.afk_start_time = current_time
-                
-                # 記錄開始AFK狀態
-                session_data = {
-                    'date': datetime.datetime.now().strftime('%Y-%m-%d'),
-                    'username': self.username,
-                    'user_name': self.username,
-                    'window': self.current_window,
-                    'type': 'afk',
-                    'status': 'AFK',
-                    'start_time': datetime.datetime.fromtimestamp(current_time).strftime('%H:%M:%S'),
-                    'end_time': datetime.datetime.fromtimestamp(current_time + 1).strftime('%H:%M:%S'),
-                    'duration': self._format_duration(1),
-                    'is_heartbeat': True
-                }
-                
-                self._save_to_mongodb(session_data)
-            elif self.is_afk:  # 如果用戶處於AFK狀態
-                # 每秒記錄AFK狀態
-                session_data = {
-                    'date': datetime.datetime.now().strftime('%Y-%m-%d'),
-                    'username': self.username,
-                    'user_name': self.username,
-                    'window': self.current_window,
-                    'type': 'afk',
-                    'status': 'AFK',
-                    'start_time': datetime.datetime.fromtimestamp(current_time).strftime('%H:%M:%S'),
-                    'end_time': datetime.datetime.fromtimestamp(current_time + 1).strftime('%H:%M:%S'),
-                    'duration': self._format_duration(1),
-                    'is_heartbeat': True
-                }
-                
-                self._save_to_mongodb(session_data)
-            
-            time.sleep(5)  # 每秒檢查一次
-    
-    def start(self):
-        """開始監控使用者活動"""
-        if self.running:
-            return
-            
-        self.running = True
-        
-        # 啟動鍵盤和滑鼠監聽器
-        self.mouse_listener = mouse.Listener(
-            on_move=self.on_mouse_move,
-            on_click=self.on_mouse_click,
-            on_scroll=self.on_mouse_scroll
-        )
-        self.keyboard_listener = keyboard.Listener(on_press=self.on_key_press)
-        
-        self.mouse_listener.start()
-        self.keyboard_listener.start()
-        
-        # 啟動監控線程
-        self.monitor_thread = threading.Thread(target=self.check_afk_status)
-        self.monitor_thread.daemon = True
-        self.monitor_thread.start()
-        
-        # print(f"活動監控已啟動。閒置{self.idle_time}秒後將判定為AFK。")
-    
-    def stop(self):
-        """停止監控使用者活動"""
-        if not self.running:
-            return
-            
-        self.running = False
-        
-        # 停止監聽器
-        if self.mouse_listener:
-            self.mouse_listener.stop()
-        if self.keyboard_listener:
-            self.keyboard_listener.stop()
-        
-        # 記錄最後一個會話
-        current_time = time.time()
-        end_time = datetime.datetime.now()
-        
-        if self.is_afk:
-            # 記錄AFK會話
-            afk_duration = current_time - self.afk_start_time
-            session_data = {
-                'date': datetime.datetime.now().strftime('%Y-%m-%d'),
-                'username': self.username,
-                'window': self.current_window,
-                'type': 'afk',
-                'start_time': datetime.datetime.fromtimestamp(self.afk_start_time).strftime('%H:%M:%S'),
-                'end_time': end_time.strftime('%H:%M:%S'),
-                'duration': self._format_duration(afk_duration)
-            }
-            
-            self.sessions.append(session_data)
-            # 保存到 MongoDB
-            self._save_to_mongodb(session_data)
-        else:
-            # 記錄工作會話
-            work_duration = current_time - self.work_start_time
-            session_data = {
-                'date': datetime.datetime.now().strftime('%Y-%m-%d'),
-                'username': self.username,
-                'window': self.current_window,
-                'type': 'work',
-                'start_time': datetime.datetime.fromtimestamp(self.work_start_time).strftime('%H:%M:%S'),
-                'end_time': end_time.strftime('%H:%M:%S'),
-                'duration': self._format_duration(work_duration)
-            }
-            
-            self.sessions.append(session_data)
-            # 保存到 MongoDB
-            self._save_to_mongodb(session_data)
-        
-        print("活動監控已停止。")
-    
-    def get_sessions(self):
-        """獲取所有記錄的會話"""
-        return self.sessions
-    
-    def is_user_afk(self):
-        """檢查使用者目前是否離開"""
-        return self.is_afk
-
-    def _format_duration(self, seconds):
-        """將秒數轉換為 HH:MM:SS 格式字串"""
-        hours = int(seconds) // 3600
-        minutes = (int(seconds) % 3600) // 60
-        seconds = int(seconds) % 60
-        return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-
-
-# 使用示例
-if __name__ == "__main__":
-    # 建立活動監控器，設定閒置時間為60秒
-    monitor = AFK()
-    try:
-        monitor.start()
-        while True:
-            time.sleep(60)
-            # print(f"目前狀態: {'AFK' if monitor.is_user_afk() else '工作中'}")
-    except KeyboardInterrupt:
-        monitor.stop()
-        # print("\n會話記錄:")
-        # for session in monitor.get_sessions():
+import os
+import sys
+
+# Add single instance check at the very beginning
+try:
+    from single_instance import SingleInstance
+    instance = SingleInstance("AFKTracker")
+except ImportError:
+    # If import fails, continue running
+    pass
+
+import time
+import threading
+import datetime
+import getpass
+import platform
+from pynput import mouse, keyboard
+try:
+    import pygetwindow as gw
+except ImportError:
+    # 如果在 macOS 或 Linux 上運行，提供替代方案
+    gw = None
+
+# 導入 MongoDB 配置
+from database.mongo_config import (get_database, time_series_enabled, time_series_meta,
+                                   create_time_series_collections)
+from database.sharding import register_agent
+from database.sessions import SessionRecorder
+from database.labels import LabelEncoder, labels_enabled
+from logger_config import setup_logger
+from agent_metrics import AgentMetrics
+from agent_sessions import SessionHistory, intern_label
+from time_codec import date_string, format_clock, format_timestamp_clock, format_duration
+from ingest_client import IngestClient, DirectWriter
+import os
+
+# 設置記錄器
+logger = setup_logger('AFKTracker')
+
+# 記錄啟動信息
+logger.info('AFK Tracking service starting...')
+logger.info(f'User: {os.environ.get("USERNAME")}')
+logger.info(f'Computer name: {os.environ.get("COMPUTERNAME")}')
+
+class AFK:
+    #180
+    def __init__(self, idle_time=300):
+        """
+        初始化活動監控器
+        
+        參數:
+            idle_time (int): 判定為離開(AFK)的閒置秒數，預設為300秒
+        """
+        self.idle_time = idle_time
+        self.last_activity_time = time.time()
+        self.is_afk = False
+        self.afk_start_time = None
+        self.work_start_time = time.time()
+        # 目前狀態（work/afk）開始的時間，寫入 presence 集合
+        self.state_since = datetime.datetime.now()
+        self.current_window = self._get_current_window()
+        self.username = getpass.getuser()
+        self.workstation_name = os.environ.get('COMPUTERNAME', platform.node())
+        # work/afk 區間（含實際起訖時間），供 /api/timeline 查詢
+        self.intervals = SessionRecorder('afk', self.username, self.workstation_name)
+        # 最近的會話（依數量與時間上限的環形緩衝區），長時間執行時記憶體不會持續增長
+        self.sessions = SessionHistory()
+        # window 的字典編碼（mongo_config.json 的 "labels" 啟用時）
+        self.labels = LabelEncoder() if labels_enabled() else None
+        self.running = False
+        self.mouse_listener = None
+        self.keyboard_listener = None
+        self.monitor_thread = None
+        # 代理程式自身資源統計，超出預算時延長心跳間隔
+        self.metrics = AgentMetrics('AFKTracker', base_interval=5)
+        
+        # 設定 mongo_config.json 的 "ingest" 時，寫入改為批次送往 API，不直接連線 MongoDB；
+        # 否則由 DirectWriter 在背景連線寫入。兩者皆為佇列，第一筆記錄不必等待連線
+        self.ingest = IngestClient.from_config('AFKTracker', self.metrics)
+        self.db = self.ingest or DirectWriter(lambda: get_database(), agent='AFKTracker', metrics=self.metrics)
+        register_agent(self.db, 'AFKTracker', self.username, self.workstation_name)
+        
+    def _prepare_database(self):
+        """在背景建立 afk 集合與索引（HTTP ingest 模式下由 API 端負責）"""
+        try:
+            db = get_database()
+            if time_series_enabled():
+                # 時間序列模式：afk 為 time-series collection，索引由 ensure_indexes 建立
+                create_time_series_collections(db)
+            else:
+                if 'afk' not in db.list_collection_names():
+                    db.create_collection('afk')
+                    print("已創建 'afk' collection")
+                    
+                # 創建複合索引
+                db.afk.create_index([
+                    ("timestamp", 1),
+                    ("username", 1),
+                    ("date", 1),
+                    ("status", 1)
+                ], name="activity_tracking_index")
+            # print("已成功連接到 MongoDB 並創建索引")
+        except Exception as e:
+            print(f"無法連接到 MongoDB: {e}")
+            print("資料將保留在佇列中，待連線恢復後寫入")
+        
+    def _get_current_window(self):
+        """獲取當前活動視窗名稱"""
+        try:
+            if platform.system() == "Windows" and gw:
+                active_window = gw.getActiveWindow()
+                # 同一視窗標題每秒取樣一次，intern 後佇列中的記錄共用同一字串
+                return intern_label(active_window.title) if active_window else "Unknown"
+            else:
+                return "Unknown (非Windows系統)"
+        except Exception:
+            return "Unknown"
+    
+    def _save_to_mongodb(self, session_data):
+        """將會話數據存儲到 MongoDB"""
+        try:
+            # 添加時間戳用於排序和查詢
+            session_data['timestamp'] = datetime.datetime.now()
+            # username + date 為 shard key（見 database/sharding.py），所有會話都必須包含
+            session_data.setdefault('username', self.username)
+            if time_series_enabled():
+                session_data['meta'] = time_series_meta(self.username, self.workstation_name)
+            if self.labels is not None:
+                self.labels.encode_document(self.db, 'afk', session_data)
+            # 插入數據到 MongoDB（經由寫入佇列）
+            self.db.afk.insert_one(session_data)
+        except Exception as e:
+            print(f"保存數據到 MongoDB 時出錯: {e}")
+    
+    def _update_presence(self, state=None):
+        """更新 presence 集合中此使用者的目前狀態（每次狀態轉換與心跳時呼叫）"""
+        try:
+            self.db.presence.update_one(
+                {'user_name': self.username},
+                {'$set': {
+                    'workstation_name': self.workstation_name,
+                    'state': state or ('afk' if self.is_afk else 'work'),
+                    'window': self.current_window,
+                    'since': self.state_since,
+                    'last_seen': datetime.datetime.now(),
+                    # API 依心跳間隔判斷資料是否過期
+                    'heartbeat_interval': self.metrics.sample_interval
+                }},
+                upsert=True
+            )
+        except Exception as e:
+            print(f"更新 presence 時出錯: {e}")
+    
+    def _update_interval(self):
+        """延伸目前的 work/afk 區間，狀態改變時開始新區間"""
+        self.intervals.update(self.db, 'afk' if self.is_afk else 'work', self.current_window)
+    
+    def on_activity(self):
+        """當檢測到活動時呼叫"""
+        current_time = time.time()
+        self.last_activity_time = current_time
+        
+        # 檢查活動狀態是否從AFK變為非AFK
+        if self.is_afk:
+            self.is_afk = False
+            afk_end_time = datetime.datetime.now()
+            afk_duration = current_time - self.afk_start_time
+            
+            # 記錄AFK會話
+            session_data = {
+                'date': date_string(),
+                'username': self.username,
+                'window': self.current_window,
+                'type': 'afk',
+                'start_time': format_timestamp_clock(self.afk_start_time),
+                'end_time': format_clock(afk_end_time),
+                'duration': self._format_duration(afk_duration)
+            }
+            
+            self.sessions.append('afk', self.current_window, self.afk_start_time, current_time)
+            # 保存到 MongoDB
+            self._save_to_mongodb(session_data)
+            
+            # 開始新的工作會話
+            self.work_start_time = current_time
+            self.current_window = self._get_current_window()
+            self.state_since = afk_end_time
+            self._update_presence()
+            self._update_interval()
+    
+    def on_mouse_move(self, x, y):
+        self.on_activity()
+    
+    def on_mouse_click(self, x, y, button, pressed):
+        if pressed:  # 僅在按下時觸發，而不是釋放時
+            self.on_activity()
+    
+    def on_mouse_scroll(self, x, y, dx, dy):
+        self.on_activity()
+    
+    def on_key_press(self, key):
+        self.on_activity()
+    
+    def check_afk_status(self):
+        """檢查使用者是否已離開(AFK)"""
+        while self.running:
+            loop_started = time.perf_counter()
+            interval = self.metrics.sample_interval
+            current_time = time.time()
+            idle_duration = current_time - self.last_activity_time
+            current_window = self._get_current_window()
+            
+            # 每秒記錄一次活動狀態
+            if not self.is_afk:  # 如果用戶不是AFK狀態
+                interim_end_time = datetime.datetime.now()
+                interim_duration = int(interval)  # 與檢查間隔一致
+                
+                session_data = {
+                    'date': date_string(),
+                    'username': self.username,
+                    'user_name': self.username,
+                    'window': self.current_window,
+                    'type': 'work',
+                    'status': 'Work',
+                    'start_time': format_timestamp_clock(current_time - interim_duration),
+                    'end_time': format_clock(interim_end_time),
+                    'duration': self._format_duration(interim_duration),
+                    'is_heartbeat': True
+                }
+                
+                # 保存到 MongoDB
+                self._save_to_mongodb(session_data)
+            
+            # 檢查是否已閒置超過閾值
+            if not self.is_afk and idle_duration >= self.idle_time:
+                self.is_afk = True
+                self.afk_start_time = current_time
+                self.state_since = datetime.datetime.fromtimestamp(current_time)
+                
+                # 記錄開始AFK狀態
+                session_data = {
+                    'date': date_string(),
+                    'username': self.username,
+                    'user_name': self.username,
+                    'window': self.current_window,
+                    'type': 'afk',
+                    'status': 'AFK',
+                    'start_time': format_timestamp_clock(current_time),
+                    'end_time': format_timestamp_clock(current_time + 1),
+                    'duration': self._format_duration(1),
+                    'is_heartbeat': True
+                }
+                
+                self._save_to_mongodb(session_data)
+            elif self.is_afk:  # 如果用戶處於AFK狀態
+                # 每秒記錄AFK狀態
+                session_data = {
+                    'date': date_string(),
+                    'username': self.username,
+                    'user_name': self.username,
+                    'window': self.current_window,
+                    'type': 'afk',
+                    'status': 'AFK',
+                    'start_time': format_timestamp_clock(current_time),
+                    'end_time': format_timestamp_clock(current_time + 1),
+                    'duration': self._format_duration(1),
+                    'is_heartbeat': True
+                }
+                
+                self._save_to_mongodb(session_data)
+            
+            self._update_presence()
+            self._update_interval()
+            self.metrics.record_loop(time.perf_counter() - loop_started)
+            time.sleep(interval)  # 預設每5秒檢查一次，超出資源預算時自動延長
+    
+    def start(self):
+        """開始監控使用者活動"""
+        if self.running:
+            return
+            
+        self.running = True
+        
+        # 啟動鍵盤和滑鼠監聽器
+        self.mouse_listener = mouse.Listener(
+            on_move=self.on_mouse_move,
+            on_click=self.on_mouse_click,
+            on_scroll=self.on_mouse_scroll
+        )
+        self.keyboard_listener = keyboard.Listener(on_press=self.on_key_press)
+        
+        self.mouse_listener.start()
+        self.keyboard_listener.start()
+        
+        # 啟動監控線程
+        self.monitor_thread = threading.Thread(target=self.check_afk_status)
+        self.monitor_thread.daemon = True
+        self.monitor_thread.start()
+        
+        if self.ingest is None:
+            threading.Thread(target=self._prepare_database, name='AFKTracker-prepare', daemon=True).start()
+        self.metrics.start_reporter(lambda: self.db, self.username)
+        
+        # print(f"活動監控已啟動。閒置{self.idle_time}秒後將判定為AFK。")
+    
+    def stop(self):
+        """停止監控使用者活動"""
+        if not self.running:
+            return
+            
+        self.running = False
+        
+        # 停止監聽器
+        if self.mouse_listener:
+            self.mouse_listener.stop()
+        if self.keyboard_listener:
+            self.keyboard_listener.stop()
+        
+        # 記錄最後一個會話
+        current_time = time.time()
+        end_time = datetime.datetime.now()
+        
+        if self.is_afk:
+            # 記錄AFK會話
+            afk_duration = current_time - self.afk_start_time
+            session_data = {
+                'date': date_string(),
+                'username': self.username,
+                'window': self.current_window,
+                'type': 'afk',
+                'start_time': format_timestamp_clock(self.afk_start_time),
+                'end_time': format_clock(end_time),
+                'duration': self._format_duration(afk_duration)
+            }
+            
+            self.sessions.append('afk', self.current_window, self.afk_start_time, current_time)
+            # 保存到 MongoDB
+            self._save_to_mongodb(session_data)
+        else:
+            # 記錄工作會話
+            work_duration = current_time - self.work_start_time
+            session_data = {
+                'date': date_string(),
+                'username': self.username,
+                'window': self.current_window,
+                'type': 'work',
+                'start_time': format_timestamp_clock(self.work_start_time),
+                'end_time': format_clock(end_time),
+                'duration': self._format_duration(work_duration)
+            }
+            
+            self.sessions.append('work', self.current_window, self.work_start_time, current_time)
+            # 保存到 MongoDB
+            self._save_to_mongodb(session_data)
+        
+        # 正常結束時立即標示離線，異常結束則由 API 依 last_seen 判斷
+        self.state_since = end_time
+        self._update_presence('offline')
+        self.intervals.close(self.db)
+        self.db.close()
+        
+        print("活動監控已停止。")
+    
+    def get_sessions(self):
+        """獲取最近記錄的會話（數量與時間受 SessionHistory 上限限制）"""
+        return self.sessions.to_dicts()
+    
+    def is_user_afk(self):
+        """檢查使用者目前是否離開"""
+        return self.is_afk
+
+    def _format_duration(self, seconds):
+        """將秒數轉換為 HH:MM:SS 格式字串"""
+        return format_duration(seconds)
+
+
+# 使用示例
+if __name__ == "__main__":
+    # 建立活動監控器，設定閒置時間為60秒
+    monitor = AFK()
+    try:
+        monitor.start()
+        while True:
+            time.sleep(60)
+            # print(f"目前狀態: {'AFK' if monitor.is_user_afk() else '工作中'}")
+    except KeyboardInterrupt:
+        monitor.stop()
+        # print("\n會話記錄:")
+        # for session in monitor.get_sessions():
             # print(f"{session['type'].upper()}: {session['start_time']} - {session['end_time']} ({session['duration']}秒) - {session['window']}")
\ No newline at end of file
@@ -0,0 +1,235 @@
+import os
+import time
+import json
+import socket
+import threading
+import datetime
+from contextlib import contextmanager
+
+from time_codec import date_string
+
+try:
+    import psutil
+except ImportError:
+    # psutil 不一定存在（例如 AFK 代理的精簡打包），退回到標準庫
+    psutil = None
+
+
+def _env_float(name, default):
+    """Read a float setting from the environment, falling back to the default"""
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return float(default)
+
+
+class AgentMetrics:
+    """
+    代理程式自身資源使用統計
+
+    Tracks CPU time, RSS, loop latency, queue depth, DB write latency and failed
+    writes for a capture agent, and adaptively lengthens the sampling interval
+    when the agent exceeds its configured budget.
+
+    Budgets are configured through environment variables:
+        AGENT_CPU_BUDGET_PERCENT  - max average CPU usage (default 2%)
+        AGENT_RSS_BUDGET_MB       - max resident memory (default 150MB)
+        AGENT_MAX_INTERVAL        - upper bound for the sampling interval (default 60s)
+        AGENT_METRICS_INTERVAL    - seconds between budget checks / agent_metrics documents (default 60s)
+        AGENT_STATUS_PORT         - if set, serve the snapshot on http://127.0.0.1:<port>/status
+    """
+
+    def __init__(self, agent_name, base_interval=1.0):
+        self.agent_name = agent_name
+        self.base_interval = float(base_interval)
+        self.sample_interval = float(base_interval)
+
+        self.cpu_budget_percent = _env_float('AGENT_CPU_BUDGET_PERCENT', 2.0)
+        self.rss_budget_mb = _env_float('AGENT_RSS_BUDGET_MB', 150.0)
+        self.max_interval = max(_env_float('AGENT_MAX_INTERVAL', 60.0), self.base_interval)
+        self.report_interval = _env_float('AGENT_METRICS_INTERVAL', 60.0)
+
+        self._lock = threading.Lock()
+        self._process = psutil.Process() if psutil else None
+        self._started = time.time()
+        self._last_check_wall = time.monotonic()
+        self._last_check_cpu = self._cpu_seconds()
+
+        self.loop_count = 0
+        self.loop_latency_last = 0.0
+        self.loop_latency_max = 0.0
+        self.loop_latency_total = 0.0
+        self.queue_depth = 0
+        self.write_count = 0
+        self.failed_writes = 0
+        self.write_latency_last = 0.0
+        self.write_latency_max = 0.0
+        self.write_latency_total = 0.0
+        self.cpu_percent = 0.0
+        self.over_budget = False
+
+        self._status_server = None
+
+    def _cpu_seconds(self):
+        if self._process is not None:
+            times = self._process.cpu_times()
+            return times.user + times.system
+        return time.process_time()
+
+    def _rss_mb(self):
+        if self._process is not None:
+            return self._process.memory_info().rss / (1024 * 1024)
+        try:
+            import resource
+            # ru_maxrss 在 Linux 上以 KB 為單位
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        except Exception:
+            return 0.0
+
+    def record_loop(self, elapsed):
+        """Record the duration (seconds) of one iteration of the agent's main loop"""
+        with self._lock:
+            self.loop_count += 1
+            self.loop_latency_last = elapsed
+            self.loop_latency_total += elapsed
+            if elapsed > self.loop_latency_max:
+                self.loop_latency_max = elapsed
+
+    @contextmanager
+    def track_write(self):
+        """Time one database write; exceptions are counted as failed writes and re-raised"""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            with self._lock:
+                self.failed_writes += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.write_count += 1
+                self.write_latency_last = elapsed
+                self.write_latency_total += elapsed
+                if elapsed > self.write_latency_max:
+                    self.write_latency_max = elapsed
+
+    def set_queue_depth(self, depth):
+        self.queue_depth = int(depth)
+
+    def check_budget(self):
+        """
+        Recompute CPU usage since the last check and adapt the sampling interval.
+
+        Over budget: the interval doubles (up to AGENT_MAX_INTERVAL).
+        Well under budget: the interval halves back towards the base interval.
+        """
+        now_wall = time.monotonic()
+        now_cpu = self._cpu_seconds()
+        wall_delta = now_wall - self._last_check_wall
+        if wall_delta > 0:
+            self.cpu_percent = (now_cpu - self._last_check_cpu) / wall_delta * 100
+        self._last_check_wall = now_wall
+        self._last_check_cpu = now_cpu
+
+        rss_mb = self._rss_mb()
+        self.over_budget = (
+            self.cpu_percent > self.cpu_budget_percent or
+            (self.rss_budget_mb > 0 and rss_mb > self.rss_budget_mb)
+        )
+
+        if self.over_budget:
+            self.sample_interval = min(self.sample_interval * 2, self.max_interval)
+        elif self.cpu_percent < self.cpu_budget_percent / 2:
+            self.sample_interval = max(self.sample_interval / 2, self.base_interval)
+        return self.sample_interval
+
+    def snapshot(self):
+        """Return the current metrics as a plain dict"""
+        with self._lock:
+            loops = self.loop_count or 1
+            writes = self.write_count or 1
+            return {
+                'agent': self.agent_name,
+                'workstation_name': os.environ.get('COMPUTERNAME', socket.gethostname()),
+                'uptime_seconds': round(time.time() - self._started, 1),
+                'cpu_time_seconds': round(self._cpu_seconds(), 3),
+                'cpu_percent': round(self.cpu_percent, 2),
+                'rss_mb': round(self._rss_mb(), 2),
+                'loop_count': self.loop_count,
+                'loop_latency_last_ms': round(self.loop_latency_last * 1000, 2),
+                'loop_latency_avg_ms': round(self.loop_latency_total / loops * 1000, 2),
+                'loop_latency_max_ms': round(self.loop_latency_max * 1000, 2),
+                'queue_depth': self.queue_depth,
+                'write_count': self.write_count,
+                'failed_writes': self.failed_writes,
+                'write_latency_last_ms': round(self.write_latency_last * 1000, 2),
+                'write_latency_avg_ms': round(self.write_latency_total / writes * 1000, 2),
+                'write_latency_max_ms': round(self.write_latency_max * 1000, 2),
+                'sample_interval': self.sample_interval,
+                'over_budget': self.over_budget,
+                'cpu_budget_percent': self.cpu_budget_percent,
+                'rss_budget_mb': self.rss_budget_mb,
+            }
+
+    def report(self, db, user_name=None):
+        """Check the budget and write one agent_metrics document"""
+        self.check_budget()
+        doc = self.snapshot()
+        doc['user_name'] = user_name
+        doc['date'] = date_string()
+        doc['timestamp'] = datetime.datetime.now()
+        try:
+            db.agent_metrics.insert_one(doc)
+        except Exception as e:
+            print(f"Error writing agent metrics: {e}")
+
+    def start_reporter(self, get_db, user_name=None):
+        """
+        Start a daemon thread that reports every AGENT_METRICS_INTERVAL seconds,
+        and the local status endpoint if AGENT_STATUS_PORT is set.
+        """
+        def _run():
+            while True:
+                time.sleep(self.report_interval)
+                try:
+                    self.report(get_db(), user_name)
+                except Exception as e:
+                    print(f"Agent metrics reporter error: {e}")
+
+        thread = threading.Thread(target=_run, name=f"{self.agent_name}-metrics", daemon=True)
+        thread.start()
+
+        port = os.environ.get('AGENT_STATUS_PORT')
+        if port:
+            self.start_status_server(int(port))
+        return thread
+
+    def start_status_server(self, port):
+        """Serve the metrics snapshot as JSON on 127.0.0.1 only"""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics = self
+
+        class _StatusHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip('/') not in ('', '/status'):
+                    self.send_error(404)
+                    return
+                body = json.dumps(metrics.snapshot()).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self._status_server = ThreadingHTTPServer(('127.0.0.1', port), _StatusHandler)
+        except OSError as e:
+            print(f"Unable to start agent status endpoint on port {port}: {e}")
+            return None
+        threading.Thread(target=self._status_server.serve_forever, daemon=True).start()
+        return self._status_server
@@ -0,0 +1,168 @@
+"""
+Compact in-memory session state for the desktop agents.
+
+The agents run for weeks, so everything they keep in memory is bounded:
+
+    SessionHistory  recent AFK / work sessions (AFK.sessions), a ring buffer
+                    capped by count and by age
+    AppUsageTable   today's accumulated foreground time per application
+                    (app_usage_times in Monitoring Script.py), reset at the
+                    day change and capped at a number of applications
+
+Records use ``__slots__`` and store times as float timestamps; window, app
+and path strings are interned, so the same title sampled every second is
+held once instead of once per record. Limits are configured through
+environment variables, like the budgets in agent_metrics.py:
+
+    AGENT_SESSION_HISTORY         - sessions kept in memory (default 500)
+    AGENT_SESSION_MAX_AGE_HOURS   - drop sessions older than this (default 24)
+    AGENT_MAX_TRACKED_APPS        - applications tracked per day (default 500)
+"""
+import sys
+import time
+from collections import deque, OrderedDict
+from datetime import datetime
+
+from agent_metrics import _env_float
+from time_codec import date_string, format_clock, format_timestamp_clock, format_duration
+
+
+def intern_label(value):
+    """Interned copy of a window / app / path string, so repeated samples share one object"""
+    return sys.intern(value) if type(value) is str else value
+
+
+class SessionRecord:
+    """One finished AFK or work session"""
+
+    __slots__ = ('kind', 'window', 'start', 'end')
+
+    def __init__(self, kind, window, start, end):
+        self.kind = intern_label(kind)
+        self.window = intern_label(window)
+        self.start = float(start)
+        self.end = float(end)
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    def to_dict(self):
+        """The record in the shape written to the afk collection"""
+        start = datetime.fromtimestamp(self.start)
+        return {
+            'date': date_string(start),
+            'type': self.kind,
+            'window': self.window,
+            'start_time': format_clock(start),
+            'end_time': format_timestamp_clock(self.end),
+            'duration': format_duration(self.duration),
+        }
+
+
+class SessionHistory:
+    """Ring buffer of recent sessions, capped by count and by age"""
+
+    def __init__(self, max_sessions=None, max_age_seconds=None):
+        if max_sessions is None:
+            max_sessions = int(_env_float('AGENT_SESSION_HISTORY', 500))
+        if max_age_seconds is None:
+            max_age_seconds = _env_float('AGENT_SESSION_MAX_AGE_HOURS', 24) * 3600
+        self.max_age_seconds = max_age_seconds
+        self._records = deque(maxlen=max(1, max_sessions))
+
+    def append(self, kind, window, start, end):
+        record = SessionRecord(kind, window, start, end)
+        self._records.append(record)
+        self.prune(record.end)
+        return record
+
+    def prune(self, now=None):
+        """Drop sessions that ended more than ``max_age_seconds`` ago"""
+        cutoff = (now or time.time()) - self.max_age_seconds
+        records = self._records
+        while records and records[0].end < cutoff:
+            records.popleft()
+
+    def __len__(self):
+        return len(self._records)
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def to_dicts(self):
+        return [record.to_dict() for record in self._records]
+
+
+class AppUsage:
+    """Accumulated foreground time of one application today"""
+
+    __slots__ = ('total_time', 'title', 'path')
+
+    def __init__(self, total_time, title, path):
+        self.total_time = total_time
+        self.title = intern_label(title)
+        self.path = intern_label(path)
+
+
+class AppUsageTable:
+    """
+    Today's ``AppUsage`` per application name. Starts empty on a new day and
+    keeps at most ``max_apps`` entries, evicting the least recently used.
+    """
+
+    def __init__(self, max_apps=None):
+        if max_apps is None:
+            max_apps = int(_env_float('AGENT_MAX_TRACKED_APPS', 500))
+        self.max_apps = max(1, max_apps)
+        self.date = date_string()
+        self._apps = OrderedDict()
+
+    def roll(self, today=None, keep=None):
+        """
+        Start a new day if the date changed. ``keep`` (the active application)
+        stays tracked, counting from zero, so its usage continues to be logged.
+        """
+        today = today or date_string()
+        if today == self.date:
+            return False
+        current = self._apps.get(keep)
+        self._apps.clear()
+        self.date = today
+        if current is not None:
+            self.add(keep, current.title, current.path)
+        return True
+
+    def add(self, name, title, path, total_time=0.0):
+        """Track ``name`` if it is not tracked yet; returns its entry"""
+        usage = self._apps.get(name)
+        if usage is None:
+            usage = self._apps[intern_label(name)] = AppUsage(total_time, title, path)
+            while len(self._apps) > self.max_apps:
+                self._apps.popitem(last=False)
+        else:
+            self._apps.move_to_end(name)
+        return usage
+
+    def merge(self, existing):
+        """
+        Add usage stored before the agent started ({app_name: {'total_time',
+        'title', 'path'}}, see load_existing_app_usage) to what was counted since.
+        """
+        for name, stored in existing.items():
+            usage = self._apps.get(name)
+            if usage is None:
+                self.add(name, stored['title'], stored['path'], stored['total_time'])
+            else:
+                usage.total_time += stored['total_time']
+
+    def __contains__(self, name):
+        return name in self._apps
+
+    def __getitem__(self, name):
+        usage = self._apps[name]
+        self._apps.move_to_end(name)
+        return usage
+
+    def __len__(self):
+        return len(self._apps)
@@ -0,0 +1,361 @@
+import time
+import threading
+from collections import defaultdict
+
+try:
+    from pymongo import monitoring
+except ImportError:
+    monitoring = None
+
+
+# 預設直方圖區間（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 回應大小區間（位元組）
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+_local = threading.local()
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple((name, labels.get(name, '')) for name in self.label_names)
+
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def __init__(self, name, help_text, label_names=()):
+        super().__init__(name, help_text, label_names)
+        self._values = defaultdict(float)
+
+    def inc(self, amount=1, **labels):
+        with self._lock:
+            self._values[self._key(labels)] += amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0.0)
+
+    def collect(self):
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                yield f"{self.name}{_format_labels(key)} {_format_value(value)}"
+
+
+class Gauge(_Metric):
+    type_name = 'gauge'
+
+    def __init__(self, name, help_text, label_names=()):
+        super().__init__(name, help_text, label_names)
+        self._values = defaultdict(float)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        with self._lock:
+            self._values[self._key(labels)] += amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0.0)
+
+    def collect(self):
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                yield f"{self.name}{_format_labels(key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # key -> [bucket counts..., sum, count]
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def count(self, **labels):
+        state = self._values.get(self._key(labels))
+        return state[-1] if state else 0
+
+    def collect(self):
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                cumulative = 0
+                for i, bound in enumerate(self.buckets):
+                    cumulative += state[i]
+                    bucket_labels = key + (('le', _format_value(float(bound))),)
+                    yield f"{self.name}_bucket{_format_labels(bucket_labels)} {cumulative}"
+                yield f"{self.name}_sum{_format_labels(key)} {_format_value(float(state[-2]))}"
+                yield f"{self.name}_count{_format_labels(key)} {state[-1]}"
+
+
+class Registry:
+    """Minimal Prometheus text-format registry (no external dependency)"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, label_names=()):
+        return self.register(Counter(name, help_text, label_names))
+
+    def gauge(self, name, help_text, label_names=()):
+        return self.register(Gauge(name, help_text, label_names))
+
+    def histogram(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, label_names, buckets))
+
+    def exposition(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUEST_LATENCY = REGISTRY.histogram(
+    'api_request_duration_seconds', 'HTTP request latency by route',
+    ('route', 'method', 'status'))
+RESPONSE_SIZE = REGISTRY.histogram(
+    'api_response_size_bytes', 'HTTP response payload size by route',
+    ('route',), buckets=SIZE_BUCKETS)
+MONGO_LATENCY = REGISTRY.histogram(
+    'api_mongo_command_duration_seconds', 'MongoDB command time by endpoint, collection and command',
+    ('endpoint', 'collection', 'command'))
+MONGO_FAILURES = REGISTRY.counter(
+    'api_mongo_command_failures_total', 'Failed MongoDB commands by endpoint and command',
+    ('endpoint', 'collection', 'command'))
+ROWS_FETCHED = REGISTRY.counter(
+    'api_rows_fetched_total', 'Documents read from MongoDB by endpoint (rows scanned by the API)',
+    ('endpoint', 'collection'))
+ROWS_RETURNED = REGISTRY.counter(
+    'api_rows_returned_total', 'Rows returned to the client by endpoint',
+    ('endpoint',))
+CACHE_REQUESTS = REGISTRY.counter(
+    'api_cache_requests_total', 'Cache lookups by cache name and result (hit/miss)',
+    ('cache', 'result'))
+POOL_CHECKED_OUT = REGISTRY.gauge(
+    'api_mongo_pool_checked_out', 'Connections currently checked out of the MongoDB pool',
+    ('address',))
+POOL_OPEN = REGISTRY.gauge(
+    'api_mongo_pool_open', 'Open connections in the MongoDB pool',
+    ('address',))
+POOL_MAX_SIZE = REGISTRY.gauge(
+    'api_mongo_pool_max_size', 'Configured maxPoolSize of the MongoDB pool',
+    ('address',))
+
+
+def set_endpoint(endpoint):
+    """Attribute MongoDB commands issued by the current thread to an endpoint"""
+    _local.endpoint = endpoint
+
+
+def current_endpoint():
+    return getattr(_local, 'endpoint', None) or 'background'
+
+
+# 可被 explain 的讀取指令
+EXPLAINABLE_COMMANDS = ('find', 'aggregate', 'count', 'distinct')
+
+
+def capture_commands(target):
+    """
+    Collect (database, command) pairs for read commands issued by the current
+    thread into ``target`` (a list), or stop collecting when ``target`` is None
+    """
+    _local.captured = target
+
+
+def observe_request(route, method, status, duration, size=None):
+    REQUEST_LATENCY.observe(duration, route=route, method=method, status=status)
+    if size is not None:
+        RESPONSE_SIZE.observe(size, route=route)
+
+
+def observe_rows(endpoint, returned):
+    ROWS_RETURNED.inc(returned, endpoint=endpoint)
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+def _address(event):
+    address = getattr(event, 'address', None)
+    if address:
+        return f"{address[0]}:{address[1]}"
+    return 'unknown'
+
+
+def _batch_size(reply):
+    cursor = reply.get('cursor') if hasattr(reply, 'get') else None
+    if not cursor:
+        return 0
+    batch = cursor.get('firstBatch')
+    if batch is None:
+        batch = cursor.get('nextBatch', [])
+    return len(batch)
+
+
+if monitoring is not None:
+    class _CommandListener(monitoring.CommandListener):
+        """Times every MongoDB command and counts documents returned per endpoint"""
+
+        def __init__(self):
+            self._pending = {}
+            self._lock = threading.Lock()
+
+        def started(self, event):
+            command = event.command
+            collection = command.get(event.command_name)
+            if not isinstance(collection, str):
+                # getMore 的值是 cursor id，集合名稱在 'collection' 欄位
+                collection = command.get('collection', '')
+            with self._lock:
+                self._pending[event.request_id] = (current_endpoint(), collection)
+            captured = getattr(_local, 'captured', None)
+            if captured is not None and event.command_name in EXPLAINABLE_COMMANDS:
+                captured.append((event.database_name, dict(command)))
+
+        def _pop(self, event):
+            with self._lock:
+                return self._pending.pop(event.request_id, (current_endpoint(), ''))
+
+        def succeeded(self, event):
+            endpoint, collection = self._pop(event)
+            MONGO_LATENCY.observe(event.duration_micros / 1e6, endpoint=endpoint,
+                                  collection=collection, command=event.command_name)
+            fetched = _batch_size(event.reply)
+            if fetched:
+                ROWS_FETCHED.inc(fetched, endpoint=endpoint, collection=collection)
+
+        def failed(self, event):
+            endpoint, collection = self._pop(event)
+            MONGO_FAILURES.inc(endpoint=endpoint, collection=collection, command=event.command_name)
+
+    class _PoolListener(monitoring.ConnectionPoolListener):
+        """Tracks MongoDB connection pool utilization"""
+
+        def pool_created(self, event):
+            POOL_MAX_SIZE.set(event.options.get('maxPoolSize', 100), address=_address(event))
+
+        def pool_ready(self, event):
+            pass
+
+        def pool_cleared(self, event):
+            pass
+
+        def pool_closed(self, event):
+            POOL_OPEN.set(0, address=_address(event))
+            POOL_CHECKED_OUT.set(0, address=_address(event))
+
+        def connection_created(self, event):
+            POOL_OPEN.inc(address=_address(event))
+
+        def connection_ready(self, event):
+            pass
+
+        def connection_closed(self, event):
+            POOL_OPEN.dec(address=_address(event))
+
+        def connection_check_out_started(self, event):
+            pass
+
+        def connection_check_out_failed(self, event):
+            pass
+
+        def connection_checked_out(self, event):
+            POOL_CHECKED_OUT.inc(address=_address(event))
+
+        def connection_checked_in(self, event):
+            POOL_CHECKED_OUT.dec(address=_address(event))
+
+
+_listeners_installed = False
+
+
+def install_mongo_listeners():
+    """Register the command and pool listeners; must run before MongoClient is created"""
+    global _listeners_installed
+    if _listeners_installed or monitoring is None:
+        return
+    monitoring.register(_CommandListener())
+    monitoring.register(_PoolListener())
+    _listeners_installed = True
+
+
+def init_flask_metrics(app):
+    """Record per-route latency/payload size and expose GET /metrics"""
+    from flask import request, g, Response
+
+    @app.before_request
+    def _metrics_start():
+        g._metrics_start = time.perf_counter()
+        set_endpoint(request.url_rule.rule if request.url_rule else 'unmatched')
+
+    @app.after_request
+    def _metrics_record(response):
+        start = getattr(g, '_metrics_start', None)
+        if start is not None and request.path != '/metrics':
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            size = None if response.direct_passthrough else response.calculate_content_length()
+            observe_request(route, request.method, response.status_code,
+                            time.perf_counter() - start, size)
+        return response
+
+    @app.teardown_request
+    def _metrics_clear(exception=None):
+        set_endpoint(None)
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(REGISTRY.exposition(), mimetype='text/plain; version=0.0.4')
+
+    return app
@@ -1,755 +1,1328 @@
-import os
-import sys
-import time
-
-# Add single instance check at the very beginning
-# try:
-#     from single_instance import SingleInstance
-#     instance = SingleInstance("ActivityTrackerAPI")
-# except ImportError:
-#     # If import fails, continue running (development environment fallback)
-#     pass
-
-from flask import Flask, render_template, jsonify, request, session
-from flask_cors import CORS
-from functools import wraps
-import hashlib
-from datetime import timedelta
-import pandas as pd
-import os
-from datetime import datetime
-import logging
-from contextlib import contextmanager
-from database.mongo_config import get_database
-from bson import ObjectId
-from logger_config import setup_logger
-from config import CONFIG
-
-# 設置記錄器
-logger = setup_logger('ActivityTrackerAPI')
-
-# 記錄啟動信息
-logger.info('API Service starting...')
-logger.info(f'User: {os.environ.get("USERNAME")}')
-logger.info(f'Computer name: {os.environ.get("COMPUTERNAME")}')
-
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
-
-# 添加一個函數用於獲取應用程序根目錄
-def get_app_root():
-    """獲取應用程序根目錄，處理打包和非打包情況"""
-    if getattr(sys, 'frozen', False):
-        # 打包後的可執行文件路徑
-        return os.path.dirname(sys.executable)
-    else:
-        # 開發環境
-        return os.path.dirname(os.path.abspath(__file__))
-
-# 修改 ensure_data_directory 函數
-def ensure_data_directory():
-    data_dir = os.path.join(get_app_root(), 'data')
-    if not os.path.exists(data_dir):
-        os.makedirs(data_dir)
-    return data_dir
-
-def format_timedelta(td):
-    if pd.isnull(td):
-        return '00:00:00'
-    seconds = int(td.total_seconds())
-    hours = seconds // 3600
-    minutes = (seconds % 3600) // 60
-    seconds = seconds % 60
-    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-
-
-def login_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
-        # if 'user name' not in session:
-            return jsonify({"error": "Authentication required"}), 401
-        return f(*args, **kwargs)
-    return decorated_function
-
-app = Flask(__name__)
-CORS(app, 
-     supports_credentials=CONFIG['CORS']['SUPPORTS_CREDENTIALS'],
-     origins=CONFIG['CORS']['ORIGINS'],
-     allow_headers=CONFIG['CORS']['ALLOW_HEADERS'],
-     methods=CONFIG['CORS']['METHODS'],
-     expose_headers=CONFIG['CORS']['EXPOSE_HEADERS'])
-
-app.secret_key = CONFIG['SECRET_KEY']
-app.permanent_session_lifetime = timedelta(days=CONFIG['SESSION_LIFETIME_DAYS'])
-
-# Add this after the app initialization but before any routes
-def init_app():
-    """初始化應用，連接 MongoDB 並執行清理工作"""
-    logger.info("開始應用程序初始化...")
-    try:
-        # 嘗試連接 MongoDB 並在打包環境中提供更明確的錯誤消息
-        try:
-            db = get_database()
-            # 簡單測試連接
-            db.command('ping')
-            logger.info("MongoDB 連接成功初始化")
-            if getattr(sys, 'frozen', False):
-                print("MongoDB 連接正常")
-        except Exception as db_err:
-            error_msg = f"MongoDB 連接錯誤: {str(db_err)}"
-            logger.error(error_msg)
-            if getattr(sys, 'frozen', False):
-                print(f"警告: {error_msg}")
-                print("請確保 MongoDB 服務正在運行")
-                print("應用程序將嘗試繼續運行，但可能會出現數據問題")
-                time.sleep(2)  # 給用戶時間閱讀警告
-        
-        # 執行 Excel 文件清理
-        try:
-            deleted_count, deleted_files = cleanup_excel_files()
-            if deleted_count > 0:
-                logger.info(f"啟動清理: 移除了 {deleted_count} 個舊 Excel 文件")
-                logger.info(f"已刪除文件: {', '.join(deleted_files)}")
-            else:
-                logger.info("啟動時無需清理 Excel 文件")
-        except Exception as cleanup_err:
-            logger.error(f"Excel 清理錯誤: {str(cleanup_err)}")
-    except Exception as e:
-        logger.error(f"啟動過程中出錯: {str(e)}")
-
-@app.route('/api/register', methods=['POST'])
-def register():
-    try:
-        data = request.get_json()
-        username = data.get('username')
-        password = data.get('password')
-        
-        if not username or not password:
-            return jsonify({"error": "Username and password required"}), 400
-            
-        password_hash = hashlib.sha256(password.encode()).hexdigest()
-        
-        # Use MongoDB instead of SQLite
-        db = get_database()
-        try:
-            db.users.insert_one({
-                'username': username,
-                'password_hash': password_hash,
-                'created_at': datetime.now()
-            })
-            return jsonify({"message": "User registered successfully"}), 201
-        except Exception as e:
-            if 'duplicate key error' in str(e):
-                return jsonify({"error": "Username already exists"}), 409
-            raise
-                
-    except Exception as e:
-        logger.error(f"Registration error: {str(e)}")
-        return jsonify({"error": "Registration failed"}), 500
-
-# Initialize MongoDB connection
-db = get_database()
-
-@app.route('/api/login', methods=['POST'])
-def login():
-    try:
-        data = request.get_json()
-        username = data.get('username')
-        password = data.get('password')
-        
-        if not username or not password:
-            return jsonify({"error": "Username and password required"}), 400
-            
-        password_hash = hashlib.sha256(password.encode()).hexdigest()
-        
-        # Find user in MongoDB
-        user = db.users.find_one({
-            'username': username,
-            'password_hash': password_hash
-        })
-        
-        if user:
-            session.permanent = True
-            session['user_id'] = str(user['_id'])
-            session['username'] = user['username']
-            return jsonify({
-                "message": "Login successful",
-                "user": {"id": str(user['_id']), "username": user['username']}
-            }), 200
-            
-        return jsonify({"error": "Invalid credentials"}), 401
-        
-    except Exception as e:
-        logger.error(f"Login error: {str(e)}")
-        return jsonify({"error": "Login failed"}), 500
-
-@app.route('/api/logout', methods=['POST'])
-def logout():
-    session.clear()
-    return jsonify({"message": "Logged out successfully"}), 200
-
-@app.route('/api/activities')
-# @login_required
-def get_data():
-    try:
-        # 從請求參數獲取日期範圍，默認為當天
-        start_date = request.args.get('start_date')
-        end_date = request.args.get('end_date')
-        
-        # 如果沒有提供日期參數，默認只返回當天記錄
-        if not start_date:
-            start_date = datetime.now().strftime('%Y-%m-%d')
-        if not end_date:
-            end_date = datetime.now().strftime('%Y-%m-%d')
-            
-        logger.info(f"Fetching activities from {start_date} to {end_date}")
-        
-        # 查詢 MongoDB 獲取指定日期範圍的活動記錄
-        activities = list(db.activities.find({
-            'date': {
-                '$gte': start_date,
-                '$lte': end_date
-            }
-        }))
-        
-        # 轉換 ObjectId 為字串以便 JSON 序列化
-        for activity in activities:
-            activity['_id'] = str(activity['_id'])
-        
-        # 對記錄進行預排序，按照創建時間降序，以便後面處理時最新的記錄會覆蓋舊的
-        activities.sort(key=lambda x: (
-            x['date'],
-            x.get('user_name', ''),
-            x.get('app_name', ''),
-            x.get('app_start_time', ''),
-            x.get('created_at', '')
-        ), reverse=True)  # 降序排序，最新的記錄在前
-        
-        # 合併相同應用程序的記錄，保留具有最大 logoff_time 的記錄
-        merged_activities = {}
-        for activity in activities:
-            # 創建唯一鍵，用於識別相同的活動記錄
-            key = (
-                activity.get('date', ''),
-                activity.get('user_name', ''),
-                activity['workstation_name'],  # 改為直接訪問 workstation_name
-                activity.get('app_name', ''),
-                activity.get('logon_time', '') or activity.get('app_start_time', '')  # 優先使用 logon_time
-            )
-            
-            # 如果鍵不存在或當前記錄的 logoff_time 更大，則更新
-            current_logoff = activity.get('logoff_time', '')
-            if key not in merged_activities or (current_logoff and current_logoff > merged_activities[key].get('logoff_time', '')):
-                merged_activities[key] = activity
-        
-        # 將字典轉換回列表
-        unique_activities = list(merged_activities.values())
-        
-        # 重新計算每個活動的 total_time
-        for activity in unique_activities:
-            logon_time = activity.get('logon_time', '') or activity.get('app_start_time', '')
-            logoff_time = activity.get('logoff_time', '')
-            
-            if logon_time and logoff_time:
-                try:
-                    # 嘗試提取完整的日期時間格式
-                    if ' ' in logon_time and ' ' in logoff_time:
-                        # 完整格式: '2025-02-28 17:24:56'
-                        logon_dt = datetime.strptime(logon_time, '%Y-%m-%d %H:%M:%S')
-                        logoff_dt = datetime.strptime(logoff_time, '%Y-%m-%d %H:%M:%S')
-                    else:
-                        # 只有時間格式: 'HH:MM:SS'
-                        logon_dt = datetime.strptime(logon_time, '%H:%M:%S')
-                        logoff_dt = datetime.strptime(logoff_time, '%H:%M:%S')
-                        
-                        # 處理跨日的情況（如果結束時間小於開始時間，視為下一天）
-                        if logoff_dt < logon_dt:
-                            logoff_dt = logoff_dt + timedelta(days=1)
-                    
-                    # 計算時間差
-                    time_diff = logoff_dt - logon_dt
-                    
-                    # 格式化為 HH:MM:SS
-                    hours, remainder = divmod(time_diff.seconds, 3600)
-                    minutes, seconds = divmod(remainder, 60)
-                    activity['total_time'] = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-                    
-                    # 添加調試日誌
-                    logger.debug(f"計算 total_time: {activity['total_time']} (logon: {logon_time}, logoff: {logoff_time})")
-                    
-                except ValueError as e:
-                    logger.warning(f"無法計算 total_time: {str(e)} - logon: {logon_time}, logoff: {logoff_time}")
-                    activity['total_time'] = activity.get('total_time', '00:00:00')
-            else:
-                activity['total_time'] = activity.get('total_time', '00:00:00')
-        
-        # 計算使用時間摘要 - 按用戶、日期和應用程式分組
-        usage_time_summary = []
-        
-        # 建立按用戶、日期、應用程式分組的時間統計
-        usage_time_dict = {}
-        for activity in unique_activities:
-            key = (
-                activity.get('date', ''),
-                activity.get('user_name', ''),
-                activity.get('app_name', '')
-            )
-            
-            try:
-                # 解析時間字串並轉換為秒數
-                time_parts = activity.get('total_time', '00:00:00').split(':')
-                total_seconds = int(time_parts[0]) * 3600 + int(time_parts[1]) * 60 + int(time_parts[2])
-                
-                if key not in usage_time_dict:
-                    usage_time_dict[key] = {
-                        'date': activity.get('date', ''),
-                        'user_name': activity.get('user_name', ''),
-                        'app_name': activity.get('app_name', ''),
-                        'total_seconds': total_seconds,
-                        'session_count': 1
-                    }
-                else:
-                    usage_time_dict[key]['total_seconds'] += total_seconds
-                    usage_time_dict[key]['session_count'] += 1
-            except (ValueError, IndexError) as e:
-                logger.warning(f"解析時間出錯: {str(e)} - {activity.get('total_time')}")
-        
-        # 轉換為列表並格式化總時間
-        for stats in usage_time_dict.values():
-            hours, remainder = divmod(stats['total_seconds'], 3600)
-            minutes, seconds = divmod(remainder, 60)
-            stats['total_time'] = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-            del stats['total_seconds']  # 移除不需要的欄位
-            usage_time_summary.append(stats)
-        
-        # 按日期和使用時間排序
-        usage_time_summary.sort(key=lambda x: (x['date'], x['user_name'], x['total_time']), reverse=True)
-        
-        logger.info(f"生成了 {len(usage_time_summary)} 個使用時間摘要記錄")
-        
-        # 返回結果時使用實際查詢的日期範圍
-        return jsonify({
-            'total_records': len(unique_activities),
-            'activities': unique_activities,
-            'usagetime': usage_time_summary,
-            'date_range': {
-                'from': start_date,
-                'to': end_date
-            }
-        })
-        
-    except Exception as e:
-        logger.error(f"Error fetching activities: {str(e)}")
-        return jsonify({
-            'error': str(e),
-            'type': type(e).__name__
-        }), 500
-
-@app.route('/api/usage')
-# login_required  
-def get_app_usage_stats():
-    try:
-        all_stats = []
-        three_days_ago = (datetime.now() - timedelta(days=3)).strftime('%Y-%m-%d')
-        
-        try:
-            db = get_database()
-            pipeline = [
-                {
-                    '$match': {
-                        'date': {'$gte': three_days_ago}
-                    }
-                },
-                {
-                    '$group': {
-                        '_id': {
-                            'user_name': '$user_name',
-                            'app_name': '$app_name',
-                            'date': '$date'
-                        },
-                        'usage_count': {'$sum': 1},
-                        # 計算時間字串轉換為秒數
-                        'total_seconds': {
-                            '$sum': {
-                                '$function': {
-                                    'body': '''function(time) {
-                                        if (!time) return 0;
-                                        const parts = time.split(':');
-                                        if (parts.length !== 3) return 0;
-                                        
-                                        // 安全轉換為數字
-                                        const hours = parseInt(parts[0]) || 0;
-                                        const minutes = parseInt(parts[1]) || 0;
-                                        const seconds = parseInt(parts[2]) || 0;
-                                        
-                                        // 驗證時間合理性（不超過24小時）
-                                        if (hours > 24 || minutes > 59 || seconds > 59) {
-                                            return 0;
-                                        }
-                                        
-                                        return (hours * 3600) + (minutes * 60) + seconds;
-                                    }''',
-                                    'args': ['$total_time'],
-                                    'lang': 'js'
-                                }
-                            }
-                        },
-                        'max_seconds': {
-                            '$max': {
-                                '$function': {
-                                    'body': '''function(time) {
-                                        if (!time) return 0;
-                                        const parts = time.split(':');
-                                        if (parts.length !== 3) return 0;
-                                        
-                                        // 安全轉換為數字
-                                        const hours = parseInt(parts[0]) || 0;
-                                        const minutes = parseInt(parts[1]) || 0;
-                                        const seconds = parseInt(parts[2]) || 0;
-                                        
-                                        // 驗證時間合理性（不超過24小時）
-                                        if (hours > 24 || minutes > 59 || seconds > 59) {
-                                            return 0;
-                                        }
-                                        
-                                        return (hours * 3600) + (minutes * 60) + seconds;
-                                    }''',
-                                    'args': ['$total_time'],
-                                    'lang': 'js'
-                                }
-                            }
-                        },
-                        'max_time': {'$max': '$total_time'}  # 保留最長單次使用時間
-                    }
-                },
-                {
-                    '$project': {
-                        '_id': 0,
-                        'user_name': '$_id.user_name',
-                        'app_name': '$_id.app_name',
-                        'date': '$_id.date',
-                        'usage_count': 1,
-                        'max_time': 1,
-                        'total_time': {
-                            '$function': {
-                                'body': '''function(seconds) {
-                                    // 限制合理範圍 - 一天最多24小時
-                                    seconds = Math.min(seconds, 86400);
-                                    
-                                    const hours = Math.floor(seconds / 3600);
-                                    const minutes = Math.floor((seconds % 3600) / 60);
-                                    const secs = seconds % 60;
-                                    return (hours < 10 ? '0' : '') + hours + ':' +
-                                           (minutes < 10 ? '0' : '') + minutes + ':' +
-                                           (secs < 10 ? '0' : '') + secs;
-                                }''',
-                                'args': ['$total_seconds'],
-                                'lang': 'js'
-                            }
-                        }
-                    }
-                },
-                {'$sort': {'date': -1, 'total_seconds': -1}}  # 改為按總使用時間排序
-            ]
-            
-            all_stats = list(db.activities.aggregate(pipeline))
-            logger.info(f"Retrieved {len(all_stats)} app usage statistics")
-            
-        except Exception as mongo_err:
-            logger.error(f"MongoDB stats error: {str(mongo_err)}")
-            return jsonify({'error': f"Database error: {str(mongo_err)}"}), 500
-            
-        return jsonify({
-            'total_records': len(all_stats),
-            'stats': all_stats,
-            'date_range': {
-                'from': three_days_ago,
-                'to': datetime.now().strftime('%Y-%m-%d')
-            }
-        })
-        
-    except Exception as e:
-        logger.error(f"Error getting usage stats: {str(e)}")
-        return jsonify({'error': str(e)}), 500
-
-from datetime import datetime, timedelta
-@app.route('/api/afk')
-def get_afk_stats():
-    try:
-        db = get_database()
-        # 取得查詢參數，預設為最近三天
-        days = request.args.get('days', default=7, type=int)
-        username = request.args.get('username')
-        
-        # 計算過濾日期
-        three_days_ago = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
-        
-        # 構建查詢條件
-        query = {'date': {'$gte': three_days_ago}}
-        if username:
-            query['username'] = username
-        
-        # 使用 MongoDB 排序功能
-        afk_records = list(db.afk.find(query).sort([
-            ("username", 1),
-            ("date", 1),
-            ("start_time", 1)
-        ]))
-        
-        if not afk_records:
-            return jsonify({
-                "error": "No data found",
-                "details": "No AFK statistics available"
-            }), 404
-
-        # 格式化記錄
-        formatted_stats = []
-        for record in afk_records:
-            formatted_stats.append({
-                'user_name': record['username'],
-                'Status': record['type'],
-                'date': record['date'],
-                'duration': record['duration'],
-                'window': record.get('window', 'Unknown'),
-                'start_time': record.get('start_time', ''),
-                'end_time': record.get('end_time', '')
-            })
-        
-        # 合併連續相同視窗的記錄
-        merged_stats = []
-        if formatted_stats:
-            current = formatted_stats[0]
-            
-            for i in range(1, len(formatted_stats)):
-                next_record = formatted_stats[i]
-                
-                # 檢查是否可以合併（相同使用者、狀態、視窗，且時間連續）
-                can_merge = (
-                    current['user_name'] == next_record['user_name'] and
-                    current['Status'] == next_record['Status'] and
-                    current['date'] == next_record['date'] and
-                    current['window'] == next_record['window'] and
-                    current['end_time'] == next_record['start_time']
-                )
-                
-                if can_merge:
-                    # 更新結束時間和持續時間
-                    current['end_time'] = next_record['end_time']
-                    
-                    # 重新計算合併後的持續時間
-                    try:
-                        start_dt = datetime.strptime(current['start_time'], '%H:%M:%S')
-                        end_dt = datetime.strptime(current['end_time'], '%H:%M:%S')
-                        
-                        # 處理跨日情況
-                        if end_dt < start_dt:
-                            end_dt += timedelta(days=1)
-                            
-                        duration_seconds = (end_dt - start_dt).total_seconds()
-                        hours, remainder = divmod(int(duration_seconds), 3600)
-                        minutes, seconds = divmod(remainder, 60)
-                        current['duration'] = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-                    except ValueError:
-                        logger.warning(f"無法計算合併記錄的持續時間: {current['start_time']} to {current['end_time']}")
-                else:
-                    # 無法合併，將當前記錄添加到結果中，開始新記錄
-                    merged_stats.append(current)
-                    current = next_record
-            
-            # 不要忘記最後一筆記錄
-            merged_stats.append(current)
-        
-        logger.info(f"Retrieved {len(afk_records)} AFK records, consolidated to {len(merged_stats)} records")
-        
-        return jsonify({
-            'total_records': len(merged_stats),
-            'afk_stats': merged_stats,
-            'date_range': {
-                'from': three_days_ago,
-                'to': datetime.now().strftime('%Y-%m-%d')
-            }
-        })
-
-    except Exception as e:
-        logger.error(f"Error processing AFK statistics: {str(e)}")
-        return jsonify({
-            'error': str(e),
-            'type': type(e).__name__,
-            'details': 'Error processing AFK statistics'
-        }), 500
-
-@app.route('/api/afk/summary')
-def get_afk_summary():
-    try:
-        db = get_database()
-        three_days_ago = (datetime.now() - timedelta(days=3)).strftime('%Y-%m-%d')
-        
-        # 獲取用戶名篩選（可選）
-        username = request.args.get('username')
-        
-        # 構建匹配條件 
-        match_criteria = {
-            'date': {'$gte': three_days_ago},
-            'is_heartbeat': {'$ne': True}  # 排除心跳資料
-        }
-        
-        if username:
-            match_criteria['username'] = username
-            
-        # 用聚合管道分析每位使用者每天的 AFK 時間
-        pipeline = [
-            {'$match': match_criteria},
-            {'$group': {
-                '_id': {
-                    'username': '$username',
-                    'date': '$date',
-                    'type': '$type'
-                },
-                'total_records': {'$sum': 1},
-                'total_duration_str': {'$sum': {
-                    '$cond': [
-                        {'$eq': ['$type', 'afk']},
-                        {'$function': {
-                            'body': '''function(duration) {
-                                const parts = duration.split(':');
-                                return (parseInt(parts[0]) * 3600) + (parseInt(parts[1]) * 60) + (parseInt(parts[2]));
-                            }''',
-                            'args': ['$duration'],
-                            'lang': 'js'
-                        }},
-                        0
-                    ]
-                }}
-            }},
-            {'$project': {
-                '_id': 0,
-                'username': '$_id.username',
-                'date': '$_id.date',
-                'type': '$_id.type',
-                'total_records': 1,
-                'total_duration_str': {
-                    '$function': {
-                        'body': '''function(seconds) {
-                            const hours = Math.floor(seconds / 3600);
-                            const minutes = Math.floor((seconds % 3600) / 60);
-                            const secs = seconds % 60;
-                            return (hours < 10 ? '0' : '') + hours + ':' +
-                                   (minutes < 10 ? '0' : '') + minutes + ':' +
-                                   (secs < 10 ? '0' : '') + secs;
-                        }''',
-                        'args': ['$total_duration_str'],
-                        'lang': 'js'
-                    }
-                }
-            }},
-            {'$sort': {'date': -1, 'username': 1}}
-        ]
-        
-        summary_data = list(db.afk.aggregate(pipeline))
-        
-        # 回傳摘要結果
-        return jsonify({
-            'total_records': len(summary_data),
-            'summary': summary_data
-        })
-        
-    except Exception as e:
-        logger.error(f"Error generating AFK summary: {str(e)}")
-        return jsonify({
-            'error': str(e),
-            'type': type(e).__name__,
-            'details': 'Error generating AFK summary'
-        }), 500
-
-@app.route('/api/cleanup', methods=['POST'])
-@login_required
-def trigger_cleanup():
-    """Manually trigger Excel file cleanup"""
-    try:
-        deleted_count, deleted_files = cleanup_excel_files()
-        return jsonify({
-            "message": f"Cleanup completed. Deleted {deleted_count} files",
-            "deleted_files": deleted_files
-        })
-    except Exception as e:
-        logger.error(f"Cleanup error: {str(e)}")
-        return jsonify({"error": "Cleanup failed"}), 500
-
-# Add after the app initialization
-@app.teardown_appcontext
-def shutdown_session(exception=None):
-    """Clean up resources when app context ends"""
-    try:
-        db = get_database()
-        if db:
-            db.client.close()
-    except Exception as e:
-        logger.error(f"Error closing MongoDB connection: {e}")
-
-# 更新主程序部分，完善錯誤處理
-if __name__ == "__main__":
-    try:
-        print("初始化 Activity Tracker API...")
-        
-        # 確保數據目錄存在
-        ensure_data_directory()
-        
-        # 初始化應用
-        init_app()
-        
-        # 檢查是否以打包方式運行
-        if getattr(sys, 'frozen', False):
-            # 生產模式 - 使用 waitress
-            from waitress import serve
-            
-            # 輸出清晰的啟動信息
-            # print("=" * 50)
-            # print(" Activity Tracker API 服務已啟動")
-            # print(" 訪問地址: http://127.0.0.1:5000")
-            # print("=" * 50)
-            
-            # 啟動生產服務器
-            serve(app, host='0.0.0.0', port=5000)
-            # 127.0.0.1
-        else:
-            debug_mode = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
-            if debug_mode:
-                print("警告: 調試模式已啟用，這會帶來安全風險")
-                print("僅用於開發環境，切勿在生產環境中啟用")
-            # 開發模式 - 使用 Flask 開發服務器
-            app.run(
-                host='0.0.0.0',
-                port=5000,
-                debug=False,  
-                use_reloader=False
-            )
-    except OSError as e:
-        # 處理端口被占用等情況
-        error_msg = f"啟動服務器時出錯: {str(e)}"
-        logger.error(error_msg)
-        print(f"錯誤: {error_msg}")
-        
-        if "Address already in use" in str(e):
-            print("端口 5000 已被佔用，可能是另一個 Activity Tracker API 實例正在運行")
-            
-        # 在打包環境中保持窗口開啟
-        if getattr(sys, 'frozen', False):
-            input("按 Enter 鍵退出...")
-    except Exception as e:
-        # 處理其他所有異常
-        error_msg = f"應用程序啟動錯誤: {str(e)}"
-        logger.error(error_msg)
-        print(f"錯誤: {error_msg}")
-        print(f"詳細信息: {type(e).__name__}")
-        
-        # 顯示完整的異常信息
-        import traceback
-        traceback.print_exc()
-        
-        # 在打包環境中保持窗口開啟
-        if getattr(sys, 'frozen', False):
+import os
+import sys
+import time
+
+# Add single instance check at the very beginning
+# try:
+#     from single_instance import SingleInstance
+#     instance = SingleInstance("ActivityTrackerAPI")
+# except ImportError:
+#     # If import fails, continue running (development environment fallback)
+#     pass
+
+from flask import Flask, render_template, jsonify, request, session
+from flask_cors import CORS
+from functools import wraps
+from datetime import timedelta
+import os
+from datetime import datetime
+import logging
+from contextlib import contextmanager
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from database.mongo_config import (get_database, get_member_client, ensure_indexes, time_series_enabled,
+                                   TIME_SERIES_COLLECTIONS, load_environment)
+from database.sharding import known_users, USER_FIELDS
+from database.sessions import overlap_filter
+from database.labels import LabelDecoder, LABEL_FIELDS
+from database.rollup import WORKSTATION_COLLECTION, rolled_up_dates, workstation_summary
+from database.analytics import SketchFeed, METRIC_FIELDS, top_apps, percentiles
+from bson import ObjectId
+from logger_config import setup_logger
+# config 可能讀取 .env 中的設定，需先載入
+load_environment()
+from config import CONFIG
+import api_metrics
+from request_profiler import init_profiler, checkpoint
+import wire_format
+from json_provider import FastJSONProvider
+from auth import init_auth, ensure_user_index, rotate_session, AuthBusyError
+from ingest import init_ingest
+from scheduler import init_scheduler
+from query_guard import QueryGuard, QUERY_STOPPED_ERRORS
+from single_flight import SingleFlight
+from time_codec import date_string, parse_date, parse_duration, format_duration, clock_span, time_span
+
+# 必須在建立任何 MongoClient 之前註冊，才能收集查詢時間與連線池使用率
+api_metrics.install_mongo_listeners()
+
+# 設置記錄器
+logger = setup_logger('ActivityTrackerAPI')
+
+# 記錄啟動信息
+logger.info('API Service starting...')
+logger.info(f'User: {os.environ.get("USERNAME")}')
+logger.info(f'Computer name: {os.environ.get("COMPUTERNAME")}')
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# 添加一個函數用於獲取應用程序根目錄
+def get_app_root():
+    """獲取應用程序根目錄，處理打包和非打包情況"""
+    if getattr(sys, 'frozen', False):
+        # 打包後的可執行文件路徑
+        return os.path.dirname(sys.executable)
+    else:
+        # 開發環境
+        return os.path.dirname(os.path.abspath(__file__))
+
+# 修改 ensure_data_directory 函數
+def ensure_data_directory():
+    data_dir = os.path.join(get_app_root(), 'data')
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+    return data_dir
+
+def format_timedelta(td):
+    if td is None:
+        return '00:00:00'
+    return format_duration(td.total_seconds())
+
+
+def login_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+        # if 'user name' not in session:
+            return jsonify({"error": "Authentication required"}), 401
+        return f(*args, **kwargs)
+    return decorated_function
+
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            return jsonify({"error": "Authentication required"}), 401
+        if not session.get('is_admin'):
+            return jsonify({"error": "Admin privileges required"}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
+# 團隊成員快取 {team: (到期時間, 成員集合)}
+TEAM_CACHE_TTL = 60
+_team_cache = {}
+
+def get_team_members(db, team):
+    """取得團隊成員名單（快取 TEAM_CACHE_TTL 秒）"""
+    cached = _team_cache.get(team)
+    if cached and cached[0] > time.time():
+        api_metrics.record_cache('team', True)
+        return cached[1]
+    api_metrics.record_cache('team', False)
+    members = {doc['user_name'] for doc in db.teams.find({'team': team}, {'user_name': 1})}
+    _team_cache[team] = (time.time() + TEAM_CACHE_TTL, members)
+    return members
+
+# 分片部署時，未指定使用者的查詢展開為已註冊的使用者，使查詢帶有 shard key
+SHARD_TARGET_ALL_QUERIES = CONFIG.get('SHARDING', {}).get('TARGET_ALL_QUERIES', False)
+_known_users_cache = {'expires': 0, 'users': []}
+
+def get_known_users(db):
+    """取得 agents 註冊表中的所有使用者（快取 TEAM_CACHE_TTL 秒）"""
+    if _known_users_cache['expires'] > time.time():
+        api_metrics.record_cache('known_users', True)
+        return _known_users_cache['users']
+    api_metrics.record_cache('known_users', False)
+    _known_users_cache['users'] = known_users(db)
+    _known_users_cache['expires'] = time.time() + TEAM_CACHE_TTL
+    return _known_users_cache['users']
+
+def get_user_scope(db):
+    """
+    解析 ?users=a,b / ?username=a / ?team=x 篩選條件。
+    回傳排序後的使用者清單；未指定任何篩選時回傳 None（不限制使用者），
+    若啟用 SHARDING.TARGET_ALL_QUERIES 則回傳所有已註冊使用者。
+    """
+    users = set()
+    for param in ('users', 'username'):
+        value = request.args.get(param)
+        if value:
+            users.update(name.strip() for name in value.split(',') if name.strip())
+    team = request.args.get('team')
+    if team:
+        members = get_team_members(db, team)
+        users = (users & members) if users else set(members)
+    elif not users:
+        if SHARD_TARGET_ALL_QUERIES:
+            # 註冊表為空時退回不限制使用者，避免漏掉資料
+            return get_known_users(db) or None
+        return None
+    return sorted(users)
+
+def user_condition(users):
+    """單一使用者用等值條件，多個用 $in，皆可使用 (user, date) 複合索引"""
+    return users[0] if len(users) == 1 else {'$in': users}
+
+# activities / afk 以時間序列集合儲存（mongo_config.json 的 time_series.enabled）
+TIME_SERIES = time_series_enabled()
+
+def heartbeat_filter(collection, start_date, end_date=None, users=None):
+    """
+    activities / afk 的日期範圍與使用者查詢條件。
+    時間序列模式下另加 timeField 範圍並改以 meta.user_name 篩選，
+    讓 MongoDB 依 bucket 的時間範圍與 meta 直接略過不相關的 bucket。
+    """
+    date_condition = {'$gte': start_date}
+    if end_date:
+        date_condition['$lte'] = end_date
+    query = {'date': date_condition}
+    if TIME_SERIES:
+        time_condition = {'$gte': parse_date(start_date)}
+        if end_date:
+            time_condition['$lt'] = parse_date(end_date) + timedelta(days=1)
+        query[TIME_SERIES_COLLECTIONS[collection]['timeField']] = time_condition
+    if users is not None:
+        query['meta.user_name' if TIME_SERIES else USER_FIELDS[collection]] = user_condition(users)
+    return query
+
+# ?since=<watermark> 增量查詢，依寫入端設定的 created_at / timestamp（兩種集合模式欄位相同）。
+# agents 以本機時間寫入且經佇列批次送出，晚到的記錄時間可能早於上次的 watermark，
+# 因此每次多讀取 DELTA_OVERLAP_SECONDS 秒，重複的記錄由用戶端依 _id / 工作階段合併
+DELTA_OVERLAP = timedelta(seconds=CONFIG.get('QUERY', {}).get('DELTA_OVERLAP_SECONDS', 60))
+
+def requested_since():
+    """
+    解析 ?since=。未提供時回傳 None（完整查詢）；空字串表示自日期範圍開始的增量查詢。
+    格式錯誤時拋出 ValueError。
+    """
+    value = request.args.get('since')
+    if value is None:
+        return None
+    if not value:
+        return datetime.min
+    return datetime.fromisoformat(value)
+
+def apply_since(collection, query, since):
+    """只讀取 watermark（減去重疊時間）之後寫入的記錄"""
+    if since == datetime.min:
+        return query
+    field = TIME_SERIES_COLLECTIONS[collection]['timeField']
+    query.setdefault(field, {})['$gt'] = since - DELTA_OVERLAP
+    return query
+
+def next_watermark(rows, field, since=None):
+    """
+    下一次 ?since= 使用的 watermark：記錄中最新的寫入時間，不超過目前時間，
+    避免時鐘超前的 agent 使後續記錄被略過。沒有記錄時沿用原本的 watermark（或 None）。
+    """
+    latest = max((row[field] for row in rows if isinstance(row.get(field), datetime)), default=None)
+    if latest is None:
+        latest = since if since not in (None, datetime.min) else None
+    if latest is None:
+        return None
+    return min(latest, datetime.now()).isoformat(timespec='milliseconds')
+
+app = Flask(__name__)
+# orjson 序列化，原生處理 ObjectId 與 datetime
+app.json = FastJSONProvider(app)
+app.json.native_datetime = CONFIG.get('JSON', {}).get('NATIVE_DATETIME', False)
+CORS(app, 
+     supports_credentials=CONFIG['CORS']['SUPPORTS_CREDENTIALS'],
+     origins=CONFIG['CORS']['ORIGINS'],
+     allow_headers=CONFIG['CORS']['ALLOW_HEADERS'],
+     methods=CONFIG['CORS']['METHODS'],
+     expose_headers=CONFIG['CORS']['EXPOSE_HEADERS'])
+
+api_metrics.init_flask_metrics(app)
+# explain 使用共用的唯讀 handle
+init_profiler(app, lambda: get_database(read_only=True), ensure_data_directory(), CONFIG.get('PROFILING'))
+# 在 metrics 之後註冊，after_request 逆序執行，metrics 記錄的是壓縮後大小
+app.after_request(wire_format.compress_response)
+
+app.secret_key = CONFIG['SECRET_KEY']
+app.permanent_session_lifetime = timedelta(days=CONFIG['SESSION_LIFETIME_DAYS'])
+
+# 伺服器端 session 與密碼雜湊執行緒池
+password_hasher = init_auth(app, ensure_data_directory(), CONFIG.get('AUTH'))
+
+# 每日 Count-Min sketch / t-digest，由 ingest 寫入時更新，排程補齊並關閉過去的日期
+ANALYTICS_CONFIG = CONFIG.get('ANALYTICS', {})
+sketch_feed = SketchFeed(ANALYTICS_CONFIG.get('CMS_WIDTH', 2048), ANALYTICS_CONFIG.get('CMS_DEPTH', 4)) \
+    if ANALYTICS_CONFIG.get('ENABLED', True) else None
+
+# 代理程式的批次寫入端點（寫入 primary）
+init_ingest(app, lambda: get_database(), CONFIG.get('INGEST'), sketch_feed)
+
+# 資料保留、每日彙總與索引檢查排程（各節點以 MongoDB 租約選出執行者，於 init_app 啟動）
+SCHEDULER_CONFIG = CONFIG.get('SCHEDULER', {})
+scheduler = init_scheduler(app, lambda: get_database(), SCHEDULER_CONFIG, sketch_feed)
+
+# 儀表板查詢的時間限制、各端點並行上限、日期範圍上限與用戶端中斷時取消查詢
+QUERY_CONFIG = CONFIG.get('QUERY', {})
+query_guard = QueryGuard(lambda: get_database(read_only=True), QUERY_CONFIG, get_member_client)
+# 同時到達的相同請求只執行一次查詢，共用回應
+single_flight = SingleFlight()
+
+# Add this after the app initialization but before any routes
+def init_app():
+    """初始化應用，連接 MongoDB 並執行清理工作"""
+    logger.info("開始應用程序初始化...")
+    try:
+        # 嘗試連接 MongoDB 並在打包環境中提供更明確的錯誤消息
+        try:
+            db = get_database()
+            # 簡單測試連接
+            db.command('ping')
+            ensure_user_index(db)
+            ensure_indexes(db)
+            logger.info("MongoDB 連接成功初始化")
+            if getattr(sys, 'frozen', False):
+                print("MongoDB 連接正常")
+        except Exception as db_err:
+            error_msg = f"MongoDB 連接錯誤: {str(db_err)}"
+            logger.error(error_msg)
+            if getattr(sys, 'frozen', False):
+                print(f"警告: {error_msg}")
+                print("請確保 MongoDB 服務正在運行")
+                print("應用程序將嘗試繼續運行，但可能會出現數據問題")
+                time.sleep(2)  # 給用戶時間閱讀警告
+        
+        # 啟動維護排程
+        if SCHEDULER_CONFIG.get('ENABLED', True):
+            scheduler.start()
+    except Exception as e:
+        logger.error(f"啟動過程中出錯: {str(e)}")
+
+@app.route('/api/register', methods=['POST'])
+def register():
+    try:
+        data = request.get_json()
+        username = data.get('username')
+        password = data.get('password')
+        
+        if not username or not password:
+            return jsonify({"error": "Username and password required"}), 400
+            
+        password_hash = password_hasher.hash_password(password)
+        
+        # Use MongoDB instead of SQLite
+        db = get_database()
+        try:
+            db.users.insert_one({
+                'username': username,
+                'password_hash': password_hash,
+                'created_at': datetime.now()
+            })
+            return jsonify({"message": "User registered successfully"}), 201
+        except Exception as e:
+            if 'duplicate key error' in str(e):
+                return jsonify({"error": "Username already exists"}), 409
+            raise
+                
+    except AuthBusyError as e:
+        logger.warning(f"Registration rejected: {str(e)}")
+        return jsonify({"error": "Server busy, please retry"}), 503
+    except Exception as e:
+        logger.error(f"Registration error: {str(e)}")
+        return jsonify({"error": "Registration failed"}), 500
+
+# Initialize MongoDB connection
+# 寫入（註冊/登入）使用 primary，唯讀儀表板查詢使用 read_db（讀取 secondary）
+db = get_database()
+read_db = get_database(read_only=True)
+
+# app_title / app_path / window 以字典編碼儲存時（見 database/labels.py），回應前解碼；
+# 新標籤可能尚未複寫到 secondary，因此從 primary 讀取
+label_decoder = LabelDecoder(lambda: db, CONFIG.get('LABELS', {}).get('CACHE_SIZE', 10000))
+
+@app.route('/api/login', methods=['POST'])
+def login():
+    try:
+        data = request.get_json()
+        username = data.get('username')
+        password = data.get('password')
+        
+        if not username or not password:
+            return jsonify({"error": "Username and password required"}), 400
+            
+        # 以唯一索引的 username 查詢，密碼在專用執行緒池中驗證（帳號不存在時也執行 KDF）
+        user = db.users.find_one({'username': username})
+        
+        if password_hasher.verify_password(password, user.get('password_hash') if user else None) and user:
+            if password_hasher.needs_rehash(user['password_hash']):
+                # 舊版 sha256 或過期參數的雜湊，登入成功時升級
+                db.users.update_one(
+                    {'_id': user['_id']},
+                    {'$set': {'password_hash': password_hasher.hash_password(password)}}
+                )
+            session.clear()
+            rotate_session(session)
+            session.permanent = True
+            session['user_id'] = str(user['_id'])
+            session['username'] = user['username']
+            session['is_admin'] = user.get('role') == 'admin'
+            return jsonify({
+                "message": "Login successful",
+                "user": {"id": str(user['_id']), "username": user['username']}
+            }), 200
+            
+        return jsonify({"error": "Invalid credentials"}), 401
+        
+    except AuthBusyError as e:
+        logger.warning(f"Login rejected: {str(e)}")
+        return jsonify({"error": "Server busy, please retry"}), 503
+    except Exception as e:
+        logger.error(f"Login error: {str(e)}")
+        return jsonify({"error": "Login failed"}), 500
+
+@app.route('/api/logout', methods=['POST'])
+def logout():
+    session.clear()
+    return jsonify({"message": "Logged out successfully"}), 200
+
+# get_data 合併記錄與重新計算 total_time 所需的欄位
+ACTIVITY_REQUIRED_FIELDS = ('date', 'user_name', 'workstation_name', 'app_name', 'logon_time',
+                            'app_start_time', 'logoff_time', 'created_at', 'total_time')
+
+@app.route('/api/activities')
+# @login_required
+@single_flight.coalesce
+@query_guard.limit
+def get_data():
+    try:
+        # 從請求參數獲取日期範圍，默認為當天
+        start_date = request.args.get('start_date')
+        end_date = request.args.get('end_date')
+        
+        # 如果沒有提供日期參數，默認只返回當天記錄
+        if not start_date:
+            start_date = date_string()
+        if not end_date:
+            end_date = date_string()
+        span_error = query_guard.span_error(start_date, end_date)
+        if span_error:
+            return jsonify({'error': span_error}), 400
+        try:
+            since = requested_since()
+        except ValueError:
+            return jsonify({'error': 'since must be an ISO datetime watermark'}), 400
+            
+        logger.info(f"Fetching activities from {start_date} to {end_date}")
+        
+        # ?fields= 時只從 MongoDB 讀取需要的欄位（加上合併與計算所需欄位）
+        projection = wire_format.mongo_projection(
+            wire_format.requested_fields(request), ACTIVITY_REQUIRED_FIELDS)
+        
+        # 查詢 MongoDB 獲取指定日期範圍的活動記錄
+        query = heartbeat_filter('activities', start_date, end_date, get_user_scope(read_db))
+        if since is not None:
+            apply_since('activities', query, since)
+        activities = list(read_db.activities.find(query, projection, **query_guard.options(read_db)))
+        watermark = next_watermark(activities, 'created_at', since)
+        checkpoint('mongo')
+        
+        # 對記錄進行預排序，按照創建時間降序，以便後面處理時最新的記錄會覆蓋舊的
+        activities.sort(key=lambda x: (
+            x['date'],
+            x.get('user_name', ''),
+            x.get('app_name', ''),
+            x.get('app_start_time', ''),
+            x.get('created_at', '')
+        ), reverse=True)  # 降序排序，最新的記錄在前
+        checkpoint('sort')
+        
+        # 合併相同應用程序的記錄，保留具有最大 logoff_time 的記錄
+        merged_activities = {}
+        for activity in activities:
+            # 創建唯一鍵，用於識別相同的活動記錄
+            key = (
+                activity.get('date', ''),
+                activity.get('user_name', ''),
+                activity['workstation_name'],  # 改為直接訪問 workstation_name
+                activity.get('app_name', ''),
+                activity.get('logon_time', '') or activity.get('app_start_time', '')  # 優先使用 logon_time
+            )
+            
+            # 如果鍵不存在或當前記錄的 logoff_time 更大，則更新
+            current_logoff = activity.get('logoff_time', '')
+            if key not in merged_activities or (current_logoff and current_logoff > merged_activities[key].get('logoff_time', '')):
+                merged_activities[key] = activity
+        
+        # 將字典轉換回列表
+        unique_activities = list(merged_activities.values())
+        checkpoint('merge')
+        
+        label_decoder.decode_rows(unique_activities, LABEL_FIELDS['activities'])
+        checkpoint('labels')
+        
+        # 重新計算每個活動的 total_time
+        for activity in unique_activities:
+            logon_time = activity.get('logon_time', '') or activity.get('app_start_time', '')
+            logoff_time = activity.get('logoff_time', '')
+            
+            if logon_time and logoff_time:
+                try:
+                    # 完整格式 '2025-02-28 17:24:56' 或只有時間 'HH:MM:SS'（結束時間較早時視為下一天）
+                    # 格式化為 HH:MM:SS，超過 24 小時時小時數繼續累加
+                    activity['total_time'] = format_duration(time_span(logon_time, logoff_time))
+                    
+                    # 添加調試日誌
+                    logger.debug(f"計算 total_time: {activity['total_time']} (logon: {logon_time}, logoff: {logoff_time})")
+                    
+                except ValueError as e:
+                    logger.warning(f"無法計算 total_time: {str(e)} - logon: {logon_time}, logoff: {logoff_time}")
+                    activity['total_time'] = activity.get('total_time', '00:00:00')
+            else:
+                activity['total_time'] = activity.get('total_time', '00:00:00')
+        checkpoint('parse_times')
+        
+        if since is not None:
+            # 增量結果只包含新寫入的記錄，用戶端依 (date, user_name, workstation_name, app_name, logon_time)
+            # 合併並保留 logoff_time 較大者，使用時間摘要由用戶端自合併後的資料計算
+            api_metrics.observe_rows('/api/activities', len(unique_activities))
+            return wire_format.respond({
+                'total_records': len(unique_activities),
+                'activities': unique_activities,
+                'since': request.args.get('since'),
+                'watermark': watermark,
+                'date_range': {
+                    'from': start_date,
+                    'to': end_date
+                }
+            }, row_keys=('activities',))
+        
+        # 計算使用時間摘要 - 按用戶、日期和應用程式分組
+        usage_time_summary = []
+        
+        # 建立按用戶、日期、應用程式分組的時間統計
+        usage_time_dict = {}
+        for activity in unique_activities:
+            key = (
+                activity.get('date', ''),
+                activity.get('user_name', ''),
+                activity.get('app_name', '')
+            )
+            
+            try:
+                # 解析時間字串並轉換為秒數
+                total_seconds = parse_duration(activity.get('total_time', '00:00:00'))
+                
+                if key not in usage_time_dict:
+                    usage_time_dict[key] = {
+                        'date': activity.get('date', ''),
+                        'user_name': activity.get('user_name', ''),
+                        'app_name': activity.get('app_name', ''),
+                        'total_seconds': total_seconds,
+                        'session_count': 1
+                    }
+                else:
+                    usage_time_dict[key]['total_seconds'] += total_seconds
+                    usage_time_dict[key]['session_count'] += 1
+            except (ValueError, IndexError) as e:
+                logger.warning(f"解析時間出錯: {str(e)} - {activity.get('total_time')}")
+        
+        # 轉換為列表並格式化總時間
+        for stats in usage_time_dict.values():
+            stats['total_time'] = format_duration(stats['total_seconds'])
+            del stats['total_seconds']  # 移除不需要的欄位
+            usage_time_summary.append(stats)
+        
+        # 按日期和使用時間排序
+        usage_time_summary.sort(key=lambda x: (x['date'], x['user_name'], x['total_time']), reverse=True)
+        
+        logger.info(f"生成了 {len(usage_time_summary)} 個使用時間摘要記錄")
+        api_metrics.observe_rows('/api/activities', len(unique_activities) + len(usage_time_summary))
+        checkpoint('summary')
+        
+        # 返回結果時使用實際查詢的日期範圍
+        return wire_format.respond({
+            'total_records': len(unique_activities),
+            'activities': unique_activities,
+            'usagetime': usage_time_summary,
+            'watermark': watermark,
+            'date_range': {
+                'from': start_date,
+                'to': end_date
+            }
+        }, row_keys=('activities', 'usagetime'))
+        
+    except QUERY_STOPPED_ERRORS as e:
+        return query_guard.stopped_response(e)
+    except Exception as e:
+        logger.error(f"Error fetching activities: {str(e)}")
+        return jsonify({
+            'error': str(e),
+            'type': type(e).__name__
+        }), 500
+
+@app.route('/api/usage')
+# login_required  
+@single_flight.coalesce
+@query_guard.limit
+def get_app_usage_stats():
+    try:
+        all_stats = []
+        three_days_ago = date_string(datetime.now() - timedelta(days=3))
+        
+        try:
+            db = get_database(read_only=True)
+            match_criteria = heartbeat_filter('activities', three_days_ago, users=get_user_scope(db))
+            pipeline = [
+                {
+                    '$match': match_criteria
+                },
+                {
+                    '$group': {
+                        '_id': {
+                            'user_name': '$user_name',
+                            'app_name': '$app_name',
+                            'date': '$date'
+                        },
+                        'usage_count': {'$sum': 1},
+                        # 計算時間字串轉換為秒數
+                        'total_seconds': {
+                            '$sum': {
+                                '$function': {
+                                    'body': '''function(time) {
+                                        if (!time) return 0;
+                                        const parts = time.split(':');
+                                        if (parts.length !== 3) return 0;
+                                        
+                                        // 安全轉換為數字
+                                        const hours = parseInt(parts[0]) || 0;
+                                        const minutes = parseInt(parts[1]) || 0;
+                                        const seconds = parseInt(parts[2]) || 0;
+                                        
+                                        // 驗證時間合理性（不超過24小時）
+                                        if (hours > 24 || minutes > 59 || seconds > 59) {
+                                            return 0;
+                                        }
+                                        
+                                        return (hours * 3600) + (minutes * 60) + seconds;
+                                    }''',
+                                    'args': ['$total_time'],
+                                    'lang': 'js'
+                                }
+                            }
+                        },
+                        'max_seconds': {
+                            '$max': {
+                                '$function': {
+                                    'body': '''function(time) {
+                                        if (!time) return 0;
+                                        const parts = time.split(':');
+                                        if (parts.length !== 3) return 0;
+                                        
+                                        // 安全轉換為數字
+                                        const hours = parseInt(parts[0]) || 0;
+                                        const minutes = parseInt(parts[1]) || 0;
+                                        const seconds = parseInt(parts[2]) || 0;
+                                        
+                                        // 驗證時間合理性（不超過24小時）
+                                        if (hours > 24 || minutes > 59 || seconds > 59) {
+                                            return 0;
+                                        }
+                                        
+                                        return (hours * 3600) + (minutes * 60) + seconds;
+                                    }''',
+                                    'args': ['$total_time'],
+                                    'lang': 'js'
+                                }
+                            }
+                        },
+                        'max_time': {'$max': '$total_time'}  # 保留最長單次使用時間
+                    }
+                },
+                {
+                    '$project': {
+                        '_id': 0,
+                        'user_name': '$_id.user_name',
+                        'app_name': '$_id.app_name',
+                        'date': '$_id.date',
+                        'usage_count': 1,
+                        'max_time': 1,
+                        'total_time': {
+                            '$function': {
+                                'body': '''function(seconds) {
+                                    // 限制合理範圍 - 一天最多24小時
+                                    seconds = Math.min(seconds, 86400);
+                                    
+                                    const hours = Math.floor(seconds / 3600);
+                                    const minutes = Math.floor((seconds % 3600) / 60);
+                                    const secs = seconds % 60;
+                                    return (hours < 10 ? '0' : '') + hours + ':' +
+                                           (minutes < 10 ? '0' : '') + minutes + ':' +
+                                           (secs < 10 ? '0' : '') + secs;
+                                }''',
+                                'args': ['$total_seconds'],
+                                'lang': 'js'
+                            }
+                        }
+                    }
+                },
+                {'$sort': {'date': -1, 'total_seconds': -1}}  # 改為按總使用時間排序
+            ]
+            
+            all_stats = list(db.activities.aggregate(pipeline, **query_guard.options(db)))
+            logger.info(f"Retrieved {len(all_stats)} app usage statistics")
+            api_metrics.observe_rows('/api/usage', len(all_stats))
+            
+        except QUERY_STOPPED_ERRORS as e:
+            return query_guard.stopped_response(e)
+        except Exception as mongo_err:
+            logger.error(f"MongoDB stats error: {str(mongo_err)}")
+            return jsonify({'error': f"Database error: {str(mongo_err)}"}), 500
+            
+        return wire_format.respond({
+            'total_records': len(all_stats),
+            'stats': all_stats,
+            'date_range': {
+                'from': three_days_ago,
+                'to': date_string()
+            }
+        }, row_keys=('stats',))
+        
+    except Exception as e:
+        logger.error(f"Error getting usage stats: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+from datetime import datetime, timedelta
+@app.route('/api/afk')
+@single_flight.coalesce
+@query_guard.limit
+def get_afk_stats():
+    try:
+        db = get_database(read_only=True)
+        # 取得查詢參數，預設為最近三天
+        days = request.args.get('days', default=7, type=int)
+        span_error = query_guard.days_error(days + 1)
+        if span_error:
+            return jsonify({'error': span_error}), 400
+        try:
+            since = requested_since()
+        except ValueError:
+            return jsonify({'error': 'since must be an ISO datetime watermark'}), 400
+        
+        # 計算過濾日期
+        three_days_ago = date_string(datetime.now() - timedelta(days=days))
+        
+        # 構建查詢條件（?username= / ?users= / ?team=）
+        query = heartbeat_filter('afk', three_days_ago, users=get_user_scope(db))
+        if since is not None:
+            apply_since('afk', query, since)
+        
+        # 使用 MongoDB 排序功能
+        afk_records = list(db.afk.find(query, **query_guard.options(db)).sort([
+            ("username", 1),
+            ("date", 1),
+            ("start_time", 1)
+        ]))
+        watermark = next_watermark(afk_records, 'timestamp', since)
+        
+        if since is not None:
+            # 增量結果不合併，保留 _id 讓用戶端去除重疊時間內重複的記錄後再合併連續視窗
+            delta_stats = [{
+                '_id': record['_id'],
+                'user_name': record['username'],
+                'Status': record['type'],
+                'date': record['date'],
+                'duration': record['duration'],
+                'window': record.get('window', 'Unknown'),
+                'start_time': record.get('start_time', ''),
+                'end_time': record.get('end_time', '')
+            } for record in afk_records]
+            label_decoder.decode_rows(delta_stats, LABEL_FIELDS['afk'])
+            api_metrics.observe_rows('/api/afk', len(delta_stats))
+            return wire_format.respond({
+                'total_records': len(delta_stats),
+                'afk_stats': delta_stats,
+                'since': request.args.get('since'),
+                'watermark': watermark,
+                'date_range': {
+                    'from': three_days_ago,
+                    'to': date_string()
+                }
+            }, row_keys=('afk_stats',))
+        
+        if not afk_records:
+            return jsonify({
+                "error": "No data found",
+                "details": "No AFK statistics available"
+            }), 404
+
+        # 格式化記錄
+        formatted_stats = []
+        for record in afk_records:
+            formatted_stats.append({
+                'user_name': record['username'],
+                'Status': record['type'],
+                'date': record['date'],
+                'duration': record['duration'],
+                'window': record.get('window', 'Unknown'),
+                'start_time': record.get('start_time', ''),
+                'end_time': record.get('end_time', '')
+            })
+        
+        # 合併連續相同視窗的記錄
+        merged_stats = []
+        if formatted_stats:
+            current = formatted_stats[0]
+            
+            for i in range(1, len(formatted_stats)):
+                next_record = formatted_stats[i]
+                
+                # 檢查是否可以合併（相同使用者、狀態、視窗，且時間連續）
+                can_merge = (
+                    current['user_name'] == next_record['user_name'] and
+                    current['Status'] == next_record['Status'] and
+                    current['date'] == next_record['date'] and
+                    current['window'] == next_record['window'] and
+                    current['end_time'] == next_record['start_time']
+                )
+                
+                if can_merge:
+                    # 更新結束時間和持續時間
+                    current['end_time'] = next_record['end_time']
+                    
+                    # 重新計算合併後的持續時間
+                    try:
+                        # 處理跨日情況
+                        current['duration'] = format_duration(clock_span(current['start_time'], current['end_time']))
+                    except ValueError:
+                        logger.warning(f"無法計算合併記錄的持續時間: {current['start_time']} to {current['end_time']}")
+                else:
+                    # 無法合併，將當前記錄添加到結果中，開始新記錄
+                    merged_stats.append(current)
+                    current = next_record
+            
+            # 不要忘記最後一筆記錄
+            merged_stats.append(current)
+        
+        # 合併以標籤 ID 比較，合併後只需解碼剩下的記錄
+        label_decoder.decode_rows(merged_stats, LABEL_FIELDS['afk'])
+        
+        logger.info(f"Retrieved {len(afk_records)} AFK records, consolidated to {len(merged_stats)} records")
+        api_metrics.observe_rows('/api/afk', len(merged_stats))
+        
+        return wire_format.respond({
+            'total_records': len(merged_stats),
+            'afk_stats': merged_stats,
+            'watermark': watermark,
+            'date_range': {
+                'from': three_days_ago,
+                'to': date_string()
+            }
+        }, row_keys=('afk_stats',))
+
+    except QUERY_STOPPED_ERRORS as e:
+        return query_guard.stopped_response(e)
+    except Exception as e:
+        logger.error(f"Error processing AFK statistics: {str(e)}")
+        return jsonify({
+            'error': str(e),
+            'type': type(e).__name__,
+            'details': 'Error processing AFK statistics'
+        }), 500
+
+@app.route('/api/afk/summary')
+@single_flight.coalesce
+@query_guard.limit
+def get_afk_summary():
+    try:
+        db = get_database(read_only=True)
+        three_days_ago = date_string(datetime.now() - timedelta(days=3))
+        
+        # 構建匹配條件（用戶名/團隊篩選可選）
+        match_criteria = heartbeat_filter('afk', three_days_ago, users=get_user_scope(db))
+        match_criteria['is_heartbeat'] = {'$ne': True}  # 排除心跳資料
+            
+        # 用聚合管道分析每位使用者每天的 AFK 時間
+        pipeline = [
+            {'$match': match_criteria},
+            {'$group': {
+                '_id': {
+                    'username': '$username',
+                    'date': '$date',
+                    'type': '$type'
+                },
+                'total_records': {'$sum': 1},
+                'total_duration_str': {'$sum': {
+                    '$cond': [
+                        {'$eq': ['$type', 'afk']},
+                        {'$function': {
+                            'body': '''function(duration) {
+                                const parts = duration.split(':');
+                                return (parseInt(parts[0]) * 3600) + (parseInt(parts[1]) * 60) + (parseInt(parts[2]));
+                            }''',
+                            'args': ['$duration'],
+                            'lang': 'js'
+                        }},
+                        0
+                    ]
+                }}
+            }},
+            {'$project': {
+                '_id': 0,
+                'username': '$_id.username',
+                'date': '$_id.date',
+                'type': '$_id.type',
+                'total_records': 1,
+                'total_duration_str': {
+                    '$function': {
+                        'body': '''function(seconds) {
+                            const hours = Math.floor(seconds / 3600);
+                            const minutes = Math.floor((seconds % 3600) / 60);
+                            const secs = seconds % 60;
+                            return (hours < 10 ? '0' : '') + hours + ':' +
+                                   (minutes < 10 ? '0' : '') + minutes + ':' +
+                                   (secs < 10 ? '0' : '') + secs;
+                        }''',
+                        'args': ['$total_duration_str'],
+                        'lang': 'js'
+                    }
+                }
+            }},
+            {'$sort': {'date': -1, 'username': 1}}
+        ]
+        
+        summary_data = list(db.afk.aggregate(pipeline, **query_guard.options(db)))
+        api_metrics.observe_rows('/api/afk/summary', len(summary_data))
+        
+        # 回傳摘要結果
+        return wire_format.respond({
+            'total_records': len(summary_data),
+            'summary': summary_data
+        }, row_keys=('summary',))
+        
+    except QUERY_STOPPED_ERRORS as e:
+        return query_guard.stopped_response(e)
+    except Exception as e:
+        logger.error(f"Error generating AFK summary: {str(e)}")
+        return jsonify({
+            'error': str(e),
+            'type': type(e).__name__,
+            'details': 'Error generating AFK summary'
+        }), 500
+
+@app.route('/api/timeline')
+@single_flight.coalesce
+@query_guard.limit
+def get_timeline():
+    """
+    回傳與 [from, to) 重疊的 work/afk 與應用程式使用區間。
+    from / to 為 ISO 格式日期時間，例如 ?from=2024-05-01T14:00&to=2024-05-01T15:00
+    """
+    try:
+        try:
+            range_from = datetime.fromisoformat(request.args['from'])
+            range_to = datetime.fromisoformat(request.args['to'])
+        except (KeyError, ValueError):
+            return jsonify({'error': 'from and to are required ISO datetimes'}), 400
+        if range_to <= range_from:
+            return jsonify({'error': 'to must be later than from'}), 400
+        span_error = query_guard.days_error((range_to.date() - range_from.date()).days + 1)
+        if span_error:
+            return jsonify({'error': span_error}), 400
+        
+        db = get_database(read_only=True)
+        query = overlap_filter(range_from, range_to)
+        source = request.args.get('source')
+        if source:
+            query['source'] = source
+        users = get_user_scope(db)
+        if users is not None:
+            query['user_name'] = user_condition(users)
+        
+        intervals = list(db.sessions.find(query, {'_id': 0}, **query_guard.options(db)).sort('start', 1))
+        checkpoint('mongo')
+        api_metrics.observe_rows('/api/timeline', len(intervals))
+        
+        return wire_format.respond({
+            'total_records': len(intervals),
+            'intervals': intervals,
+            'range': {'from': range_from, 'to': range_to}
+        }, row_keys=('intervals',))
+    
+    except QUERY_STOPPED_ERRORS as e:
+        return query_guard.stopped_response(e)
+    except Exception as e:
+        logger.error(f"Error fetching timeline: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+# 未彙總日期的工作站統計依工作站分區並行查詢（(date, workstation_name) 索引）
+WORKSTATIONS_CONFIG = CONFIG.get('WORKSTATIONS', {})
+WORKSTATION_PARTITION_SIZE = WORKSTATIONS_CONFIG.get('PARTITION_SIZE', 100)
+workstation_executor = ThreadPoolExecutor(max_workers=WORKSTATIONS_CONFIG.get('FANOUT_WORKERS', 8),
+                                          thread_name_prefix='workstations')
+
+def live_workstation_rows(db, dates, names=None):
+    """
+    直接由 activities 計算 dates 的工作站統計：先取得這些日期出現的工作站，
+    切成 WORKSTATION_PARTITION_SIZE 台一組並行查詢後合併
+    """
+    field = 'meta.workstation_name' if TIME_SERIES else 'workstation_name'
+    query = heartbeat_filter('activities', min(dates), max(dates))
+    query['date'] = {'$in': sorted(dates)}
+    if names is not None:
+        query[field] = {'$in': sorted(names)}
+    options = query_guard.options(db)
+    workstations = sorted(name for name in db.activities.distinct(field, query, **options) if name)
+    partitions = [workstations[i:i + WORKSTATION_PARTITION_SIZE]
+                  for i in range(0, len(workstations), WORKSTATION_PARTITION_SIZE)]
+    
+    def partition_rows(partition):
+        return workstation_summary(db, dict(query, **{field: {'$in': partition}}), options.get('comment'))
+    
+    # 以 copy_context 執行，讓分區查詢沿用請求的 pymongo.timeout 期限
+    futures = [workstation_executor.submit(contextvars.copy_context().run, partition_rows, partition)
+               for partition in partitions]
+    rows = []
+    for future in futures:
+        rows.extend(future.result())
+    return rows
+
+@app.route('/api/workstations')
+@single_flight.coalesce
+@query_guard.limit
+def get_workstations():
+    """
+    每台工作站每天的開機時間、應用程式使用時間與閒置時間。
+    已彙總的過去日期讀取 daily_workstations，當天與尚未彙總的日期直接由 activities 計算。
+    ?start_date= / ?end_date= 預設為當天，?workstations=a,b 只回傳指定的工作站。
+    """
+    try:
+        start_date = request.args.get('start_date') or date_string()
+        end_date = request.args.get('end_date') or date_string()
+        span_error = query_guard.span_error(start_date, end_date)
+        if span_error:
+            return jsonify({'error': span_error}), 400
+        names = request.args.get('workstations')
+        names = {name.strip() for name in names.split(',') if name.strip()} if names else None
+        
+        db = get_database(read_only=True)
+        start = parse_date(start_date)
+        dates = [date_string(start + timedelta(days=offset))
+                 for offset in range((parse_date(end_date) - start).days + 1)]
+        # rollup 排程每隔一段時間重算當天，當天一律直接計算以免回傳過時的資料
+        rolled_up = sorted((rolled_up_dates(db, start_date) - {date_string()}) & set(dates))
+        
+        rows = []
+        if rolled_up:
+            query = {'date': {'$in': rolled_up}}
+            if names is not None:
+                query['workstation_name'] = {'$in': sorted(names)}
+            rows = list(db[WORKSTATION_COLLECTION].find(query, {'_id': 0}, **query_guard.options(db)))
+        checkpoint('rollup')
+        live = sorted(set(dates) - set(rolled_up))
+        if live:
+            rows.extend(live_workstation_rows(db, live, names))
+        checkpoint('live')
+        
+        for row in rows:
+            row['uptime'] = format_duration(row['uptime_seconds'])
+            row['system_working_time'] = format_duration(row['system_working_time_seconds'])
+            row['active_time'] = format_duration(row['active_seconds'])
+            row['idle_time'] = format_duration(row['idle_seconds'])
+        rows.sort(key=lambda row: row['workstation_name'] or '')
+        rows.sort(key=lambda row: row['date'], reverse=True)
+        api_metrics.observe_rows('/api/workstations', len(rows))
+        
+        return wire_format.respond({
+            'total_records': len(rows),
+            'workstations': rows,
+            'sources': {'rollup': rolled_up, 'live': live},
+            'date_range': {
+                'from': start_date,
+                'to': end_date
+            }
+        }, row_keys=('workstations',))
+    
+    except QUERY_STOPPED_ERRORS as e:
+        return query_guard.stopped_response(e)
+    except Exception as e:
+        logger.error(f"Error fetching workstations: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+ANALYTICS_MAX_LIMIT = ANALYTICS_CONFIG.get('MAX_LIMIT', 100)
+ANALYTICS_MAX_SPAN_DAYS = ANALYTICS_CONFIG.get('MAX_DATE_SPAN_DAYS', 366)
+
+def analytics_range():
+    """
+    分析端點的日期範圍與範圍（scope）：預設為本月至今，?team=x 使用團隊的 sketch。
+    每天只讀取一份 sketch，允許的範圍較一般查詢長。
+    """
+    today = date_string()
+    start_date = request.args.get('start_date') or today[:8] + '01'
+    end_date = request.args.get('end_date') or today
+    span = (parse_date(end_date) - parse_date(start_date)).days
+    if span < 0:
+        raise ValueError('end_date must not be before start_date')
+    if span + 1 > ANALYTICS_MAX_SPAN_DAYS:
+        raise ValueError(f"Date range exceeds {ANALYTICS_MAX_SPAN_DAYS} days")
+    team = request.args.get('team')
+    return start_date, end_date, f"team:{team}" if team else 'all'
+
+@app.route('/api/analytics/top-apps')
+@single_flight.coalesce
+@query_guard.limit
+def get_top_apps():
+    """
+    日期範圍內使用時間最多的應用程式（近似值）：合併每日 Count-Min sketch。
+    ?start_date= / ?end_date= 預設為本月至今，?team=x，?limit=10。
+    seconds 不低於實際值，高估不超過 error_bound_seconds（機率 1 - e^-depth）。
+    """
+    if sketch_feed is None:
+        return jsonify({'error': 'Analytics sketches are disabled'}), 404
+    try:
+        try:
+            start_date, end_date, scope = analytics_range()
+            limit = int(request.args.get('limit', 10))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        limit = min(max(limit, 1), ANALYTICS_MAX_LIMIT)
+        
+        db = get_database(read_only=True)
+        result = top_apps(db, start_date, end_date, scope, limit, sketch_feed.width, sketch_feed.depth)
+        checkpoint('merge')
+        for row in result['apps']:
+            row['time'] = format_duration(row['seconds'])
+        api_metrics.observe_rows('/api/analytics/top-apps', len(result['apps']))
+        
+        return wire_format.respond({
+            'total_records': len(result['apps']),
+            'apps': result['apps'],
+            'total_seconds': result['total_seconds'],
+            'error_bound_seconds': result['error_bound_seconds'],
+            'approximate': True,
+            'days': result['days'],
+            'scope': scope,
+            'date_range': {
+                'from': start_date,
+                'to': end_date
+            }
+        }, row_keys=('apps',))
+    
+    except QUERY_STOPPED_ERRORS as e:
+        return query_guard.stopped_response(e)
+    except Exception as e:
+        logger.error(f"Error fetching top apps: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/analytics/percentiles')
+@single_flight.coalesce
+@query_guard.limit
+def get_percentiles():
+    """
+    每位使用者每天 AFK / 應用程式使用秒數的百分位數（近似值）：合併每日 t-digest。
+    ?metric=afk|app_time（預設 afk），?p=50,90,99，?start_date= / ?end_date= 預設為本月至今，?team=x。
+    """
+    if sketch_feed is None:
+        return jsonify({'error': 'Analytics sketches are disabled'}), 404
+    try:
+        metric = request.args.get('metric', 'afk')
+        if metric not in METRIC_FIELDS:
+            return jsonify({'error': f"metric must be one of: {', '.join(METRIC_FIELDS)}"}), 400
+        try:
+            start_date, end_date, scope = analytics_range()
+            points = [float(p) for p in request.args.get('p', '50,90,99').split(',') if p.strip()]
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if not points or not all(0 <= p <= 100 for p in points):
+            return jsonify({'error': 'p must be a list of percentiles between 0 and 100'}), 400
+        
+        db = get_database(read_only=True)
+        result = percentiles(db, start_date, end_date, metric, [p / 100 for p in points], scope)
+        checkpoint('merge')
+        values = []
+        for p in points:
+            seconds = result['values'][p / 100]
+            values.append({
+                'p': p,
+                'seconds': seconds,
+                'time': format_duration(seconds) if seconds is not None else None
+            })
+        api_metrics.observe_rows('/api/analytics/percentiles', len(values))
+        
+        return wire_format.respond({
+            'metric': metric,
+            'percentiles': values,
+            'samples': result['count'],
+            'approximate': True,
+            'days': result['days'],
+            'scope': scope,
+            'date_range': {
+                'from': start_date,
+                'to': end_date
+            }
+        }, row_keys=('percentiles',))
+    
+    except QUERY_STOPPED_ERRORS as e:
+        return query_guard.stopped_response(e)
+    except Exception as e:
+        logger.error(f"Error fetching percentiles: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+# presence 文件超過此秒數（且超過三個心跳間隔）未更新時視為離線
+PRESENCE_STALE_AFTER_SECONDS = CONFIG.get('PRESENCE', {}).get('STALE_AFTER_SECONDS', 60)
+
+@app.route('/api/presence')
+@query_guard.limit
+def get_presence():
+    """目前每位使用者的狀態（work / afk / offline），直接讀取 presence 集合"""
+    try:
+        # presence 需要即時資料，讀取 primary
+        db = get_database()
+        query = {}
+        users = get_user_scope(db)
+        if users is not None:
+            query['user_name'] = user_condition(users)
+        
+        now = datetime.now()
+        presence = []
+        counts = {'work': 0, 'afk': 0, 'offline': 0}
+        for doc in db.presence.find(query, {'_id': 0}).sort('user_name', 1):
+            last_seen = doc.get('last_seen')
+            stale_after = max(PRESENCE_STALE_AFTER_SECONDS, 3 * (doc.get('heartbeat_interval') or 0))
+            stale = last_seen is None or (now - last_seen).total_seconds() > stale_after
+            state = 'offline' if stale else doc.get('state', 'offline')
+            counts[state] = counts.get(state, 0) + 1
+            presence.append({
+                'user_name': doc.get('user_name'),
+                'workstation_name': doc.get('workstation_name'),
+                'state': state,
+                'window': doc.get('window'),
+                'since': doc.get('since'),
+                'last_seen': last_seen,
+                'stale': stale
+            })
+        
+        api_metrics.observe_rows('/api/presence', len(presence))
+        return wire_format.respond({
+            'total_records': len(presence),
+            'counts': counts,
+            'presence': presence,
+            'as_of': now
+        }, row_keys=('presence',))
+    
+    except QUERY_STOPPED_ERRORS as e:
+        return query_guard.stopped_response(e)
+    except Exception as e:
+        logger.error(f"Error fetching presence: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/teams')
+@query_guard.limit
+def get_teams():
+    """列出所有團隊及其成員"""
+    try:
+        db = get_database()
+        pipeline = [
+            {'$group': {'_id': '$team', 'members': {'$push': '$user_name'}}},
+            {'$project': {'_id': 0, 'team': '$_id', 'members': 1}},
+            {'$sort': {'team': 1}}
+        ]
+        teams = list(db.teams.aggregate(pipeline))
+        return jsonify({'total_records': len(teams), 'teams': teams})
+    except QUERY_STOPPED_ERRORS as e:
+        return query_guard.stopped_response(e)
+    except Exception as e:
+        logger.error(f"Error fetching teams: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/teams', methods=['POST'])
+@admin_required
+def assign_team():
+    """設定使用者所屬團隊（team 為空時移除）"""
+    try:
+        data = request.get_json() or {}
+        user_name = data.get('user_name')
+        team = data.get('team')
+        if not user_name:
+            return jsonify({"error": "user_name required"}), 400
+        
+        db = get_database()
+        if team:
+            db.teams.update_one(
+                {'user_name': user_name},
+                {'$set': {'team': team, 'updated_at': datetime.now()}},
+                upsert=True
+            )
+        else:
+            db.teams.delete_one({'user_name': user_name})
+        _team_cache.clear()
+        return jsonify({"message": "Team updated", "user_name": user_name, "team": team})
+    except Exception as e:
+        logger.error(f"Error updating team: {str(e)}")
+        return jsonify({"error": "Team update failed"}), 500
+
+@app.route('/api/cleanup', methods=['POST'])
+@login_required
+def trigger_cleanup():
+    """Manually trigger the data retention job"""
+    try:
+        if not scheduler.run_now('retention'):
+            return jsonify({"error": "Cleanup is already running"}), 409
+        return jsonify({"message": "Cleanup started"}), 202
+    except Exception as e:
+        logger.error(f"Cleanup error: {str(e)}")
+        return jsonify({"error": "Cleanup failed"}), 500
+
+# 更新主程序部分，完善錯誤處理
+if __name__ == "__main__":
+    try:
+        print("初始化 Activity Tracker API...")
+        
+        # 確保數據目錄存在
+        ensure_data_directory()
+        
+        # 初始化應用
+        init_app()
+        
+        # 檢查是否以打包方式運行
+        if getattr(sys, 'frozen', False):
+            # 生產模式 - 使用 waitress
+            from waitress import serve
+            
+            # 輸出清晰的啟動信息
+            # print("=" * 50)
+            # print(" Activity Tracker API 服務已啟動")
+            # print(" 訪問地址: http://127.0.0.1:5000")
+            # print("=" * 50)
+            
+            # 啟動生產服務器
+            # 預讀請求才能偵測用戶端中斷連線並取消其查詢（waitress.client_disconnected）
+            serve(app, host='0.0.0.0', port=5000,
+                  channel_request_lookahead=QUERY_CONFIG.get('REQUEST_LOOKAHEAD', 5))
+            # 127.0.0.1
+        else:
+            debug_mode = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
+            if debug_mode:
+                print("警告: 調試模式已啟用，這會帶來安全風險")
+                print("僅用於開發環境，切勿在生產環境中啟用")
+            # 開發模式 - 使用 Flask 開發服務器
+            app.run(
+                host='0.0.0.0',
+                port=5000,
+                debug=False,  
+                use_reloader=False
+            )
+    except OSError as e:
+        # 處理端口被占用等情況
+        error_msg = f"啟動服務器時出錯: {str(e)}"
+        logger.error(error_msg)
+        print(f"錯誤: {error_msg}")
+        
+        if "Address already in use" in str(e):
+            print("端口 5000 已被佔用，可能是另一個 Activity Tracker API 實例正在運行")
+            
+        # 在打包環境中保持窗口開啟
+        if getattr(sys, 'frozen', False):
+            input("按 Enter 鍵退出...")
+    except Exception as e:
+        # 處理其他所有異常
+        error_msg = f"應用程序啟動錯誤: {str(e)}"
+        logger.error(error_msg)
+        print(f"錯誤: {error_msg}")
+        print(f"詳細信息: {type(e).__name__}")
+        
+        # 顯示完整的異常信息
+        import traceback
+        traceback.print_exc()
+        
+        # 在打包環境中保持窗口開啟
+        if getattr(sys, 'frozen', False):
             input("按 Enter 鍵退出...")
\ No newline at end of file
@@ -0,0 +1,317 @@
+import os
+import time
+import json
+import base64
+import hashlib
+import hmac
+import logging
+import secrets
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import api_metrics
+
+try:
+    from argon2 import PasswordHasher
+    from argon2.exceptions import VerifyMismatchError, InvalidHashError
+except ImportError:
+    PasswordHasher = None
+
+
+class AuthBusyError(Exception):
+    """Raised when the password hashing pool is saturated"""
+
+
+class PasswordHasherPool:
+    """
+    Password hashing with a tunable KDF (scrypt by default, argon2id when
+    argon2-cffi is installed and selected), executed in a small dedicated
+    thread pool so that hashing cannot occupy every request thread.
+
+    Legacy unsalted sha256 hex digests are still accepted and reported by
+    ``needs_rehash`` so they can be upgraded on the next successful login.
+    """
+
+    def __init__(self, config=None):
+        config = config or {}
+        self.algorithm = config.get('KDF', 'scrypt')
+        if self.algorithm == 'argon2' and PasswordHasher is None:
+            self.algorithm = 'scrypt'
+        self.scrypt_n = config.get('SCRYPT_N', 2 ** 14)
+        self.scrypt_r = config.get('SCRYPT_R', 8)
+        self.scrypt_p = config.get('SCRYPT_P', 1)
+        self.timeout = config.get('KDF_TIMEOUT', 10)
+        workers = config.get('KDF_WORKERS', 2)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='kdf')
+        # 限制排隊中的雜湊工作數量，超過時直接拒絕而非無限排隊
+        self._slots = threading.BoundedSemaphore(config.get('KDF_MAX_PENDING', workers * 8))
+        if self.algorithm == 'argon2':
+            self._argon2 = PasswordHasher(
+                time_cost=config.get('ARGON2_TIME_COST', 2),
+                memory_cost=config.get('ARGON2_MEMORY_COST', 19456),
+                parallelism=config.get('ARGON2_PARALLELISM', 1))
+        self._dummy_hash = None
+
+    # --- synchronous primitives (run inside the pool) ---
+
+    def _hash(self, password):
+        if self.algorithm == 'argon2':
+            return self._argon2.hash(password)
+        salt = os.urandom(16)
+        digest = hashlib.scrypt(password.encode(), salt=salt, n=self.scrypt_n, r=self.scrypt_r,
+                                p=self.scrypt_p, maxmem=256 * self.scrypt_n * self.scrypt_r)
+        return 'scrypt${}${}${}${}${}'.format(
+            self.scrypt_n, self.scrypt_r, self.scrypt_p,
+            base64.b64encode(salt).decode(), base64.b64encode(digest).decode())
+
+    def _verify(self, password, stored):
+        if not stored:
+            return False
+        if stored.startswith('$argon2'):
+            if PasswordHasher is None:
+                return False
+            try:
+                return PasswordHasher().verify(stored, password)
+            except (VerifyMismatchError, InvalidHashError):
+                return False
+        if stored.startswith('scrypt$'):
+            try:
+                _, n, r, p, salt, digest = stored.split('$')
+                n, r, p = int(n), int(r), int(p)
+                expected = base64.b64decode(digest)
+                actual = hashlib.scrypt(password.encode(), salt=base64.b64decode(salt),
+                                        n=n, r=r, p=p, maxmem=256 * n * r, dklen=len(expected))
+            except ValueError:
+                return False
+            return hmac.compare_digest(actual, expected)
+        # 舊版 sha256 雜湊
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(legacy, stored)
+
+    def _verify_unknown(self, password):
+        # 帳號不存在（或沒有密碼）時仍以相同的 KDF 驗證一次，避免以回應時間判斷帳號是否存在
+        if self._dummy_hash is None:
+            self._dummy_hash = self._hash(secrets.token_urlsafe(16))
+        self._verify(password, self._dummy_hash)
+        return False
+
+    def needs_rehash(self, stored):
+        """True if the stored hash uses a legacy or outdated KDF configuration"""
+        if self.algorithm == 'argon2':
+            if not stored.startswith('$argon2'):
+                return True
+            return self._argon2.check_needs_rehash(stored)
+        return not stored.startswith(f'scrypt${self.scrypt_n}${self.scrypt_r}${self.scrypt_p}$')
+
+    # --- pooled API used by request handlers ---
+
+    def _submit(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            raise AuthBusyError("Password hashing queue is full")
+        try:
+            future = self._executor.submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise AuthBusyError("Password hashing timed out")
+
+    def hash_password(self, password):
+        return self._submit(self._hash, password)
+
+    def verify_password(self, password, stored):
+        """Verify against ``stored``; without a stored hash (unknown user) the KDF still runs and False is returned"""
+        if not stored:
+            return self._submit(self._verify_unknown, password)
+        return self._submit(self._verify, password, stored)
+
+
+class SQLiteSessionBackend:
+    """Local persistent session storage so sessions survive an API restart"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('CREATE TABLE IF NOT EXISTS sessions (sid TEXT PRIMARY KEY, data TEXT, expires REAL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires)')
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def get(self, sid):
+        row = self._conn().execute('SELECT data, expires FROM sessions WHERE sid = ?', (sid,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, sid, data, expires):
+        conn = self._conn()
+        conn.execute('INSERT OR REPLACE INTO sessions (sid, data, expires) VALUES (?, ?, ?)',
+                     (sid, json.dumps(data), expires))
+        conn.commit()
+
+    def delete(self, sid):
+        conn = self._conn()
+        conn.execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+        conn.commit()
+
+    def purge_expired(self):
+        conn = self._conn()
+        deleted = conn.execute('DELETE FROM sessions WHERE expires < ?', (time.time(),)).rowcount
+        conn.commit()
+        return deleted
+
+
+class SessionStore:
+    """
+    In-memory LRU session cache with an optional persistent backend. Expired
+    sessions are purged from the backend at most every ``purge_interval``
+    seconds, when a session is saved.
+    """
+
+    def __init__(self, capacity=10000, backend=None, purge_interval=3600):
+        self.capacity = capacity
+        self.backend = backend
+        self.purge_interval = purge_interval
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self._next_purge = time.time() + purge_interval
+
+    def get(self, sid):
+        now = time.time()
+        with self._lock:
+            item = self._items.get(sid)
+            if item is not None:
+                self._items.move_to_end(sid)
+        api_metrics.record_cache('session', item is not None)
+        if item is None and self.backend is not None:
+            item = self.backend.get(sid)
+            if item is not None:
+                self._remember(sid, item)
+        if item is None:
+            return None
+        data, expires = item
+        if expires < now:
+            self.delete(sid)
+            return None
+        return data
+
+    def _remember(self, sid, item):
+        with self._lock:
+            self._items[sid] = item
+            self._items.move_to_end(sid)
+            while len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+
+    def set(self, sid, data, expires):
+        self._remember(sid, (data, expires))
+        if self.backend is not None:
+            self.backend.set(sid, data, expires)
+            self._purge_if_due()
+
+    def _purge_if_due(self):
+        now = time.time()
+        with self._lock:
+            if now < self._next_purge:
+                return
+            self._next_purge = now + self.purge_interval
+        try:
+            self.backend.purge_expired()
+        except sqlite3.Error as e:
+            # 下一個間隔再試，不影響本次請求
+            logging.warning(f"Unable to purge expired sessions: {e}")
+
+    def delete(self, sid):
+        with self._lock:
+            self._items.pop(sid, None)
+        if self.backend is not None:
+            self.backend.delete(sid)
+
+
+def _make_session_interface(store):
+    from flask.sessions import SessionInterface, SessionMixin
+    from werkzeug.datastructures import CallbackDict
+
+    class ServerSideSession(CallbackDict, SessionMixin):
+        def __init__(self, initial=None, sid=None, new=False):
+            def on_update(self):
+                self.modified = True
+            super().__init__(initial, on_update)
+            self.sid = sid
+            self.new = new
+            self.modified = False
+            self.rotate = False
+
+    class ServerSideSessionInterface(SessionInterface):
+        """Keeps session data on the server; the cookie only carries a random session id"""
+
+        def _new_sid(self):
+            return secrets.token_urlsafe(32)
+
+        def open_session(self, app, request):
+            sid = request.cookies.get(self.get_cookie_name(app))
+            if sid:
+                data = store.get(sid)
+                if data is not None:
+                    return ServerSideSession(data, sid=sid)
+            return ServerSideSession(sid=self._new_sid(), new=True)
+
+        def save_session(self, app, session, response):
+            name = self.get_cookie_name(app)
+            domain = self.get_cookie_domain(app)
+            path = self.get_cookie_path(app)
+            if not session:
+                if session.modified:
+                    store.delete(session.sid)
+                    response.delete_cookie(name, domain=domain, path=path)
+                return
+            if session.rotate:
+                # 登入後更換 session id，避免 session fixation
+                store.delete(session.sid)
+                session.sid = self._new_sid()
+            if not (session.modified or session.rotate or self.should_set_cookie(app, session)):
+                return
+            expires = self.get_expiration_time(app, session)
+            lifetime = app.permanent_session_lifetime.total_seconds()
+            store.set(session.sid, dict(session), time.time() + lifetime)
+            response.set_cookie(name, session.sid, expires=expires, domain=domain, path=path,
+                                httponly=self.get_cookie_httponly(app),
+                                secure=self.get_cookie_secure(app),
+                                samesite=self.get_cookie_samesite(app))
+
+    return ServerSideSessionInterface()
+
+
+def rotate_session(session):
+    """Issue a fresh session id for this session when the response is saved"""
+    if hasattr(session, 'rotate'):
+        session.rotate = True
+
+
+def init_auth(app, data_dir, config=None):
+    """Install the server-side session store on the Flask app and return the password hasher pool"""
+    config = config or {}
+    backend = None
+    if config.get('SESSION_BACKEND', 'memory') == 'sqlite':
+        backend = SQLiteSessionBackend(config.get('SESSION_DB', os.path.join(data_dir, 'sessions.db')))
+    store = SessionStore(config.get('SESSION_CACHE_SIZE', 10000), backend,
+                         config.get('SESSION_PURGE_SECONDS', 3600))
+    app.session_interface = _make_session_interface(store)
+    app.extensions['session_store'] = store
+    return PasswordHasherPool(config)
+
+
+def ensure_user_index(db):
+    """Ensure the unique username index backing the login lookup"""
+    db.users.create_index('username', unique=True)
@@ -0,0 +1,112 @@
+"""
+Agent in-memory state over simulated weeks of uptime.
+
+Feeds AFK sessions and per-app usage for ``--days`` simulated days into the
+bounded structures from agent_sessions.py and into the unbounded list /
+dict-of-dicts they replaced, and reports the traced memory of each at the
+end of every simulated week:
+
+    python bench/bench_agent_memory.py --days 56 --sessions-per-day 400 --apps-per-day 60
+
+Fails if the bounded structures grow over the second half of the run by
+more than ``--max-growth-kb``. The first weeks include one-time growth of
+interpreter tables (the interned-string dict resizes once to hold a day's
+titles), so they are not compared.
+"""
+import sys
+import random
+import argparse
+import tracemalloc
+from datetime import datetime, timedelta
+
+import harness  # noqa: F401  (adds the repository root to sys.path)
+from agent_sessions import SessionHistory, AppUsageTable
+from time_codec import date_string, format_clock, format_duration
+
+DAY = 86400
+
+
+def _window(rng, day):
+    # 視窗標題每天有部分是新的（文件名稱、網頁標題），與實際桌面相同
+    if rng.random() < 0.3:
+        return f"Report {day}-{rng.randint(0, 50)}.xlsx - Excel"
+    return rng.choice(['Inbox - Outlook', 'Microsoft Teams', 'app.py - Visual Studio Code', 'Google Chrome'])
+
+
+def simulate_bounded(args, start):
+    sessions = SessionHistory(max_sessions=args.history, max_age_seconds=args.max_age_hours * 3600)
+    usage = AppUsageTable(max_apps=args.max_apps)
+    rng = random.Random(args.seed)
+    for day in range(args.days):
+        midnight = start + day * DAY
+        usage.roll(date_string(datetime.fromtimestamp(midnight)))
+        for i in range(args.sessions_per_day):
+            begin = midnight + i * (DAY / args.sessions_per_day)
+            window = _window(rng, day)
+            sessions.append(rng.choice(('afk', 'work')), window, begin, begin + 60)
+            entry = usage.add(f"app{day}_{rng.randint(0, args.apps_per_day)}.exe", window, r'C:\Program Files\app.exe')
+            entry.total_time += 60
+        yield day
+
+
+def simulate_unbounded(args, start):
+    sessions = []
+    usage = {}
+    rng = random.Random(args.seed)
+    for day in range(args.days):
+        midnight = start + day * DAY
+        for i in range(args.sessions_per_day):
+            begin = datetime.fromtimestamp(midnight + i * (DAY / args.sessions_per_day))
+            window = _window(rng, day)
+            sessions.append({'date': date_string(begin), 'username': 'bench', 'window': window,
+                             'type': rng.choice(('afk', 'work')), 'start_time': format_clock(begin),
+                             'end_time': format_clock(begin + timedelta(seconds=60)),
+                             'duration': format_duration(60)})
+            name = f"app{day}_{rng.randint(0, args.apps_per_day)}.exe"
+            if name not in usage:
+                usage[name] = {'total_time': 0, 'title': window, 'path': r'C:\Program Files\app.exe'}
+            usage[name]['total_time'] += 60
+        yield day
+
+
+def measure(simulation, args):
+    """Traced memory (KB) held by a simulation at the end of each week"""
+    start = datetime(2025, 1, 6).timestamp()
+    weekly = []
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    for day in simulation(args, start):
+        if (day + 1) % 7 == 0 or day + 1 == args.days:
+            weekly.append((tracemalloc.get_traced_memory()[0] - baseline) / 1024)
+    tracemalloc.stop()
+    return weekly
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Agent memory over simulated uptime')
+    parser.add_argument('--days', type=int, default=56)
+    parser.add_argument('--sessions-per-day', type=int, default=400)
+    parser.add_argument('--apps-per-day', type=int, default=60)
+    parser.add_argument('--history', type=int, default=500)
+    parser.add_argument('--max-age-hours', type=float, default=24)
+    parser.add_argument('--max-apps', type=int, default=500)
+    parser.add_argument('--max-growth-kb', type=float, default=64)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    bounded = measure(simulate_bounded, args)
+    unbounded = measure(simulate_unbounded, args)
+    print(f"{'week':>4s} {'bounded KB':>11s} {'list/dict KB':>13s}")
+    for week, (new, old) in enumerate(zip(bounded, unbounded), 1):
+        print(f"{week:4d} {new:11.1f} {old:13.1f}")
+
+    middle = len(bounded) // 2
+    growth = bounded[-1] - bounded[middle]
+    ok = growth <= args.max_growth_kb
+    print(f"\n{'OK  ' if ok else 'FAIL'} bounded growth from week {middle + 1} to week {len(bounded)}: "
+          f"{growth:.1f} KB (limit {args.max_growth_kb} KB)")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
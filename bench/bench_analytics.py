@@ -0,0 +1,109 @@
+"""
+Cost and accuracy of the /api/analytics endpoints over a date range:
+
+    top-apps      merge the daily Count-Min sketches and rank the candidates
+    percentiles   merge the daily t-digests of per-user AFK time
+
+Synthetic per-user daily app and AFK times (Zipf-distributed app choice,
+log-normal durations) are fed through ``SketchFeed`` and every day is
+closed, as the scheduler would. The estimates are compared with the exact
+values computed from the same data.
+
+    python bench/bench_analytics.py --days 31 --users 500 --apps 2000
+    python bench/bench_analytics.py --uri mongodb://localhost:27017/ --days 90
+"""
+import sys
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+
+from harness import open_database
+from database.analytics import (SKETCH_COLLECTION, SketchFeed, close_day, ensure_sketch_indexes, percentiles,
+                                top_apps)
+from time_codec import date_string
+
+
+def _timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def _exact_quantile(values, q):
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark sketch-backed analytics queries')
+    parser.add_argument('--uri', help='MongoDB connection string (default: in-process mongomock)')
+    parser.add_argument('--database', default='activity_tracker_bench')
+    parser.add_argument('--days', type=int, default=31)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--apps', type=int, default=500)
+    parser.add_argument('--sessions', type=int, default=40, help='app sessions per user and day')
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    db = open_database(args.uri, args.database)
+    db.drop_collection(SKETCH_COLLECTION)
+    ensure_sketch_indexes(db)
+    feed = SketchFeed()
+    feed.team_of = lambda db, user_name: None
+
+    apps = [f"app-{index}.exe" for index in range(args.apps)]
+    weights = [1 / (rank + 1) for rank in range(args.apps)]
+    users = [f"user{index:05d}" for index in range(args.users)]
+    exact_apps = {}
+    exact_afk = []
+    dates = [date_string(datetime.now() - timedelta(days=offset)) for offset in range(args.days, 0, -1)]
+    started = time.perf_counter()
+    for date in dates:
+        app_updates = []
+        afk_updates = []
+        for user_name in users:
+            for app_name in rng.choices(apps, weights, k=args.sessions):
+                seconds = round(rng.lognormvariate(5, 1))
+                app_updates.append((date, user_name, app_name, seconds))
+                exact_apps[app_name] = exact_apps.get(app_name, 0) + seconds
+            afk = round(rng.lognormvariate(7.5, 0.6))
+            afk_updates.append((date, user_name, afk))
+            exact_afk.append(afk)
+        # 以每位使用者為一批，模擬 ingest 的更新次數
+        for index in range(0, len(app_updates), args.sessions):
+            feed.apply(db, app_updates[index:index + args.sessions], [])
+        feed.apply(db, [], afk_updates)
+        close_day(db, date)
+    load = time.perf_counter() - started
+
+    start_date, end_date = dates[0], dates[-1]
+    top_time, top = _timed(lambda: top_apps(db, start_date, end_date, limit=args.limit), args.repeat)
+    quantiles = (0.5, 0.9, 0.99)
+    pct_time, pct = _timed(lambda: percentiles(db, start_date, end_date, 'afk', quantiles), args.repeat)
+
+    exact_top = sorted(exact_apps, key=exact_apps.get, reverse=True)[:args.limit]
+    found = [row['app_name'] for row in top['apps']]
+    recall = len(set(found) & set(exact_top)) / len(exact_top)
+    worst = max(abs(row['seconds'] - exact_apps.get(row['app_name'], 0)) for row in top['apps'])
+
+    print(f"{args.days} days x {args.users} users, {args.apps} apps; sketches built in {load:.1f}s")
+    print(f"top-apps     {top_time * 1000:8.1f} ms  recall@{args.limit} {recall:.0%}, "
+          f"worst overestimate {worst:.0f}s (bound {top['error_bound_seconds']:.0f}s)")
+    print(f"percentiles  {pct_time * 1000:8.1f} ms  over {pct['count']} user-days")
+    for q in quantiles:
+        exact = _exact_quantile(exact_afk, q)
+        estimate = pct['values'][q]
+        print(f"  p{q * 100:g}: {estimate:9.0f}s  exact {exact:9.0f}s  ({(estimate - exact) / exact:+.2%})")
+    return 0 if recall >= 0.9 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""
+Storage size of the heartbeat collections with and without label encoding.
+
+Generates the same synthetic data twice, once as the agents wrote it before
+and once with app_title / app_path / window dictionary-encoded
+(database/labels.py), and compares the sizes:
+
+    python bench/bench_label_storage.py --users 5 --days 2
+    python bench/bench_label_storage.py --uri mongodb://localhost:27017/
+
+Without --uri the data goes to mongomock and the BSON size of the documents
+is reported; with --uri the collStats data, storage and index sizes are
+reported (the databases are dropped first).
+"""
+import sys
+import argparse
+
+import bson
+
+from harness import open_database
+from generate_data import populate
+
+COLLECTIONS = ('activities', 'afk', 'labels')
+
+
+def _sizes(db, real):
+    sizes = {}
+    for name in COLLECTIONS:
+        if real:
+            stats = db.command('collStats', name) if name in db.list_collection_names() else {}
+            sizes[name] = {'documents': stats.get('count', 0), 'data_bytes': stats.get('size', 0),
+                           'storage_bytes': stats.get('storageSize', 0),
+                           'index_bytes': stats.get('totalIndexSize', 0)}
+        else:
+            docs = list(db[name].find())
+            sizes[name] = {'documents': len(docs),
+                           'data_bytes': sum(len(bson.encode(doc)) for doc in docs)}
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare storage with and without label encoding')
+    parser.add_argument('--uri', help='MongoDB connection string (default: in-process mongomock)')
+    parser.add_argument('--database', default='activity_tracker_bench')
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--days', type=int, default=2)
+    parser.add_argument('--interval', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    results = {}
+    for variant, labels in (('plain', False), ('labels', True)):
+        db = open_database(args.uri, f"{args.database}_{variant}")
+        for name in COLLECTIONS:
+            db.drop_collection(name)
+        populate(db, args.users, args.days, seed=args.seed, interval=args.interval, labels=labels)
+        results[variant] = _sizes(db, bool(args.uri))
+
+    columns = [key for key in results['plain']['activities'] if key != 'documents']
+    print(f"{'collection':12s} {'variant':8s} {'documents':>10s} " + ' '.join(f"{c:>14s}" for c in columns))
+    for name in COLLECTIONS:
+        for variant in ('plain', 'labels'):
+            row = results[variant][name]
+            print(f"{name:12s} {variant:8s} {row['documents']:10d} "
+                  + ' '.join(f"{row[c]:14d}" for c in columns))
+
+    plain = sum(results['plain'][name]['data_bytes'] for name in COLLECTIONS)
+    encoded = sum(results['labels'][name]['data_bytes'] for name in COLLECTIONS)
+    print(f"\ntotal data: {plain} -> {encoded} bytes ({100 * (1 - encoded / plain):.1f}% smaller, "
+          f"labels collection included)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""
+Login throughput benchmark.
+
+Registers users through /api/register and then hammers /api/login from
+several client threads, reporting logins/s and latency percentiles for the
+configured KDF and hashing pool size.
+
+    python bench/bench_login.py --users 20 --threads 8 --duration 10
+"""
+import sys
+import time
+import argparse
+import threading
+import statistics
+
+from harness import open_database, load_api
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return round(ordered[index] * 1000, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark login throughput')
+    parser.add_argument('--uri', help='MongoDB connection string (default: in-process mongomock)')
+    parser.add_argument('--database', default='activity_tracker_bench')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0)
+    args = parser.parse_args()
+
+    db = open_database(args.uri, args.database)
+    db.drop_collection('users')
+    api = load_api(db)
+    client = api.app.test_client()
+    for i in range(args.users):
+        client.post('/api/register', json={'username': f'bench{i}', 'password': f'password{i}'})
+
+    latencies, failures = [], []
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def worker(index):
+        local_client = api.app.test_client()
+        i = index
+        while not stop.is_set():
+            user = i % args.users
+            started = time.perf_counter()
+            response = local_client.post('/api/login', json={'username': f'bench{user}',
+                                                             'password': f'password{user}'})
+            elapsed = time.perf_counter() - started
+            with lock:
+                (latencies if response.status_code == 200 else failures).append(elapsed)
+            i += args.threads
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    hasher = api.password_hasher
+    print(f"KDF={hasher.algorithm} workers={hasher._executor._max_workers} client threads={args.threads}")
+    print(f"logins/s={len(latencies) / elapsed:.1f} failed/busy={len(failures)}")
+    if latencies:
+        print(f"latency p50={_percentile(latencies, 50)}ms p99={_percentile(latencies, 99)}ms "
+              f"mean={statistics.mean(latencies) * 1000:.2f}ms")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
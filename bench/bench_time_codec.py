@@ -0,0 +1,117 @@
+"""
+Micro-benchmark of time_codec against the strptime / strftime / str(timedelta)
+code it replaced on the agent and API hot paths.
+
+    python bench/bench_time_codec.py
+    python bench/bench_time_codec.py --number 200000 --repeat 7
+
+Each case also checks that both implementations return the same value
+(durations are compared in seconds, since str(timedelta) is not zero-padded).
+"""
+import sys
+import json
+import timeit
+import argparse
+from datetime import datetime, timedelta
+
+import harness  # noqa: F401  (adds the repository root to sys.path)
+import time_codec
+
+NOW = datetime(2025, 2, 28, 17, 24, 56)
+STAMP = NOW.timestamp()
+
+
+def _old_split(value):
+    parts = value.split(':')
+    return int(parts[0]) * 3600 + int(parts[1]) * 60 + int(parts[2])
+
+
+def _old_total_time(logon, logoff):
+    # app.py get_data 在改用 time_codec 之前的寫法
+    if ' ' in logon and ' ' in logoff:
+        diff = datetime.strptime(logoff, '%Y-%m-%d %H:%M:%S') - datetime.strptime(logon, '%Y-%m-%d %H:%M:%S')
+    else:
+        start = datetime.strptime(logon, '%H:%M:%S')
+        end = datetime.strptime(logoff, '%H:%M:%S')
+        if end < start:
+            end += timedelta(days=1)
+        diff = end - start
+    hours, remainder = divmod(diff.seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+
+# (名稱, 舊寫法, 新寫法, 比較結果前的正規化)
+CASES = [
+    ('parse datetime',
+     lambda: datetime.strptime('2025-02-28 17:24:56', '%Y-%m-%d %H:%M:%S'),
+     lambda: time_codec.parse_datetime('2025-02-28 17:24:56'), None),
+    ('parse date',
+     lambda: datetime.strptime('2025-02-28', '%Y-%m-%d'),
+     lambda: time_codec.parse_date('2025-02-28'), None),
+    ('parse duration',
+     lambda: _old_split('07:12:45'),
+     lambda: time_codec.parse_duration('07:12:45'), None),
+    ('parse duration (no cache)',
+     lambda: _old_split('07:12:45'),
+     lambda: time_codec.parse_duration.__wrapped__('07:12:45'), None),
+    ('activity total_time',
+     lambda: _old_total_time('2025-02-28 09:00:00', '2025-02-28 17:24:56'),
+     lambda: time_codec.format_duration(time_codec.time_span('2025-02-28 09:00:00', '2025-02-28 17:24:56')),
+     None),
+    ('afk merge duration',
+     lambda: _old_total_time('23:59:30', '00:00:45'),
+     lambda: time_codec.format_duration(time_codec.clock_span('23:59:30', '00:00:45')), None),
+    ('format duration',
+     lambda: str(timedelta(seconds=int(25931.7))),
+     lambda: time_codec.format_duration(25931.7), time_codec.parse_duration),
+    ('format datetime',
+     lambda: NOW.strftime('%Y-%m-%d %H:%M:%S'),
+     lambda: time_codec.format_datetime(NOW), None),
+    ('format clock (timestamp)',
+     lambda: datetime.fromtimestamp(STAMP).strftime('%H:%M:%S'),
+     lambda: time_codec.format_timestamp_clock(STAMP), None),
+    ('today date string',
+     lambda: datetime.now().strftime('%Y-%m-%d'),
+     lambda: time_codec.date_string(), None),
+]
+
+
+def _best(func, number, repeat):
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark time_codec against strptime / strftime')
+    parser.add_argument('--number', type=int, default=100000, help='calls per timing run')
+    parser.add_argument('--repeat', type=int, default=5, help='take the fastest of N runs')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    failures = 0
+    report = {}
+    print(f"{'case':26s} {'old ns':>9s} {'new ns':>9s} {'speedup':>8s}")
+    for name, old, new, normalize in CASES:
+        normalize = normalize or (lambda value: value)
+        if normalize(old()) != normalize(new()):
+            print(f"{name:26s} MISMATCH old={old()!r} new={new()!r}")
+            failures += 1
+            continue
+        old_ns = _best(old, args.number, args.repeat)
+        new_ns = _best(new, args.number, args.repeat)
+        report[name] = {'old_ns': round(old_ns, 1), 'new_ns': round(new_ns, 1),
+                        'speedup': round(old_ns / new_ns, 2)}
+        print(f"{name:26s} {old_ns:9.0f} {new_ns:9.0f} {old_ns / new_ns:7.1f}x")
+
+    # 超過 24 小時的持續時間：str(timedelta) 會輸出 '1 day, 1:00:00'
+    print(f"\nformat_duration(90000) = {time_codec.format_duration(90000)!r}, "
+          f"str(timedelta) = {str(timedelta(seconds=90000))!r}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
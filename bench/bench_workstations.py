@@ -0,0 +1,86 @@
+"""
+Cost of the /api/workstations computation for one day:
+
+    single      one workstation_summary over the whole day
+    fan-out     the day split into workstation partitions queried concurrently
+                (as /api/workstations does for days not rolled up yet)
+    rollup      reading the day's daily_workstations documents
+
+    python bench/bench_workstations.py --users 200 --partition-size 25
+    python bench/bench_workstations.py --uri mongodb://localhost:27017/ --users 2000
+
+Without --uri the data goes to mongomock, where the fan-out cannot run in
+parallel; use a real server to measure it.
+"""
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from harness import open_database
+from generate_data import populate
+from database.rollup import WORKSTATION_COLLECTION, rollup_day, workstation_summary
+from time_codec import date_string
+
+
+def _timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark per-workstation daily aggregates')
+    parser.add_argument('--uri', help='MongoDB connection string (default: in-process mongomock)')
+    parser.add_argument('--database', default='activity_tracker_bench')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--interval', type=int, default=30)
+    parser.add_argument('--partition-size', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    db = open_database(args.uri, args.database)
+    for name in ('activities', 'afk', 'user_idle_times', 'daily_usage', WORKSTATION_COLLECTION):
+        db.drop_collection(name)
+    populate(db, args.users, 1, seed=args.seed, interval=args.interval)
+    db.activities.create_index([('date', 1), ('workstation_name', 1)])
+    date = date_string()
+    query = {'date': date}
+
+    single, rows = _timed(lambda: workstation_summary(db, query), args.repeat)
+
+    workstations = sorted(db.activities.distinct('workstation_name', query))
+    partitions = [workstations[i:i + args.partition_size]
+                  for i in range(0, len(workstations), args.partition_size)]
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+
+    def fan_out():
+        futures = [executor.submit(workstation_summary, db, dict(query, workstation_name={'$in': partition}))
+                   for partition in partitions]
+        return [row for future in futures for row in future.result()]
+
+    fanned, fan_rows = _timed(fan_out, args.repeat)
+    if len(fan_rows) != len(rows):
+        print(f"mismatch: single={len(rows)} fan-out={len(fan_rows)} rows")
+        return 1
+
+    rollup_day(db, date)
+    rolled, rolled_rows = _timed(lambda: list(db[WORKSTATION_COLLECTION].find({'date': date}, {'_id': 0})),
+                                 args.repeat)
+
+    print(f"{len(workstations)} workstations, {db.activities.count_documents(query)} heartbeats, "
+          f"{len(partitions)} partitions")
+    for name, seconds, count in (('single', single, len(rows)), ('fan-out', fanned, len(fan_rows)),
+                                 ('rollup', rolled, len(rolled_rows))):
+        print(f"{name:8s} {seconds * 1000:9.1f} ms  {count} rows")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
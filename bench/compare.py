@@ -0,0 +1,41 @@
+"""
+Compare two benchmark result files.
+
+    python bench/compare.py bench/results/abc1234.json bench/results/def5678.json
+"""
+import sys
+import json
+import argparse
+
+
+def load(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files')
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--metric', default='median_ms')
+    args = parser.parse_args()
+
+    baseline = load(args.baseline)
+    candidate = load(args.candidate)
+    if baseline.get('params') != candidate.get('params') or baseline.get('backend') != candidate.get('backend'):
+        print("Warning: results were produced with different parameters or backends")
+
+    print(f"{'case':32s} {baseline['commit']:>12s} {candidate['commit']:>12s} {'change':>9s}")
+    names = list(baseline['results']) + [n for n in candidate['results'] if n not in baseline['results']]
+    for name in names:
+        old = baseline['results'].get(name, {}).get(args.metric)
+        new = candidate['results'].get(name, {}).get(args.metric)
+        if old is None or new is None:
+            print(f"{name:32s} {str(old):>12s} {str(new):>12s} {'n/a':>9s}")
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        print(f"{name:32s} {old:12.3f} {new:12.3f} {change:+8.1f}%")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
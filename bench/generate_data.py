@@ -0,0 +1,218 @@
+"""
+Synthetic data generator for benchmarks.
+
+Fills ``activities``, ``afk`` and ``user_idle_times`` with documents shaped
+exactly like the ones written by ``log_to_database`` (Monitoring Script.py),
+``AFK._save_to_mongodb`` (afk.py) and ``save_user_idle_time``.
+
+    python bench/generate_data.py --users 50 --days 7 --uri mongodb://localhost:27017/
+"""
+import random
+import argparse
+from datetime import datetime, timedelta
+
+from harness import open_database
+
+from database.mongo_config import TIME_SERIES_COLLECTIONS, time_series_meta
+from database.labels import LabelEncoder
+from time_codec import DATETIME_FORMAT, format_duration
+
+APPS = [
+    ('chrome.exe', 'Google Chrome', r'C:\Program Files\Google\Chrome\Application\chrome.exe'),
+    ('OUTLOOK.EXE', 'Inbox - Outlook', r'C:\Program Files\Microsoft Office\root\Office16\OUTLOOK.EXE'),
+    ('EXCEL.EXE', 'Book1 - Excel', r'C:\Program Files\Microsoft Office\root\Office16\EXCEL.EXE'),
+    ('WINWORD.EXE', 'Document1 - Word', r'C:\Program Files\Microsoft Office\root\Office16\WINWORD.EXE'),
+    ('Teams.exe', 'Microsoft Teams', r'C:\Users\Public\AppData\Local\Microsoft\Teams\current\Teams.exe'),
+    ('Code.exe', 'app.py - Visual Studio Code', r'C:\Program Files\Microsoft VS Code\Code.exe'),
+    ('explorer.exe', 'File Explorer', r'C:\Windows\explorer.exe'),
+    ('System_Locked', 'Windows鎖定畫面', '系統'),
+]
+
+
+def generate_activities(rng, user, workstation, day, interval=10):
+    """Yield one user's activity snapshots for one day, one every ``interval`` seconds"""
+    date_str = day.strftime('%Y-%m-%d')
+    boot = day.replace(hour=8, minute=rng.randint(0, 30), second=rng.randint(0, 59))
+    boot_str = boot.strftime(DATETIME_FORMAT)
+    end_of_day = day.replace(hour=17, minute=rng.randint(30, 59))
+    now = boot + timedelta(minutes=rng.randint(1, 10))
+    usage = {}
+    idle_seconds = 0
+
+    while now < end_of_day:
+        app_name, app_title, app_path = rng.choice(APPS)
+        session_length = rng.randint(30, 1800)
+        logon = now
+        app_start = (boot + timedelta(seconds=rng.randint(0, 600))).strftime(DATETIME_FORMAT)
+        elapsed = 0
+        while elapsed < session_length and now < end_of_day:
+            step = min(interval, session_length - elapsed)
+            elapsed += step
+            now += timedelta(seconds=step)
+            usage[app_name] = usage.get(app_name, 0) + step
+            if rng.random() < 0.05:
+                idle_seconds += step
+            total = format_duration(usage[app_name])
+            yield {
+                'workstation_name': workstation,
+                'user_name': user,
+                'logon_time': logon.strftime(DATETIME_FORMAT),
+                'logoff_time': now.strftime(DATETIME_FORMAT),
+                'idle_time': format_duration(idle_seconds),
+                'active_time': format_duration((now - boot).total_seconds()),
+                'app_name': app_name,
+                'app_title': app_title,
+                'app_path': app_path,
+                'total_time': total,
+                'boot_time': boot_str,
+                'app_start_time': app_start,
+                'sum_time': total,
+                'system_working_time': format_duration((now - boot).total_seconds()),
+                'date': date_str,
+                'created_at': now,
+            }
+
+
+def generate_afk(rng, user, day, heartbeat=5, idle_threshold=300):
+    """Yield one user's AFK heartbeats and closed AFK sessions for one day"""
+    date_str = day.strftime('%Y-%m-%d')
+    now = day.replace(hour=8, minute=rng.randint(30, 59))
+    end_of_day = day.replace(hour=17, minute=rng.randint(30, 59))
+    window = rng.choice(APPS)[1]
+
+    while now < end_of_day:
+        # 工作區段：每 heartbeat 秒一筆心跳
+        work_until = now + timedelta(seconds=rng.randint(600, 5400))
+        while now < work_until and now < end_of_day:
+            yield {
+                'date': date_str,
+                'username': user,
+                'user_name': user,
+                'window': window,
+                'type': 'work',
+                'status': 'Work',
+                'start_time': (now - timedelta(seconds=heartbeat)).strftime('%H:%M:%S'),
+                'end_time': now.strftime('%H:%M:%S'),
+                'duration': format_duration(heartbeat),
+                'is_heartbeat': True,
+                'timestamp': now,
+            }
+            now += timedelta(seconds=heartbeat)
+
+        # AFK 區段：閒置門檻後開始 AFK 心跳，結束時寫入完整 AFK 會話
+        now += timedelta(seconds=idle_threshold)
+        afk_start = now
+        afk_until = now + timedelta(seconds=rng.randint(60, 2400))
+        while now < afk_until and now < end_of_day:
+            yield {
+                'date': date_str,
+                'username': user,
+                'user_name': user,
+                'window': window,
+                'type': 'afk',
+                'status': 'AFK',
+                'start_time': now.strftime('%H:%M:%S'),
+                'end_time': (now + timedelta(seconds=1)).strftime('%H:%M:%S'),
+                'duration': format_duration(1),
+                'is_heartbeat': True,
+                'timestamp': now,
+            }
+            now += timedelta(seconds=heartbeat)
+        yield {
+            'date': date_str,
+            'username': user,
+            'window': window,
+            'type': 'afk',
+            'start_time': afk_start.strftime('%H:%M:%S'),
+            'end_time': now.strftime('%H:%M:%S'),
+            'duration': format_duration((now - afk_start).total_seconds()),
+            'timestamp': now,
+        }
+        window = rng.choice(APPS)[1]
+
+
+def populate(db, users=10, days=3, seed=42, interval=10, end_date=None, batch_size=5000,
+             time_series=False, labels=False):
+    """
+    Fill ``db`` with users x days of synthetic data, ending at ``end_date``
+    (default today). Returns the number of documents written per collection.
+    With ``time_series`` the heartbeat documents carry the ``meta`` field
+    used by time-series collections; with ``labels`` the long string fields
+    are dictionary-encoded like the agents do (database/labels.py).
+    """
+    rng = random.Random(seed)
+    end_date = (end_date or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+    counts = {'activities': 0, 'afk': 0, 'user_idle_times': 0}
+    encoder = LabelEncoder(min_length=16, cache_size=100000) if labels else None
+
+    def _flush(collection, batch):
+        if batch:
+            if time_series:
+                for doc in batch:
+                    doc['meta'] = time_series_meta(doc.get('user_name', doc.get('username')),
+                                                   doc.get('workstation_name', workstation))
+            if encoder is not None:
+                for doc in batch:
+                    encoder.encode_document(db, collection, doc)
+            db[collection].insert_many(batch, ordered=False)
+            counts[collection] += len(batch)
+            batch.clear()
+
+    for u in range(users):
+        user = f"user{u:04d}"
+        workstation = f"WS-{u:04d}"
+        for d in range(days):
+            day = end_date - timedelta(days=days - 1 - d)
+            batch = []
+            for doc in generate_activities(rng, user, workstation, day, interval):
+                batch.append(doc)
+                if len(batch) >= batch_size:
+                    _flush('activities', batch)
+            _flush('activities', batch)
+
+            for doc in generate_afk(rng, user, day):
+                batch.append(doc)
+                if len(batch) >= batch_size:
+                    _flush('afk', batch)
+            _flush('afk', batch)
+
+            db.user_idle_times.update_one(
+                {'user_name': user, 'date': day.strftime('%Y-%m-%d')},
+                {'$set': {'idle_time': format_duration(rng.randint(0, 3600)), 'last_updated': day}},
+                upsert=True
+            )
+            counts['user_idle_times'] += 1
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic activity tracker data')
+    parser.add_argument('--uri', help='MongoDB connection string (default: in-process mongomock)')
+    parser.add_argument('--database', default='activity_tracker_bench')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--days', type=int, default=3)
+    parser.add_argument('--interval', type=int, default=10, help='seconds between activity snapshots')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--drop', action='store_true', help='drop existing collections first')
+    parser.add_argument('--labels', action='store_true',
+                        help='dictionary-encode app_title / app_path / window into the labels collection')
+    parser.add_argument('--time-series', action='store_true',
+                        help='store activities/afk as time-series collections (MongoDB 5.0+)')
+    args = parser.parse_args()
+
+    db = open_database(args.uri, args.database)
+    if args.drop:
+        for name in ('activities', 'afk', 'user_idle_times', 'labels'):
+            db.drop_collection(name)
+    if args.time_series:
+        existing = set(db.list_collection_names())
+        for name, options in TIME_SERIES_COLLECTIONS.items():
+            if name not in existing:
+                db.create_collection(name, timeseries=options)
+    counts = populate(db, args.users, args.days, args.seed, args.interval, time_series=args.time_series,
+                      labels=args.labels)
+    print(f"Generated {counts} in {args.database}")
+
+
+if __name__ == '__main__':
+    main()
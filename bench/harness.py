@@ -0,0 +1,159 @@
+import os
+import sys
+import time
+import uuid
+import types
+import importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def _bulk_write_as_loop(self, requests, ordered=True, **kwargs):
+    """bulk_write applied one operation at a time with the plain collection methods"""
+    from pymongo import InsertOne, UpdateOne, UpdateMany, ReplaceOne, DeleteOne, DeleteMany
+
+    for request in requests:
+        if isinstance(request, InsertOne):
+            self.insert_one(request._doc)
+        elif isinstance(request, UpdateOne):
+            self.update_one(request._filter, request._doc, upsert=request._upsert)
+        elif isinstance(request, UpdateMany):
+            self.update_many(request._filter, request._doc, upsert=request._upsert)
+        elif isinstance(request, ReplaceOne):
+            self.replace_one(request._filter, request._doc, upsert=request._upsert)
+        elif isinstance(request, DeleteOne):
+            self.delete_one(request._filter)
+        elif isinstance(request, DeleteMany):
+            self.delete_many(request._filter)
+        else:
+            raise TypeError(f"Unsupported bulk operation: {request!r}")
+
+
+def _ensure_mongomock_bulk_write(db):
+    # mongomock 4.3 的 bulk_write 與 pymongo 4.9 以上的操作物件不相容（多了 sort 參數），
+    # 此時改為逐筆套用，讓使用 bulk_write 的彙總 / sketch 程式碼可以在 mongomock 上執行
+    import mongomock
+    from pymongo import UpdateOne
+
+    probe = db['_bulk_write_probe']
+    try:
+        probe.bulk_write([UpdateOne({'_id': 1}, {'$set': {'ok': True}}, upsert=True)])
+    except TypeError:
+        mongomock.collection.Collection.bulk_write = _bulk_write_as_loop
+    db.drop_collection('_bulk_write_probe')
+
+
+def open_database(uri=None, database='activity_tracker_bench'):
+    """Return a database handle on a real MongoDB (uri) or an in-process mongomock stand-in"""
+    if uri:
+        from pymongo import MongoClient
+        return MongoClient(uri)[database]
+    import mongomock
+    db = mongomock.MongoClient()[database]
+    _ensure_mongomock_bulk_write(db)
+    return db
+
+
+def install_fake_os_hooks(window_title='Visual Studio Code', idle_ms=0):
+    """
+    Install stand-ins for the Windows / input-hook modules the agents import
+    (win32gui, win32process, win32api, win32con, pynput), so the real writer
+    code can run on any platform.
+    """
+    started = time.monotonic()
+
+    win32gui = types.ModuleType('win32gui')
+    win32gui.GetForegroundWindow = lambda: 1
+    win32gui.GetWindowText = lambda hwnd: window_title
+
+    win32process = types.ModuleType('win32process')
+    win32process.GetWindowThreadProcessId = lambda hwnd: (0, os.getpid())
+
+    win32api = types.ModuleType('win32api')
+    win32api.GetTickCount = lambda: int((time.monotonic() - started) * 1000) + idle_ms
+    win32api.GetLastInputInfo = lambda: int((time.monotonic() - started) * 1000)
+
+    win32con = types.ModuleType('win32con')
+
+    class _Listener:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def start(self):
+            pass
+
+        def stop(self):
+            pass
+
+    pynput = types.ModuleType('pynput')
+    pynput.mouse = types.ModuleType('pynput.mouse')
+    pynput.keyboard = types.ModuleType('pynput.keyboard')
+    pynput.mouse.Listener = _Listener
+    pynput.keyboard.Listener = _Listener
+
+    for name, module in (('win32gui', win32gui), ('win32process', win32process),
+                         ('win32api', win32api), ('win32con', win32con),
+                         ('pynput', pynput), ('pynput.mouse', pynput.mouse),
+                         ('pynput.keyboard', pynput.keyboard)):
+        sys.modules.setdefault(name, module)
+
+
+class _NoIngest:
+    """Stand-in for ``IngestClient``: the agents under test never send to a configured API"""
+
+    @staticmethod
+    def from_config(agent, metrics=None):
+        return None
+
+
+def check_writes_land(writer, db, agent):
+    """Raise unless a write queued on an agent's ``writer`` reaches ``db``"""
+    marker = uuid.uuid4().hex
+    writer.bench_probe.insert_one({'_id': marker, 'agent': agent})
+    if not writer.flush() or db.bench_probe.count_documents({'_id': marker}) != 1:
+        raise RuntimeError(f"{agent} writes do not reach the benchmark database")
+    db.bench_probe.delete_one({'_id': marker})
+
+
+def load_monitoring_script(db):
+    """
+    Import 'Monitoring Script.py' with its database handle pointed at ``db``.
+    The module's writer is created at import time, so it is replaced with a
+    DirectWriter on ``db`` (also when mongo_config.json configures ingest).
+    """
+    from ingest_client import DirectWriter
+
+    install_fake_os_hooks()
+    module = sys.modules.get('monitoring_script')
+    if module is None:
+        spec = importlib.util.spec_from_file_location(
+            'monitoring_script', os.path.join(ROOT, 'Monitoring Script.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules['monitoring_script'] = module
+    module.get_database = lambda: db
+    if db is not None:
+        module.ingest = None
+        module.writer = DirectWriter(lambda: db, agent='ActivityMonitor', metrics=module.agent_metrics)
+        check_writes_land(module.writer, db, 'ActivityMonitor')
+    return module
+
+
+def load_afk(db):
+    """Import afk.py with its database handle pointed at ``db`` (trackers created afterwards write there)"""
+    install_fake_os_hooks()
+    import afk
+    afk.get_database = lambda: db
+    afk.IngestClient = _NoIngest
+    return afk
+
+
+def load_api(db):
+    """Import app.py and return a Flask test client whose queries go to ``db``"""
+    import app
+    app.db = db
+    app.read_db = db
+    app.get_database = lambda *args, **kwargs: db
+    return app
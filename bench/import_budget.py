@@ -0,0 +1,109 @@
+"""
+Import-time budget check for the agents and the API.
+
+Imports each entry point in a fresh interpreter with ``-X importtime``,
+reports the total and the slowest modules, and fails if a budget is
+exceeded or a module that must stay lazy is imported at startup:
+
+    python bench/import_budget.py
+    python bench/import_budget.py --runs 5 --top 15
+
+The Windows / input-hook modules are replaced by the harness stand-ins, so
+the check measures the repository's own import graph on any platform.
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+from harness import ROOT
+
+# (名稱, 匯入程式碼, 預算毫秒, 啟動時不得載入的模組)
+TARGETS = [
+    ('ActivityMonitor',
+     "import importlib.util; "
+     "spec = importlib.util.spec_from_file_location('monitoring_script', r'{root}/Monitoring Script.py'); "
+     "module = importlib.util.module_from_spec(spec); spec.loader.exec_module(module)",
+     150, ('pandas', 'pymongo', 'bson', 'dotenv', 'sqlite3', 'zipfile')),
+    ('AFKTracker', "import afk", 150, ('pandas', 'pymongo', 'bson', 'dotenv')),
+    ('API', "import app", 600, ('pandas',)),
+]
+
+_PRELUDE = ("import sys; sys.path.insert(0, r'{bench}'); sys.path.insert(0, r'{root}'); "
+            "from harness import install_fake_os_hooks; install_fake_os_hooks(); ")
+
+
+def parse_importtime(stderr):
+    """Return {module: (self_us, cumulative_us)} and the top-level import order"""
+    modules = {}
+    top_level = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, values = line.split(':', 1)
+        self_us, cumulative_us, name = values.split('|', 2)
+        depth = len(name) - len(name.lstrip())
+        name = name.strip()
+        modules[name] = (int(self_us), int(cumulative_us))
+        if depth <= 1:
+            top_level.append(name)
+    return modules, top_level
+
+
+def measure(code, runs):
+    """Run ``code`` ``runs`` times; return the fastest run's total (ms) and module table"""
+    best = None
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    prelude = _PRELUDE.format(bench=os.path.dirname(os.path.abspath(__file__)), root=ROOT)
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', prelude + code.format(root=ROOT)],
+            cwd=ROOT, env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip().splitlines()[-1])
+        modules, top_level = parse_importtime(result.stderr)
+        # harness 與直譯器本身的匯入不計入預算
+        baseline = sum(modules[name][1] for name in top_level if name in ('harness', 'site', 'encodings'))
+        total = sum(modules[name][1] for name in top_level) - baseline
+        if best is None or total < best[0]:
+            best = (total, modules)
+    return best[0] / 1000.0, best[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check import-time budgets')
+    parser.add_argument('--runs', type=int, default=3, help='take the fastest of N runs')
+    parser.add_argument('--top', type=int, default=10, help='slowest modules to list')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    failures = 0
+    report = {}
+    for name, code, budget_ms, forbidden in TARGETS:
+        try:
+            total_ms, modules = measure(code, args.runs)
+        except RuntimeError as e:
+            print(f"{name}: import failed: {e}")
+            failures += 1
+            continue
+        loaded = sorted(module for module in forbidden if module in modules)
+        ok = total_ms <= budget_ms and not loaded
+        failures += 0 if ok else 1
+        print(f"{'OK  ' if ok else 'FAIL'} {name:16s} {total_ms:8.1f} ms (budget {budget_ms} ms)"
+              f"{'  eagerly imports: ' + ', '.join(loaded) if loaded else ''}")
+        slowest = sorted(modules.items(), key=lambda item: item[1][0], reverse=True)[:args.top]
+        for module, (self_us, cumulative_us) in slowest:
+            print(f"       {self_us / 1000:8.1f} ms self {cumulative_us / 1000:8.1f} ms cumulative  {module}")
+        report[name] = {'total_ms': round(total_ms, 1), 'budget_ms': budget_ms, 'eager': loaded,
+                        'slowest': [{'module': module, 'self_ms': self_us / 1000}
+                                    for module, (self_us, _) in slowest]}
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,270 @@
+"""
+Load-test harness: a fleet of simulated agents plus polling dashboards.
+
+Each simulated desktop runs the real writer code from ``Monitoring Script.py``
+(``get_idle_time`` + ``log_to_database`` once per second) and ``afk.py``
+(``AFK.check_afk_status`` heartbeat loop) with the Windows/input hooks faked
+and its own MongoDB connection, like a real desktop. Dashboards poll the API
+endpoints of a running server. For every fleet size the harness reports write
+throughput, p50/p99 endpoint latency and MongoDB opcounters, producing a
+capacity curve. Write throughput counts the queued writes the agents'
+``DirectWriter`` threads actually applied (``sent``), not the agent calls,
+which only append to the queue.
+
+    python app.py &
+    python bench/load_test.py --uri mongodb://localhost:27017/ --api http://127.0.0.1:5000 \\
+        --fleet 10,50,200 --dashboards 5 --duration 60
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import urllib.request
+from datetime import datetime, timedelta
+
+from harness import ROOT, install_fake_os_hooks, load_monitoring_script, load_afk
+
+from time_codec import format_datetime, format_duration
+
+ENDPOINTS = ['/api/activities', '/api/usage', '/api/afk', '/api/afk/summary']
+
+_agent_local = threading.local()
+_connection = {}
+_clients = []
+_writers = []
+_clients_lock = threading.Lock()
+
+
+def _thread_database():
+    """
+    The calling thread's own MongoDB connection, opened on first use. The
+    agents' DirectWriter threads call it too, so every simulated desktop
+    writes over its own connection, like a real desktop.
+    """
+    db = getattr(_agent_local, 'db', None)
+    if db is None:
+        from pymongo import MongoClient
+        client = MongoClient(_connection['uri'])
+        with _clients_lock:
+            _clients.append(client)
+        db = _agent_local.db = client[_connection['database']]
+    return db
+
+
+def _close_clients():
+    with _clients_lock:
+        clients = list(_clients)
+        _clients.clear()
+        _writers.clear()
+    for client in clients:
+        client.close()
+
+
+def _register_writer(writer):
+    with _clients_lock:
+        _writers.append(writer)
+    return writer
+
+
+def _writer_totals():
+    """(writes applied, failed batches) over every simulated desktop's write queue"""
+    with _clients_lock:
+        writers = list(_writers)
+    return sum(writer.sent for writer in writers), sum(writer.failed_batches for writer in writers)
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def add(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+def _percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return round(ordered[index] * 1000, 2)
+
+
+def run_monitoring_agent(index, args, monitoring, stop, errors):
+    """Simulate the Monitoring Script main loop for one desktop"""
+    from ingest_client import DirectWriter
+    _agent_local.writer = _register_writer(
+        DirectWriter(_thread_database, agent='ActivityMonitor', metrics=monitoring.agent_metrics))
+    rng = random.Random(index)
+    user = f"load{index:05d}"
+    workstation = f"LOAD-WS-{index:05d}"
+    boot = datetime.now() - timedelta(hours=1)
+    boot_str = boot.strftime('%Y-%m-%d %H:%M:%S')
+    logon_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    app_name, total = 'Code.exe', 0
+    time.sleep(rng.random())
+
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            idle_time = monitoring.get_idle_time(user)
+            if rng.random() < 0.02:
+                app_name, total = rng.choice(['chrome.exe', 'EXCEL.EXE', 'OUTLOOK.EXE', 'Code.exe']), 0
+            total += 1
+            now = datetime.now()
+            total_hms = format_duration(total)
+            monitoring.log_to_database(
+                workstation, user, logon_str, format_datetime(now), idle_time,
+                format_duration((now - boot).total_seconds()), app_name,
+                f"{app_name} window", f"C:\\Program Files\\{app_name}", total_hms, boot_str,
+                boot_str, total_hms, format_duration((now - boot).total_seconds()))
+        except Exception:
+            errors.add()
+        stop.wait(max(0.0, 1.0 - (time.perf_counter() - started)))
+    _agent_local.writer.close()
+
+
+def run_afk_agent(index, args, afk_module, stop):
+    """Run the real AFK heartbeat loop for one desktop until ``stop`` is set"""
+    tracker = afk_module.AFK()
+    tracker.username = f"load{index:05d}"
+    _register_writer(tracker.db)
+
+    tracker.running = True
+    loop = threading.Thread(target=tracker.check_afk_status, daemon=True)
+    loop.start()
+    stop.wait()
+    tracker.running = False
+    loop.join(timeout=10)
+    tracker.db.close()
+
+
+def run_dashboard(index, args, stop, latencies, errors):
+    """Poll the API endpoints round-robin, recording latency per endpoint"""
+    rng = random.Random(1000 + index)
+    while not stop.is_set():
+        endpoint = rng.choice(ENDPOINTS)
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(args.api.rstrip('/') + endpoint, timeout=args.timeout) as response:
+                response.read()
+            latencies[endpoint].append(time.perf_counter() - started)
+        except Exception:
+            errors.add()
+        stop.wait(args.poll_interval)
+
+
+def _opcounters(db):
+    try:
+        return dict(db.command('serverStatus')['opcounters'])
+    except Exception:
+        return {}
+
+
+def run_step(fleet, args, monitoring, afk_module, admin_db):
+    stop = threading.Event()
+    write_errors, poll_errors = Counter(), Counter()
+    latencies = {endpoint: [] for endpoint in ENDPOINTS}
+    threads = []
+
+    for i in range(fleet):
+        threads.append(threading.Thread(target=run_monitoring_agent, daemon=True,
+                                        args=(i, args, monitoring, stop, write_errors)))
+        threads.append(threading.Thread(target=run_afk_agent, daemon=True,
+                                        args=(i, args, afk_module, stop)))
+    for i in range(args.dashboards):
+        threads.append(threading.Thread(target=run_dashboard, daemon=True,
+                                        args=(i, args, stop, latencies, poll_errors)))
+
+    for thread in threads:
+        thread.start()
+    # 預熱後才開始計算
+    time.sleep(args.warmup)
+    sent_before, failed_before = _writer_totals()
+    ops_before = _opcounters(admin_db)
+    for samples in latencies.values():
+        samples.clear()
+    started = time.perf_counter()
+    time.sleep(args.duration)
+    elapsed = time.perf_counter() - started
+    # 代理程式的寫入只是放入佇列，以寫入執行緒實際套用的筆數計算吞吐量
+    sent_after, failed_after = _writer_totals()
+    ops_after = _opcounters(admin_db)
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=10)
+    _close_clients()
+
+    return {
+        'fleet': fleet,
+        'dashboards': args.dashboards,
+        'duration_s': round(elapsed, 1),
+        'writes_per_s': round((sent_after - sent_before) / elapsed, 1),
+        'write_errors': write_errors.value,
+        'failed_batches': failed_after - failed_before,
+        'poll_errors': poll_errors.value,
+        'endpoints': {
+            endpoint: {'requests': len(samples), 'p50_ms': _percentile(samples, 50),
+                       'p99_ms': _percentile(samples, 99)}
+            for endpoint, samples in latencies.items()
+        },
+        'mongo_ops_per_s': {
+            op: round((ops_after[op] - ops_before.get(op, 0)) / elapsed, 1)
+            for op in ops_after
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate a fleet of agents and dashboards')
+    parser.add_argument('--uri', default='mongodb://localhost:27017/')
+    parser.add_argument('--database', default='activity_tracker',
+                        help='must match the database the API server reads from')
+    parser.add_argument('--api', default='http://127.0.0.1:5000')
+    parser.add_argument('--fleet', default='10,50,100', help='comma-separated fleet sizes')
+    parser.add_argument('--dashboards', type=int, default=5)
+    parser.add_argument('--poll-interval', type=float, default=5.0)
+    parser.add_argument('--duration', type=float, default=30.0, help='measured seconds per step')
+    parser.add_argument('--warmup', type=float, default=5.0)
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--output', help='JSON capacity curve output file')
+    args = parser.parse_args()
+
+    from pymongo import MongoClient
+    admin_db = MongoClient(args.uri)[args.database]
+
+    install_fake_os_hooks(idle_ms=0)
+    _connection.update(uri=args.uri, database=args.database)
+    monitoring = load_monitoring_script(None)
+    monitoring.get_database = _thread_database
+    # 每台模擬桌機使用自己的寫入佇列（見 run_monitoring_agent）
+    monitoring.get_write_database = lambda: _agent_local.writer
+    afk_module = load_afk(None)
+    afk_module.get_database = _thread_database
+
+    curve = []
+    for fleet in [int(size) for size in args.fleet.split(',') if size.strip()]:
+        print(f"Running fleet of {fleet} desktops with {args.dashboards} dashboards...")
+        result = run_step(fleet, args, monitoring, afk_module, admin_db)
+        curve.append(result)
+        latency = ', '.join(f"{endpoint} p50={stats['p50_ms']} p99={stats['p99_ms']}"
+                            for endpoint, stats in result['endpoints'].items())
+        print(f"  writes/s={result['writes_per_s']} errors={result['write_errors']}/{result['poll_errors']} "
+              f"failed batches={result['failed_batches']} {latency}")
+        print(f"  mongo ops/s={result['mongo_ops_per_s']}")
+
+    output = args.output or os.path.join(ROOT, 'bench', 'results',
+                                         f"load_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({'timestamp': datetime.now().isoformat(timespec='seconds'),
+                   'api': args.api, 'capacity_curve': curve}, f, indent=2)
+    print(f"Capacity curve written to {output}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
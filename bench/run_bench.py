@@ -0,0 +1,204 @@
+"""
+Benchmark runner for the API endpoints and the agent write path.
+
+Seeds a database with ``generate_data.populate`` (mongomock by default, or a
+real MongoDB with --uri), times every case and writes a JSON result file that
+can be compared across commits with ``bench/compare.py``. The default backend
+needs ``mongomock``; note that mongomock does not implement ``$function``, so
+/api/usage and /api/afk/summary are only measurable against a real MongoDB.
+The agent cases flush the agent's write queue, so they time the MongoDB
+writes and not only the append to the queue.
+
+    python bench/run_bench.py --users 20 --days 3
+    python bench/run_bench.py --uri mongodb://localhost:27017/ --output bench/results/local.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+from datetime import datetime
+
+from harness import ROOT, open_database, load_api, load_monitoring_script, load_afk, check_writes_land
+from generate_data import populate
+
+CASES = {}
+
+
+def case(name):
+    """Register a benchmark case; the function receives the context and runs one iteration"""
+    def decorator(func):
+        CASES[name] = func
+        return func
+    return decorator
+
+
+def _get(ctx, path):
+    response = ctx['client'].get(path)
+    if response.status_code != 200:
+        raise RuntimeError(f"{path} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+    return response
+
+
+@case('api.activities.today')
+def bench_activities_today(ctx):
+    _get(ctx, '/api/activities')
+
+
+@case('api.activities.range')
+def bench_activities_range(ctx):
+    _get(ctx, f"/api/activities?start_date={ctx['start_date']}&end_date={ctx['end_date']}")
+
+
+@case('api.usage')
+def bench_usage(ctx):
+    _get(ctx, '/api/usage')
+
+
+@case('api.afk')
+def bench_afk(ctx):
+    _get(ctx, '/api/afk')
+
+
+@case('api.afk.user')
+def bench_afk_user(ctx):
+    _get(ctx, '/api/afk?username=user0000')
+
+
+@case('api.afk.summary')
+def bench_afk_summary(ctx):
+    _get(ctx, '/api/afk/summary')
+
+
+def _flush(writer):
+    # 代理程式只把寫入放進佇列，計時包含實際寫入 MongoDB
+    if not writer.flush():
+        raise RuntimeError(f"{writer.agent} writes failed: {writer.stats()}")
+
+
+@case('agent.log_to_database')
+def bench_log_to_database(ctx):
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    ctx['monitoring'].log_to_database(
+        'WS-BENCH', 'bench', now, now, '0:00:00', '1:00:00', 'Code.exe',
+        'app.py - Visual Studio Code', r'C:\Program Files\Microsoft VS Code\Code.exe',
+        '0:10:00', now, now, '0:10:00', '1:00:00')
+    _flush(ctx['monitoring'].writer)
+
+
+@case('agent.afk_save')
+def bench_afk_save(ctx):
+    tracker = ctx['afk_tracker']
+    tracker._save_to_mongodb({
+        'date': datetime.now().strftime('%Y-%m-%d'),
+        'username': 'bench',
+        'user_name': 'bench',
+        'window': 'Visual Studio Code',
+        'type': 'work',
+        'status': 'Work',
+        'start_time': '09:00:00',
+        'end_time': '09:00:05',
+        'duration': '00:00:05',
+        'is_heartbeat': True,
+    })
+    _flush(tracker.db)
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return 'unknown'
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def run_case(func, ctx, repeat, warmup):
+    for _ in range(warmup):
+        func(ctx)
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(ctx)
+        samples.append(time.perf_counter() - start)
+    return {
+        'repeat': repeat,
+        'min_ms': round(min(samples) * 1000, 3),
+        'median_ms': round(statistics.median(samples) * 1000, 3),
+        'mean_ms': round(statistics.mean(samples) * 1000, 3),
+        'p95_ms': round(_percentile(samples, 95) * 1000, 3),
+        'max_ms': round(max(samples) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run activity tracker benchmarks')
+    parser.add_argument('--uri', help='MongoDB connection string (default: in-process mongomock)')
+    parser.add_argument('--database', default='activity_tracker_bench')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--days', type=int, default=3)
+    parser.add_argument('--interval', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--filter', default='', help='only run cases whose name contains this string')
+    parser.add_argument('--output', help='result file (default: bench/results/<commit>.json)')
+    args = parser.parse_args()
+
+    db = open_database(args.uri, args.database)
+    for name in ('activities', 'afk', 'user_idle_times'):
+        db.drop_collection(name)
+    seed_start = time.perf_counter()
+    counts = populate(db, args.users, args.days, args.seed, args.interval)
+    print(f"Seeded {counts} in {time.perf_counter() - seed_start:.1f}s")
+
+    api = load_api(db)
+    monitoring = load_monitoring_script(db)
+    afk_module = load_afk(db)
+    ctx = {
+        'client': api.app.test_client(),
+        'monitoring': monitoring,
+        'afk_tracker': afk_module.AFK(),
+        'start_date': min(db.activities.distinct('date')),
+        'end_date': max(db.activities.distinct('date')),
+    }
+    check_writes_land(ctx['afk_tracker'].db, db, 'AFKTracker')
+
+    results = {}
+    for name, func in CASES.items():
+        if args.filter not in name:
+            continue
+        try:
+            results[name] = run_case(func, ctx, args.repeat, args.warmup)
+            print(f"{name:32s} median {results[name]['median_ms']:10.3f} ms   p95 {results[name]['p95_ms']:10.3f} ms")
+        except Exception as e:
+            results[name] = {'error': str(e)}
+            print(f"{name:32s} ERROR {e}")
+
+    report = {
+        'commit': _git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'backend': 'mongodb' if args.uri else 'mongomock',
+        'params': {'users': args.users, 'days': args.days, 'interval': args.interval,
+                   'seed': args.seed, 'repeat': args.repeat},
+        'documents': counts,
+        'results': results,
+    }
+    output = args.output or os.path.join(ROOT, 'bench', 'results', f"{report['commit']}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
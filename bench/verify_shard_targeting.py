@@ -0,0 +1,232 @@
+"""
+Verify that API queries are shard-targeted under the documented shard keys.
+
+Stand-in mode (default) routes documents across N in-process mongomock
+"shards" by hashing the shard key user field, like mongos would, and records
+how many shards every find/aggregate issued by the API had to visit:
+
+    python bench/verify_shard_targeting.py --shards 4 --users 20
+
+With --uri pointing at a real mongos, the same query shapes are explained
+and the number of shards in the winning plan is reported instead.
+"""
+import sys
+import hashlib
+import argparse
+
+from harness import open_database, load_api
+from generate_data import populate
+
+from database.sharding import SHARD_KEYS, USER_FIELDS, register_agent
+
+
+def _shard_for(value, shard_count):
+    digest = hashlib.md5(str(value).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'little') % shard_count
+
+
+def _users_in_filter(query, user_field):
+    """Values of the shard key user field constrained by a query, or None if unconstrained"""
+    if not query or user_field not in query:
+        return None
+    condition = query[user_field]
+    if isinstance(condition, dict):
+        if '$in' in condition:
+            return list(condition['$in'])
+        if '$eq' in condition:
+            return [condition['$eq']]
+        return None
+    return [condition]
+
+
+class _Cursor(list):
+    def sort(self, keys, direction=None):
+        if isinstance(keys, str):
+            keys = [(keys, direction or 1)]
+        for key, order in reversed(keys):
+            super().sort(key=lambda doc: (doc.get(key) is None, doc.get(key, '')), reverse=order < 0)
+        return self
+
+
+class ShardedCollection:
+    """Routes writes by shard key and records how many shards each read targets"""
+
+    def __init__(self, router, name):
+        self.router = router
+        self.name = name
+        self.user_field = USER_FIELDS[name]
+        self.shards = [shard[name] for shard in router.shards]
+
+    def _targets(self, query):
+        users = _users_in_filter(query, self.user_field)
+        if users is None:
+            return list(range(len(self.shards)))
+        return sorted({_shard_for(user, len(self.shards)) for user in users})
+
+    def _record(self, operation, query):
+        targets = self._targets(query)
+        self.router.log.append({
+            'endpoint': self.router.current,
+            'collection': self.name,
+            'operation': operation,
+            'targeted': len(targets),
+            'shards': len(self.shards),
+            'has_shard_key': _users_in_filter(query, self.user_field) is not None,
+        })
+        return targets
+
+    def insert_one(self, doc):
+        return self.shards[_shard_for(doc.get(self.user_field), len(self.shards))].insert_one(doc)
+
+    def insert_many(self, docs, ordered=True):
+        for doc in docs:
+            self.insert_one(doc)
+
+    def update_one(self, query, update, upsert=False):
+        targets = self._record('update_one', query)
+        return self.shards[targets[0]].update_one(query, update, upsert=upsert)
+
+    def find(self, query=None, projection=None, **kwargs):
+        results = _Cursor()
+        for index in self._record('find', query):
+            results.extend(self.shards[index].find(query or {}, projection, **kwargs))
+        return results
+
+    def aggregate(self, pipeline, **kwargs):
+        match = pipeline[0].get('$match') if pipeline and '$match' in pipeline[0] else None
+        targets = self._record('aggregate', match)
+        # 與 mongos 相同：在目標分片上 $match，再於合併節點執行其餘管道
+        merged = self.router.merge_db[self.name]
+        merged.delete_many({})
+        for index in targets:
+            docs = list(self.shards[index].find(match or {}))
+            if docs:
+                merged.insert_many(docs)
+        return merged.aggregate(pipeline[1:] if match is not None else pipeline, **kwargs)
+
+    def distinct(self, key, query=None, **kwargs):
+        values = set()
+        for index in self._record('distinct', query):
+            values.update(self.shards[index].distinct(key, query or {}, **kwargs))
+        return list(values)
+
+    def delete_many(self, query):
+        for index in self._record('delete_many', query):
+            self.shards[index].delete_many(query)
+
+    def create_index(self, *args, **kwargs):
+        for shard in self.shards:
+            shard.create_index(*args, **kwargs)
+
+
+class ShardedDatabaseStandIn:
+    """A mongos stand-in over ``shard_count`` mongomock databases"""
+
+    def __init__(self, shard_count):
+        import mongomock
+        self.shards = [mongomock.MongoClient()[f'shard{i}'] for i in range(shard_count)]
+        self.merge_db = mongomock.MongoClient()['merge']
+        self.log = []
+        self.current = None
+        self.name = 'activity_tracker_sharded'
+
+    def __getitem__(self, name):
+        if name in SHARD_KEYS:
+            return ShardedCollection(self, name)
+        # 未分片的集合位於 primary shard
+        return self.shards[0][name]
+
+    __getattr__ = __getitem__
+
+    def command(self, *args, **kwargs):
+        return self.shards[0].command(*args, **kwargs)
+
+    def list_collection_names(self):
+        return self.shards[0].list_collection_names()
+
+    def drop_collection(self, name):
+        for shard in self.shards:
+            shard.drop_collection(name)
+
+
+def run_stand_in(args):
+    db = ShardedDatabaseStandIn(args.shards)
+    populate(db, args.users, args.days, seed=args.seed, interval=60)
+    for i in range(args.users):
+        register_agent(db, 'ActivityMonitor', f"user{i:04d}", f"WS-{i:04d}")
+    api = load_api(db)
+    client = api.app.test_client()
+
+    cases = [
+        ('/api/activities?username=user0000', 1),
+        ('/api/activities?users=user0000,user0001', 2),
+        ('/api/usage?username=user0000', 1),
+        ('/api/afk?username=user0000', 1),
+        ('/api/afk/summary?username=user0000', 1),
+        ('/api/activities', None),
+        ('/api/afk', None),
+    ]
+    failures = 0
+    for target_all in (False, True):
+        api.SHARD_TARGET_ALL_QUERIES = target_all
+        print(f"\nSHARDING.TARGET_ALL_QUERIES={target_all}")
+        for path, max_targets in cases:
+            db.log.clear()
+            db.current = path
+            response = client.get(path)
+            # 回應失敗或沒有記錄到任何查詢時，無法證明查詢有分片定向
+            if response.status_code != 200:
+                failures += 1
+                print(f"  FAIL {path:42s} HTTP {response.status_code}: "
+                      f"{' '.join(response.get_data(as_text=True).split())[:120]}")
+            queries = [entry for entry in db.log
+                       if entry['collection'] in SHARD_KEYS and entry['operation'] != 'update_one']
+            if not queries:
+                failures += 1
+                print(f"  FAIL {path:42s} no sharded queries recorded")
+            for entry in queries:
+                ok = entry['has_shard_key'] and (max_targets is None or entry['targeted'] <= max_targets)
+                if max_targets is None and not target_all:
+                    # 未指定使用者且未啟用展開時，預期為廣播查詢
+                    ok = True
+                failures += 0 if ok else 1
+                print(f"  {'OK  ' if ok else 'FAIL'} {path:42s} {entry['collection']:12s} {entry['operation']:9s} "
+                      f"{entry['targeted']}/{entry['shards']} shards"
+                      f"{'' if entry['has_shard_key'] else ' (broadcast)'}")
+    return failures
+
+
+def run_real(args):
+    db = open_database(args.uri, args.database)
+    shapes = [
+        ('activities', {'user_name': 'user0000', 'date': {'$gte': '2000-01-01'}}),
+        ('afk', {'username': 'user0000', 'date': {'$gte': '2000-01-01'}}),
+        ('user_idle_times', {'user_name': 'user0000', 'date': '2000-01-01'}),
+    ]
+    failures = 0
+    for collection, query in shapes:
+        plan = db.command('explain', {'find': collection, 'filter': query}, verbosity='queryPlanner')
+        shards = plan.get('queryPlanner', {}).get('winningPlan', {}).get('shards', [])
+        ok = len(shards) == 1
+        failures += 0 if ok else 1
+        print(f"{'OK  ' if ok else 'FAIL'} {collection:16s} {query} -> {len(shards)} shard(s)")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Verify shard targeting of API queries')
+    parser.add_argument('--uri', help='mongos connection string (default: in-process stand-in)')
+    parser.add_argument('--database', default='activity_tracker')
+    parser.add_argument('--shards', type=int, default=4)
+    parser.add_argument('--users', type=int, default=12)
+    parser.add_argument('--days', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    failures = run_real(args) if args.uri else run_stand_in(args)
+    print(f"\n{failures} failed or untargeted quer{'y' if failures == 1 else 'ies'}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
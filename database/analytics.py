@@ -0,0 +1,262 @@
+"""
+Daily analytics sketches for /api/analytics/top-apps and /api/analytics/percentiles.
+
+``analytics_sketches`` holds one document per (date, scope), where scope is
+``all`` or ``team:<name>``:
+
+    { _id: "<date>|<scope>", date, scope, source: "ingest" | "backfill",
+      cms: {<row>: {<column>: seconds}}, cms_total,   # app time Count-Min sketch
+      candidates: [<app name>, ...],                  # heavy-hitter candidates
+      app_users: {<user key>: seconds},               # active app time per user
+      afk_users: {<user key>: seconds},               # AFK time per user
+      digests: {app_time: [[mean, weight], ...], afk: [...]},
+      closed: true }
+
+/api/ingest feeds the open documents as it writes (``SketchFeed``): app time
+comes from the activity intervals in ``sessions`` (the growth of each
+interval's ``end``, read back in one query per batch) and AFK time from the
+finished AFK records. Every change is an ``$inc`` or ``$addToSet``, so API
+nodes update the same document concurrently without coordination; the
+ingest idempotency keys keep resent batches from being counted twice.
+
+The scheduler's ``sketches`` job closes past days: it turns the per-user
+totals into t-digests of daily app and AFK time per user and prunes the
+candidates to the day's heavy hitters. Days without ingest-fed documents
+(agents writing to MongoDB directly) are rebuilt from ``sessions`` and
+``afk`` by the same job.
+
+User keys are label IDs (database/labels.py) of the user name, which keeps
+arbitrary user names out of field paths.
+"""
+import time
+from datetime import datetime, timedelta
+
+import api_metrics
+from sketches import CountMinSketch, TDigest, sketch_cells, DEFAULT_WIDTH, DEFAULT_DEPTH
+from database.labels import label_id
+from database.rollup import LOCKED_APP
+from time_codec import date_string, parse_duration
+
+SKETCH_COLLECTION = 'analytics_sketches'
+
+# 每個文件保留的 heavy-hitter 候選數
+CANDIDATES_PER_DAY = 200
+
+# 指標 -> 每位使用者累計秒數的欄位
+METRIC_FIELDS = {'app_time': 'app_users', 'afk': 'afk_users'}
+
+# 使用者 -> 團隊對應的快取秒數
+TEAM_MAP_TTL = 60
+
+
+def sketch_id(date, scope):
+    return f"{date}|{scope}"
+
+
+def ensure_sketch_indexes(db):
+    db[SKETCH_COLLECTION].create_index([('scope', 1), ('date', 1)])
+    db[SKETCH_COLLECTION].create_index([('date', 1), ('source', 1)])
+    # 排程依日期找出需要補齊的日期並讀取當天的 activity 區段
+    db.sessions.create_index([('date', 1), ('source', 1)])
+
+
+class SketchFeed:
+    """Accumulates the sketch updates of an ingest batch and applies them"""
+
+    def __init__(self, width=DEFAULT_WIDTH, depth=DEFAULT_DEPTH):
+        self.width = width
+        self.depth = depth
+        self._teams = {}
+        self._teams_expire = 0
+
+    def team_of(self, db, user_name):
+        api_metrics.record_cache('sketch_teams', self._teams_expire > time.time())
+        if self._teams_expire <= time.time():
+            self._teams = {doc['user_name']: doc.get('team') for doc in
+                           db.teams.find({}, {'_id': 0, 'user_name': 1, 'team': 1})}
+            self._teams_expire = time.time() + TEAM_MAP_TTL
+        return self._teams.get(user_name)
+
+    def session_updates(self, db, operations):
+        """
+        App time of a batch of ``sessions`` upserts, as [(index, date, user, app, seconds)]
+        where ``index`` is the position of the operation in ``operations``.
+        Must be called before the upserts are written: the growth of each
+        interval is measured from its stored ``end``.
+        """
+        ids = [op['filter']['_id'] for op in operations]
+        if not ids:
+            return []
+        stored = {doc['_id']: doc for doc in db.sessions.find(
+            {'_id': {'$in': ids}}, {'end': 1, 'start': 1, 'state': 1, 'source': 1, 'user_name': 1, 'date': 1})}
+        updates = []
+        for index, op in enumerate(operations):
+            update = op['update']
+            values = dict(update.get('$setOnInsert', {}))
+            doc = stored.setdefault(op['filter']['_id'], values)
+            for field in ('start', 'state', 'source', 'user_name', 'date'):
+                doc.setdefault(field, values.get(field))
+            end = update.get('$set', {}).get('end')
+            previous = doc.get('end') or doc.get('start')
+            if doc.get('source') != 'activity' or not isinstance(end, datetime) \
+                    or not isinstance(previous, datetime):
+                continue
+            seconds = (end - previous).total_seconds()
+            doc['end'] = max(end, previous)
+            if seconds > 0 and doc.get('state') and doc.get('state') != LOCKED_APP:
+                updates.append((index, doc.get('date') or date_string(doc['start']), doc.get('user_name'),
+                                doc['state'], seconds))
+        return updates
+
+    @staticmethod
+    def afk_updates(docs):
+        """AFK time of inserted afk records (finished AFK periods only), as [(date, user, seconds)]"""
+        updates = []
+        for doc in docs:
+            if doc.get('type') != 'afk' or doc.get('is_heartbeat'):
+                continue
+            try:
+                seconds = parse_duration(doc.get('duration') or '00:00:00')
+            except ValueError:
+                continue
+            if seconds > 0:
+                updates.append((doc['date'], doc.get('username') or doc.get('user_name'), seconds))
+        return updates
+
+    def apply(self, db, app_updates, afk_updates, source='ingest'):
+        """Write the updates with one upsert per (date, scope) document"""
+        from pymongo import UpdateOne
+
+        changes = {}
+
+        def change(date, user_name):
+            scopes = ['all']
+            team = self.team_of(db, user_name)
+            if team:
+                scopes.append(f"team:{team}")
+            return [changes.setdefault((date, scope), {'inc': {}, 'apps': {}}) for scope in scopes]
+
+        for date, user_name, app_name, seconds in app_updates:
+            user = f"app_users.{label_id(user_name or '')}"
+            for entry in change(date, user_name):
+                inc = entry['inc']
+                for row, column in sketch_cells(app_name, self.width, self.depth):
+                    key = f"cms.{row}.{column}"
+                    inc[key] = inc.get(key, 0) + seconds
+                inc['cms_total'] = inc.get('cms_total', 0) + seconds
+                inc[user] = inc.get(user, 0) + seconds
+                entry['apps'][app_name] = entry['apps'].get(app_name, 0) + seconds
+        for date, user_name, seconds in afk_updates:
+            user = f"afk_users.{label_id(user_name or '')}"
+            for entry in change(date, user_name):
+                entry['inc'][user] = entry['inc'].get(user, 0) + seconds
+
+        operations = []
+        for (date, scope), entry in changes.items():
+            update = {'$setOnInsert': {'date': date, 'scope': scope, 'source': source}}
+            if entry['inc']:
+                update['$inc'] = entry['inc']
+            if entry['apps']:
+                # 本批次使用時間最多的應用程式加入候選，關閉當天時再依 sketch 估計值修剪
+                top = sorted(entry['apps'], key=entry['apps'].get, reverse=True)[:CANDIDATES_PER_DAY]
+                update['$addToSet'] = {'candidates': {'$each': top}}
+            operations.append(UpdateOne({'_id': sketch_id(date, scope)}, update, upsert=True))
+        if operations:
+            db[SKETCH_COLLECTION].bulk_write(operations, ordered=False)
+        return len(operations)
+
+
+def close_day(db, date, width=DEFAULT_WIDTH, depth=DEFAULT_DEPTH):
+    """Build the t-digests and prune the candidates of ``date``'s documents; returns the number closed"""
+    closed = 0
+    for doc in db[SKETCH_COLLECTION].find({'date': date, 'closed': {'$ne': True}}):
+        cms = CountMinSketch(width, depth).add_cells(doc.get('cms', {}), doc.get('cms_total', 0))
+        candidates = sorted(set(doc.get('candidates', [])), key=cms.estimate, reverse=True)
+        digests = {}
+        for metric, users_field in METRIC_FIELDS.items():
+            digest = TDigest()
+            for seconds in doc.get(users_field, {}).values():
+                digest.add(seconds)
+            digests[metric] = digest.to_list()
+        db[SKETCH_COLLECTION].update_one({'_id': doc['_id']}, {'$set': {
+            'candidates': candidates[:CANDIDATES_PER_DAY], 'digests': digests, 'closed': True,
+            'closed_at': datetime.now()}})
+        closed += 1
+    return closed
+
+
+def backfill_day(db, date, feed):
+    """Rebuild ``date``'s documents from ``sessions`` and ``afk``; returns the number written"""
+    db[SKETCH_COLLECTION].delete_many({'date': date, 'source': 'backfill'})
+    app_updates = []
+    for doc in db.sessions.find({'date': date, 'source': 'activity'},
+                                {'user_name': 1, 'state': 1, 'start': 1, 'end': 1}):
+        if not isinstance(doc.get('start'), datetime) or not isinstance(doc.get('end'), datetime):
+            continue
+        seconds = (doc['end'] - doc['start']).total_seconds()
+        if seconds > 0 and doc.get('state') and doc['state'] != LOCKED_APP:
+            app_updates.append((date, doc.get('user_name'), doc['state'], seconds))
+    afk_docs = db.afk.find({'date': date, 'type': 'afk', 'is_heartbeat': {'$ne': True}},
+                           {'date': 1, 'type': 1, 'username': 1, 'user_name': 1, 'duration': 1})
+    return feed.apply(db, app_updates, feed.afk_updates(afk_docs), source='backfill')
+
+
+def maintain(db, feed, backfill_days=7):
+    """
+    Rebuild the open days not fed by ingest, then close the past days (a
+    backfilled day is rebuilt on every run until it is closed)
+    """
+    today = date_string()
+    since = date_string(datetime.now() - timedelta(days=backfill_days))
+    recent = {'date': {'$gte': since}}
+    fed = set(db[SKETCH_COLLECTION].distinct('date', dict(recent, source='ingest')))
+    closed_days = set(db[SKETCH_COLLECTION].distinct('date', dict(recent, closed=True)))
+    active = set(db.sessions.distinct('date', recent))
+    rebuilt = sorted(active - fed - closed_days)
+    for date in rebuilt:
+        backfill_day(db, date, feed)
+    open_days = set(db[SKETCH_COLLECTION].distinct('date', {'date': {'$lt': today}, 'closed': {'$ne': True}}))
+    closed = {date: close_day(db, date, feed.width, feed.depth) for date in sorted(open_days)}
+    return {'backfilled': rebuilt, 'closed': closed}
+
+
+def _documents(db, start_date, end_date, scope, fields):
+    return db[SKETCH_COLLECTION].find({'scope': scope, 'date': {'$gte': start_date, '$lte': end_date}}, fields)
+
+
+def top_apps(db, start_date, end_date, scope='all', limit=10, width=DEFAULT_WIDTH, depth=DEFAULT_DEPTH):
+    """Estimated top ``limit`` apps by time over the range, with the sketch error bound"""
+    cms = CountMinSketch(width, depth)
+    candidates = set()
+    days = 0
+    for doc in _documents(db, start_date, end_date, scope, {'cms': 1, 'cms_total': 1, 'candidates': 1}):
+        cms.add_cells(doc.get('cms', {}), doc.get('cms_total', 0))
+        candidates.update(doc.get('candidates', []))
+        days += 1
+    ranked = sorted(((cms.estimate(app), app) for app in candidates), reverse=True)[:limit]
+    return {
+        'apps': [{'app_name': app, 'seconds': seconds} for seconds, app in ranked],
+        'total_seconds': cms.total,
+        'error_bound_seconds': cms.error_bound(),
+        'days': days,
+    }
+
+
+def percentiles(db, start_date, end_date, metric, quantiles, scope='all'):
+    """Estimated quantiles of daily per-user ``metric`` seconds over the range"""
+    digest = TDigest()
+    days = 0
+    users_field = METRIC_FIELDS[metric]
+    for doc in _documents(db, start_date, end_date, scope, {'digests': 1, users_field: 1, 'closed': 1}):
+        if doc.get('closed'):
+            digest.merge(TDigest(centroids=doc.get('digests', {}).get(metric)))
+        else:
+            # 尚未關閉的日期（當天）直接使用每位使用者的累計值
+            for seconds in doc.get(users_field, {}).values():
+                digest.add(seconds)
+        days += 1
+    return {
+        'values': {q: digest.quantile(q) for q in quantiles},
+        'count': digest.count,
+        'days': days,
+    }
@@ -0,0 +1,150 @@
+"""
+Dictionary encoding of long, repetitive strings in the heartbeat collections.
+
+``activities.app_title`` / ``app_path`` and ``afk.window`` repeat the same
+window titles and executable paths in every heartbeat. With the "labels"
+section of mongo_config.json enabled, e.g.
+
+    "labels": {"enabled": true, "min_length": 16}
+
+the agents store an integer ID in those fields instead, and the string once
+in the ``labels`` collection:
+
+    { _id: <label id>, value: "<string>", created_at: <datetime> }
+
+Label IDs are derived from the string (a 53-bit BLAKE2b hash, so they are
+exact in JSON numbers), which lets every agent assign them locally without a
+round trip, including in HTTP ingest mode where agents have no database
+connection. Agents keep a local cache of the labels they already wrote, so
+each string is upserted once per agent run, not once per heartbeat.
+
+The API decodes IDs back to strings through ``LabelDecoder``, an in-memory
+LRU over ``labels``; documents written without encoding keep their strings
+and are returned unchanged.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+# 以字典編碼的欄位
+LABEL_FIELDS = {
+    'activities': ('app_title', 'app_path'),
+    'afk': ('window',),
+}
+
+_label_settings = None
+
+
+def get_label_settings():
+    """Settings of the "labels" section of mongo_config.json; disabled when missing"""
+    global _label_settings
+    if _label_settings is None:
+        from database.mongo_config import load_config
+
+        try:
+            settings = load_config().get('labels') or {}
+        except Exception:
+            settings = {}
+        _label_settings = {
+            'enabled': bool(settings.get('enabled', False)),
+            # 短字串存成 ID 不會更小
+            'min_length': settings.get('min_length', 16),
+            'cache_size': settings.get('cache_size', 4096),
+        }
+    return _label_settings
+
+
+def labels_enabled():
+    return get_label_settings()['enabled']
+
+
+def label_id(value):
+    """Label ID of a string: the first 53 bits of its BLAKE2b digest"""
+    digest = hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') >> 11
+
+
+class LabelEncoder:
+    """Agent-side encoder; writes each new label to ``labels`` through the agent's write handle"""
+
+    def __init__(self, min_length=None, cache_size=None):
+        settings = get_label_settings()
+        self.min_length = settings['min_length'] if min_length is None else min_length
+        self.cache_size = settings['cache_size'] if cache_size is None else cache_size
+        self._known = OrderedDict()
+
+    def encode(self, db, value):
+        """ID for ``value`` (strings shorter than ``min_length`` are kept as they are)"""
+        if not isinstance(value, str) or len(value) < self.min_length:
+            return value
+        known = self._known.get(value)
+        if known is not None:
+            self._known.move_to_end(value)
+            return known
+        known = label_id(value)
+        # 標籤以 ID 為 _id upsert，多個代理程式同時寫入相同字串也只會有一筆
+        db.labels.update_one({'_id': known},
+                             {'$setOnInsert': {'value': value, 'created_at': datetime.now()}},
+                             upsert=True)
+        self._known[value] = known
+        if len(self._known) > self.cache_size:
+            self._known.popitem(last=False)
+        return known
+
+    def encode_document(self, db, collection, doc):
+        """Replace the label fields of ``collection`` in ``doc`` with IDs (in place)"""
+        for field in LABEL_FIELDS[collection]:
+            if field in doc:
+                doc[field] = self.encode(db, doc[field])
+        return doc
+
+
+class LabelDecoder:
+    """API-side decoder with an in-memory LRU of label ID -> string"""
+
+    def __init__(self, get_db, cache_size=10000):
+        self.get_db = get_db
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        # 快取由多個請求執行緒共用；查詢資料庫時不持有鎖
+        self._lock = threading.Lock()
+
+    def lookup(self, ids):
+        """Map label IDs to strings, reading the ones not cached in one query"""
+        found = {}
+        missing = []
+        with self._lock:
+            for value in ids:
+                text = self._cache.get(value)
+                if text is None:
+                    missing.append(value)
+                else:
+                    self._cache.move_to_end(value)
+                    found[value] = text
+            self.hits += len(found)
+            self.misses += len(missing)
+        if missing:
+            loaded = {doc['_id']: doc['value'] for doc in self.get_db().labels.find({'_id': {'$in': missing}})}
+            found.update(loaded)
+            with self._lock:
+                self._cache.update(loaded)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return found
+
+    def decode_rows(self, rows, fields):
+        """Replace label IDs in ``fields`` of every row with their strings (in place)"""
+        ids = {row[field] for row in rows for field in fields
+               if type(row.get(field)) is int}
+        if not ids:
+            return rows
+        labels = self.lookup(ids)
+        for row in rows:
+            for field in fields:
+                value = row.get(field)
+                if type(value) is int and value in labels:
+                    row[field] = labels[value]
+        return rows
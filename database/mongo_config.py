@@ -1,90 +1,252 @@
-from pymongo import MongoClient
-from datetime import datetime
-import os
-import sys
-import json
-import logging
-from dotenv import load_dotenv
-
-# Load environment variables
-load_dotenv()
-
-def get_config_path():
-    """Get the configuration file path, handling both packaged and development environments"""
-    if getattr(sys, 'frozen', False):
-        # Path for packaged executable
-        base_dir = os.path.dirname(sys.executable)
-    else:
-        # Development environment
-        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    
-    return os.path.join(base_dir, 'database', 'mongo_config.json')
-
-def get_database():
-    """Get MongoDB connection from configuration file"""
-    from pymongo import MongoClient
-    
-    try:
-        config_path = get_config_path()
-        if not os.path.exists(config_path):
-            raise FileNotFoundError(f"MongoDB configuration file does not exist: {config_path}")
-            
-        with open(config_path, 'r') as f:
-            config = json.load(f)
-            
-        # Check if either database_name or database key exists
-        if 'database_name' in config:
-            db_name = config['database_name']
-        elif 'database' in config:
-            db_name = config['database']
-        else:
-            raise KeyError("MongoDB configuration file is missing database name setting (either 'database_name' or 'database')")
-        
-        # Check connection string
-        if 'connection_string' not in config:
-            raise KeyError("MongoDB configuration file is missing 'connection_string' setting")
-            
-        connection_string = config['connection_string']
-        
-        # Display connection info (optional)
-        if getattr(sys, 'frozen', False):
-            print(f"Connecting to MongoDB: {connection_string} ({db_name})")
-            
-        client = MongoClient(connection_string)
-        return client[db_name]
-    except Exception as e:
-        import logging
-        logging.error(f"MongoDB connection error: {str(e)}")
-        print(f"Database error: {str(e)}")
-        if getattr(sys, 'frozen', False):
-            input("Press Enter to exit...")
-        sys.exit(1)
-
-def init_database():
-    """Initialize MongoDB collections and indexes"""
-    try:
-        db = get_database()
-        if db is None:
-            logging.warning("Unable to initialize MongoDB, will use local storage")
-            return False
-            
-        # Create collections
-        collections = ['users', 'activities', 'idle_times', 'afk']
-        for collection in collections:
-            if collection not in db.list_collection_names():
-                db.create_collection(collection)
-        
-        # Create indexes
-        db.users.create_index('username', unique=True)
-        db.activities.create_index([('date', 1)])
-        db.idle_times.create_index([('user_name', 1), ('date', 1)])
-        db.afk.create_index([('start', 1)])
-        db.afk.create_index([('type', 1)])
-        
-        logging.info("MongoDB initialization successful")
-        return True
-        
-    except Exception as e:
-        logging.error(f"Error initializing MongoDB: {e}")
-        print(f"Error initializing MongoDB: {e}")
+from datetime import datetime
+import os
+import sys
+import json
+import logging
+import threading
+
+# pymongo 與 dotenv 在第一次使用時才載入，縮短代理程式啟動時間
+_environment_loaded = False
+
+def load_environment():
+    """Load environment variables from .env (once)"""
+    global _environment_loaded
+    if not _environment_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _environment_loaded = True
+
+def get_config_path():
+    """Get the configuration file path, handling both packaged and development environments"""
+    if getattr(sys, 'frozen', False):
+        # Path for packaged executable
+        base_dir = os.path.dirname(sys.executable)
+    else:
+        # Development environment
+        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    
+    return os.path.join(base_dir, 'database', 'mongo_config.json')
+
+def load_config():
+    """Read the MongoDB configuration file"""
+    config_path = get_config_path()
+    if not os.path.exists(config_path):
+        raise FileNotFoundError(f"MongoDB configuration file does not exist: {config_path}")
+        
+    with open(config_path, 'r') as f:
+        return json.load(f)
+
+# 儀表板讀取預設使用的讀取偏好；max_staleness_seconds 最小為 90 秒
+DEFAULT_READ_PREFERENCE = {'mode': 'secondaryPreferred', 'max_staleness_seconds': 90}
+
+def get_read_preference(config):
+    """Build the read preference for read-only handles from the "read_preference" config section"""
+    from pymongo import read_preferences
+    
+    settings = dict(DEFAULT_READ_PREFERENCE, **(config.get('read_preference') or {}))
+    modes = {
+        'primary': read_preferences.Primary,
+        'primaryPreferred': read_preferences.PrimaryPreferred,
+        'secondary': read_preferences.Secondary,
+        'secondaryPreferred': read_preferences.SecondaryPreferred,
+        'nearest': read_preferences.Nearest,
+    }
+    mode = modes[settings['mode']]
+    if mode is read_preferences.Primary:
+        return mode()
+    return mode(max_staleness=settings.get('max_staleness_seconds') or -1)
+
+# 每個程序共用一個 MongoClient（連線池），primary 與唯讀 handle 都由它建立
+_client = None
+_databases = {}
+_client_lock = threading.Lock()
+
+def get_database(read_only=False):
+    """
+    Get MongoDB connection from configuration file.
+    
+    All handles share one process-wide MongoClient, so the number of
+    connections depends on the number of processes, not on the number of
+    calls. With read_only=True the handle reads from secondaries
+    (secondaryPreferred by default, bounded by max_staleness_seconds) so
+    dashboard queries do not compete with the agents' writes on the primary.
+    Use it for reads only.
+    """
+    database = _databases.get(read_only)
+    if database is not None:
+        return database
+    
+    from pymongo import MongoClient
+    
+    load_environment()
+    try:
+        with _client_lock:
+            if read_only in _databases:
+                return _databases[read_only]
+            config = load_config()
+            
+            # Check if either database_name or database key exists
+            if 'database_name' in config:
+                db_name = config['database_name']
+            elif 'database' in config:
+                db_name = config['database']
+            else:
+                raise KeyError("MongoDB configuration file is missing database name setting (either 'database_name' or 'database')")
+            
+            # Check connection string
+            if 'connection_string' not in config:
+                raise KeyError("MongoDB configuration file is missing 'connection_string' setting")
+                
+            connection_string = config['connection_string']
+            
+            global _client
+            if _client is None:
+                # Display connection info (optional)
+                if getattr(sys, 'frozen', False):
+                    print(f"Connecting to MongoDB: {connection_string} ({db_name})")
+                _client = MongoClient(connection_string)
+            if read_only:
+                database = _client.get_database(db_name, read_preference=get_read_preference(config))
+            else:
+                database = _client[db_name]
+            _databases[read_only] = database
+            return database
+    except Exception as e:
+        import logging
+        logging.error(f"MongoDB connection error: {str(e)}")
+        print(f"Database error: {str(e)}")
+        if getattr(sys, 'frozen', False):
+            input("Press Enter to exit...")
+        sys.exit(1)
+
+def get_member_client(address):
+    """
+    New MongoClient connected directly to one member (host, port) of the
+    configured deployment, with the connection string's credentials and
+    options. For commands that only see the member they run on, such as
+    $currentOp and killOp. The caller closes it.
+    """
+    from pymongo import MongoClient
+    from pymongo.uri_parser import parse_uri
+
+    load_environment()
+    parsed = parse_uri(load_config()['connection_string'])
+    # 直接連線到單一成員，不套用複本集名稱與讀取偏好
+    options = {key: value for key, value in parsed['options'].items()
+               if key.lower() not in ('replicaset', 'directconnection', 'readpreference', 'readpreferencetags',
+                                      'maxstalenessseconds')}
+    host, port = address
+    return MongoClient(host, port, directConnection=True, username=parsed['username'],
+                       password=parsed['password'], **options)
+
+# 心跳資料的時間序列集合設定：timeField 為寫入時間，metaField 為使用者/工作站
+TIME_SERIES_COLLECTIONS = {
+    'activities': {'timeField': 'created_at', 'metaField': 'meta', 'granularity': 'seconds'},
+    'afk': {'timeField': 'timestamp', 'metaField': 'meta', 'granularity': 'seconds'},
+}
+
+_time_series_settings = None
+
+def get_time_series_settings():
+    """
+    Time-series storage settings from the "time_series" section of
+    mongo_config.json, e.g. {"enabled": true, "expire_after_days": 7}.
+    Disabled when the section (or the configuration file) is missing.
+    """
+    global _time_series_settings
+    if _time_series_settings is None:
+        try:
+            settings = load_config().get('time_series') or {}
+        except Exception:
+            settings = {}
+        _time_series_settings = {
+            'enabled': bool(settings.get('enabled', False)),
+            'expire_after_days': settings.get('expire_after_days', 7),
+        }
+    return _time_series_settings
+
+def time_series_enabled():
+    return get_time_series_settings()['enabled']
+
+def time_series_meta(user_name, workstation_name):
+    """metaField value for a heartbeat document; both agents use the same shape"""
+    return {'user_name': user_name, 'workstation_name': workstation_name}
+
+def create_time_series_collections(db):
+    """Create the heartbeat collections as time-series collections if they do not exist yet"""
+    existing = {info['name']: info.get('type') for info in db.list_collections()}
+    expire_after_days = get_time_series_settings()['expire_after_days']
+    for name, options in TIME_SERIES_COLLECTIONS.items():
+        if name not in existing:
+            kwargs = {'timeseries': options}
+            if expire_after_days:
+                # 以 TTL 取代依 date 字串的 delete_many 清理
+                kwargs['expireAfterSeconds'] = int(expire_after_days * 86400)
+            db.create_collection(name, **kwargs)
+            logging.info(f"Created time-series collection {name}")
+        elif existing[name] != 'timeseries':
+            logging.warning(f"Collection {name} already exists as a regular collection; "
+                            f"migrate it before enabling time-series mode")
+
+def ensure_indexes(db):
+    """Create the indexes the API queries rely on (idempotent)"""
+    db.users.create_index('username', unique=True)
+    if time_series_enabled():
+        # 時間序列集合依 (meta.user_name, 時間) 篩選，bucket 依時間範圍掃描
+        for name, options in TIME_SERIES_COLLECTIONS.items():
+            db[name].create_index([('meta.user_name', 1), (options['timeField'], 1)])
+        # /api/workstations 依工作站分區查詢尚未彙總的日期
+        db.activities.create_index([('meta.workstation_name', 1), ('created_at', 1)])
+    else:
+        db.activities.create_index([('date', 1)])
+        # 以 (使用者, 日期) 為首的複合索引，讓依使用者/團隊篩選的查詢只讀取自己的分區
+        db.activities.create_index([('user_name', 1), ('date', 1)])
+        db.afk.create_index([('start', 1)])
+        db.afk.create_index([('type', 1)])
+        db.afk.create_index([('username', 1), ('date', 1)])
+        # ?since= 增量查詢依寫入時間讀取當天新記錄
+        db.activities.create_index([('date', 1), ('created_at', 1)])
+        db.activities.create_index([('date', 1), ('workstation_name', 1)])
+        db.afk.create_index([('date', 1), ('timestamp', 1)])
+    # 代理程式每次取樣依 (使用者, 日期) upsert 閒置時間，retention 依日期刪除
+    db.user_idle_times.create_index([('user_name', 1), ('date', 1)])
+    db.user_idle_times.create_index([('date', 1)])
+    # 每位使用者一筆目前狀態
+    db.presence.create_index('user_name', unique=True)
+    # 區間重疊查詢
+    from database.sessions import ensure_session_indexes
+    ensure_session_indexes(db)
+    # 每日分析 sketch
+    from database.analytics import ensure_sketch_indexes
+    ensure_sketch_indexes(db)
+    # 使用者與團隊對應
+    db.teams.create_index('user_name', unique=True)
+    db.teams.create_index('team')
+
+def init_database():
+    """Initialize MongoDB collections and indexes"""
+    try:
+        db = get_database()
+        if db is None:
+            logging.warning("Unable to initialize MongoDB, will use local storage")
+            return False
+            
+        # Create collections
+        if time_series_enabled():
+            create_time_series_collections(db)
+        collections = ['users', 'activities', 'user_idle_times', 'afk', 'teams', 'presence', 'sessions', 'labels', 'daily_usage',
+                       'daily_workstations', 'analytics_sketches']
+        for collection in collections:
+            if collection not in db.list_collection_names():
+                db.create_collection(collection)
+        
+        # Create indexes
+        ensure_indexes(db)
+        
+        logging.info("MongoDB initialization successful")
+        return True
+        
+    except Exception as e:
+        logging.error(f"Error initializing MongoDB: {e}")
+        print(f"Error initializing MongoDB: {e}")
         return False
\ No newline at end of file
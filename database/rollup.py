@@ -0,0 +1,201 @@
+"""
+Daily rollups of the activities heartbeats.
+
+``daily_usage`` holds one document per (date, user, workstation, app):
+
+    { _id: "<date>|<user_name>|<workstation_name>|<app_name>",
+      date, user_name, workstation_name, app_name,
+      total_seconds, sessions, first_seen, last_seen, updated_at }
+
+``daily_workstations`` holds one document per (date, workstation):
+
+    { _id: "<date>|<workstation_name>", date, workstation_name, users,
+      boot_time, system_working_time_seconds, uptime_seconds,
+      active_seconds, locked_seconds, idle_seconds, last_seen, updated_at }
+
+A session is one (workstation, app, logon_time) run, as in /api/activities:
+its length is its latest logoff_time minus its logon_time. MongoDB reduces
+the day's heartbeats to one row per session (and one row per user and boot
+of each machine) with ``$group``; only those rows reach the API. Rollups are
+kept much longer than the raw heartbeats, so the retention job rolls a day
+up before deleting its activities.
+
+``workstation_summary`` computes the daily_workstations rows for any
+heartbeat filter; /api/workstations uses it for the days not rolled up yet.
+"""
+from datetime import datetime
+
+from time_codec import time_span, parse_duration
+
+ROLLUP_COLLECTION = 'daily_usage'
+WORKSTATION_COLLECTION = 'daily_workstations'
+
+# 系統鎖定時 agent 記錄的應用程式名稱，不計入使用時間
+LOCKED_APP = 'System_Locked'
+
+
+def ensure_rollup_indexes(db):
+    db[ROLLUP_COLLECTION].create_index([('date', 1), ('workstation_name', 1)])
+    db[ROLLUP_COLLECTION].create_index([('user_name', 1), ('date', 1)])
+    db[WORKSTATION_COLLECTION].create_index([('date', 1), ('workstation_name', 1)])
+    db[WORKSTATION_COLLECTION].create_index([('workstation_name', 1), ('date', 1)])
+
+
+def _options(comment):
+    # comment 只在有值時傳入，替身資料庫（mongomock 等）不接受此參數
+    return {'comment': comment} if comment is not None else {}
+
+
+def _session_rows(db, match, comment=None):
+    pipeline = [
+        {'$match': match},
+        {'$group': {
+            '_id': {
+                'date': '$date',
+                'user_name': '$user_name',
+                'workstation_name': '$workstation_name',
+                'app_name': '$app_name',
+                'logon': {'$ifNull': ['$logon_time', '$app_start_time']},
+            },
+            'logoff': {'$max': '$logoff_time'},
+        }},
+    ]
+    return db.activities.aggregate(pipeline, **_options(comment))
+
+
+def _machine_rows(db, match, comment=None):
+    # 每位使用者每次開機一筆：最後心跳時間與當天累計閒置時間
+    pipeline = [
+        {'$match': match},
+        {'$group': {
+            '_id': {
+                'date': '$date',
+                'workstation_name': '$workstation_name',
+                'user_name': '$user_name',
+                'boot_time': '$boot_time',
+            },
+            'last_seen': {'$max': '$logoff_time'},
+            'idle_time': {'$max': '$idle_time'},
+        }},
+    ]
+    return db.activities.aggregate(pipeline, **_options(comment))
+
+
+def usage_totals(rows):
+    """Sum session rows into {(date, user, workstation, app): totals}"""
+    totals = {}
+    for row in rows:
+        key = row['_id']
+        logon, logoff = key.get('logon') or '', row.get('logoff') or ''
+        try:
+            seconds = time_span(logon, logoff) if logon and logoff else 0
+        except ValueError:
+            seconds = 0
+        ident = (key.get('date'), key.get('user_name'), key.get('workstation_name'), key.get('app_name'))
+        entry = totals.get(ident)
+        if entry is None:
+            entry = totals[ident] = {'total_seconds': 0, 'sessions': 0,
+                                     'first_seen': logon, 'last_seen': logoff}
+        entry['total_seconds'] += max(seconds, 0)
+        entry['sessions'] += 1
+        entry['first_seen'] = min(entry['first_seen'], logon) if logon else entry['first_seen']
+        entry['last_seen'] = max(entry['last_seen'], logoff)
+    return totals
+
+
+def _seconds(start, end):
+    try:
+        return max(time_span(start, end), 0) if start and end else 0
+    except ValueError:
+        return 0
+
+
+def workstation_totals(usage, machine_rows):
+    """Combine usage totals and per-boot machine rows into {(date, workstation): row}"""
+    machines = {}
+
+    def machine(date, workstation_name):
+        row = machines.get((date, workstation_name))
+        if row is None:
+            row = machines[(date, workstation_name)] = {
+                'date': date, 'workstation_name': workstation_name, 'users': set(),
+                'boot_time': '', 'system_working_time_seconds': 0, 'uptime_seconds': 0,
+                'active_seconds': 0, 'locked_seconds': 0, 'idle_seconds': 0, 'last_seen': '',
+                '_boots': {}, '_idle': {},
+            }
+        return row
+
+    for (date, user_name, workstation_name, app_name), entry in usage.items():
+        row = machine(date, workstation_name)
+        row['users'].add(user_name)
+        row['locked_seconds' if app_name == LOCKED_APP else 'active_seconds'] += entry['total_seconds']
+
+    for doc in machine_rows:
+        key = doc['_id']
+        row = machine(key.get('date'), key.get('workstation_name'))
+        row['users'].add(key.get('user_name'))
+        last_seen = doc.get('last_seen') or ''
+        boot_time = key.get('boot_time') or ''
+        boots = row['_boots']
+        boots[boot_time] = max(boots.get(boot_time, ''), last_seen)
+        # idle_time 為使用者當天累計值，取每位使用者的最大值
+        try:
+            idle = parse_duration(doc.get('idle_time') or '00:00:00')
+        except ValueError:
+            idle = 0
+        row['_idle'][key.get('user_name')] = max(row['_idle'].get(key.get('user_name'), 0), idle)
+
+    for row in machines.values():
+        boots = row.pop('_boots')
+        idle = row.pop('_idle')
+        row['users'] = sorted(user for user in row['users'] if user)
+        row['idle_seconds'] = sum(idle.values())
+        day_start = f"{row['date']} 00:00:00"
+        for boot_time, last_seen in boots.items():
+            # 當天開機時間：每次開機自開機（或當天零時）到最後一次心跳
+            row['uptime_seconds'] += _seconds(max(boot_time, day_start), last_seen)
+            row['last_seen'] = max(row['last_seen'], last_seen)
+        if boots:
+            row['boot_time'] = max(boots)
+            row['system_working_time_seconds'] = _seconds(row['boot_time'], boots[row['boot_time']])
+    return machines
+
+
+def workstation_summary(db, match, comment=None):
+    """daily_workstations rows computed directly from the heartbeats matching ``match``"""
+    usage = usage_totals(_session_rows(db, match, comment))
+    return list(workstation_totals(usage, _machine_rows(db, match, comment)).values())
+
+
+def rollup_day(db, date):
+    """(Re)compute the daily_usage and daily_workstations documents of ``date``; returns the number written"""
+    from pymongo import ReplaceOne
+
+    match = {'date': date}
+    usage = usage_totals(_session_rows(db, match))
+    machines = workstation_totals(usage, _machine_rows(db, match))
+
+    now = datetime.now()
+    operations = []
+    for (_, user_name, workstation_name, app_name), entry in usage.items():
+        doc = dict(entry, date=date, user_name=user_name, workstation_name=workstation_name,
+                   app_name=app_name, updated_at=now)
+        doc['_id'] = f"{date}|{user_name}|{workstation_name}|{app_name}"
+        operations.append(ReplaceOne({'_id': doc['_id']}, doc, upsert=True))
+    if operations:
+        db[ROLLUP_COLLECTION].bulk_write(operations, ordered=False)
+
+    machine_operations = []
+    for (_, workstation_name), row in machines.items():
+        doc = dict(row, updated_at=now)
+        doc['_id'] = f"{date}|{workstation_name}"
+        machine_operations.append(ReplaceOne({'_id': doc['_id']}, doc, upsert=True))
+    if machine_operations:
+        db[WORKSTATION_COLLECTION].bulk_write(machine_operations, ordered=False)
+    return len(operations) + len(machine_operations)
+
+
+def rolled_up_dates(db, since):
+    """Dates since ``since`` that have both rollups"""
+    usage = set(db[ROLLUP_COLLECTION].distinct('date', {'date': {'$gte': since}}))
+    return usage & set(db[WORKSTATION_COLLECTION].distinct('date', {'date': {'$gte': since}}))
@@ -0,0 +1,108 @@
+"""
+Interval storage for time-range overlap queries.
+
+Each document in ``sessions`` is one contiguous interval of a single state:
+
+    { user_name, workstation_name, source: "afk" | "activity",
+      state: "work" | "afk" | <app name>, detail: <window / app title>,
+      start: <datetime>, end: <datetime>, date: "YYYY-MM-DD" }
+
+Writers split intervals into segments of at most ``SESSION_SEGMENT_SECONDS``,
+so an interval overlapping [from, to) always satisfies
+
+    from - SESSION_SEGMENT_SECONDS <= start < to   and   end > from
+
+which is a bounded range scan on the (start, end) indexes: the cost of a
+timeline query depends on the width of the window, not on the day volume.
+"""
+import logging
+from datetime import datetime, timedelta
+
+from time_codec import date_string
+
+SESSION_SEGMENT_SECONDS = 3600
+
+# 兩次更新間隔超過此秒數（休眠、斷線）時不延伸舊區段，改為開始新區段
+SESSION_MAX_GAP_SECONDS = 180
+
+
+def ensure_session_indexes(db):
+    db.sessions.create_index([('start', 1), ('end', 1)])
+    db.sessions.create_index([('user_name', 1), ('start', 1), ('end', 1)])
+
+
+def overlap_filter(start, end):
+    """Query matching intervals that overlap [start, end)"""
+    return {
+        'start': {'$gte': start - timedelta(seconds=SESSION_SEGMENT_SECONDS), '$lt': end},
+        'end': {'$gt': start},
+    }
+
+
+class SessionRecorder:
+    """Maintains the current interval of one agent and upserts it into ``sessions``"""
+
+    def __init__(self, source, user_name, workstation_name):
+        self.source = source
+        self.user_name = user_name
+        self.workstation_name = workstation_name
+        self._id = None
+        self._state = None
+        self._start = None
+        self._last = None
+        self._detail = None
+
+    def _write(self, db, end, detail):
+        db.sessions.update_one(
+            {'_id': self._id},
+            {'$set': {'end': end, 'detail': detail},
+             '$setOnInsert': {
+                 'user_name': self.user_name,
+                 'workstation_name': self.workstation_name,
+                 'source': self.source,
+                 'state': self._state,
+                 'start': self._start,
+                 'date': date_string(self._start),
+             }},
+            upsert=True
+        )
+
+    def _begin(self, state, start):
+        from bson import ObjectId
+        
+        self._id = ObjectId()
+        self._state = state
+        self._start = start
+
+    def update(self, db, state, detail=None, now=None):
+        """Extend the current interval to ``now``, starting a new one when the state changes"""
+        now = now or datetime.now()
+        try:
+            if self._id is None or (now - self._last).total_seconds() > SESSION_MAX_GAP_SECONDS:
+                self._begin(state, now)
+            else:
+                # 區段長度上限，讓重疊查詢可以限制 start 的掃描範圍
+                while (now - self._start).total_seconds() > SESSION_SEGMENT_SECONDS:
+                    boundary = self._start + timedelta(seconds=SESSION_SEGMENT_SECONDS)
+                    self._write(db, boundary, self._detail)
+                    self._begin(self._state, boundary)
+                if state != self._state:
+                    # 狀態改變：結束目前區段，新區段從同一時間點開始
+                    self._write(db, now, self._detail)
+                    self._begin(state, now)
+            self._write(db, now, detail)
+            self._last = now
+            self._detail = detail
+        except Exception as e:
+            logging.warning(f"Unable to record session interval: {e}")
+
+    def close(self, db, now=None):
+        """End the current interval (agent shutdown)"""
+        if self._id is None:
+            return
+        now = now or datetime.now()
+        try:
+            db.sessions.update_one({'_id': self._id}, {'$set': {'end': now}})
+        except Exception as e:
+            logging.warning(f"Unable to close session interval: {e}")
+        self._id = None
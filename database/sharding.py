@@ -0,0 +1,101 @@
+"""
+Sharding layout for the high-volume collections.
+
+Shard keys (MongoDB 4.4+ compound hashed keys):
+
+    activities       { user_name: "hashed", date: 1 }
+    afk              { username:  "hashed", date: 1 }
+    user_idle_times  { user_name: "hashed", date: 1 }
+
+Every writer already sets both fields on every document
+(``log_to_database``, ``AFK._save_to_mongodb``, ``save_user_idle_time``) and
+never updates them afterwards, as required for shard key fields. Hashing the
+user spreads the per-second write stream evenly across shards, while the
+``date`` suffix keeps one user's range reads within a single chunk range.
+
+Read queries are shard-targeted when they include the user field. Queries
+scoped with ?users=/?team= do so naturally; when SHARDING.TARGET_ALL_QUERIES
+is enabled, unscoped dashboard queries are expanded to the users listed in
+the ``agents`` registry (written once per agent start by ``register_agent``).
+
+In time-series mode (see ``database/mongo_config.py``) the shard key of the
+heartbeat collections may only use the metaField, so they are sharded on
+``{ "meta.user_name": "hashed" }`` instead.
+"""
+import logging
+from datetime import datetime
+
+from database.mongo_config import time_series_enabled, create_time_series_collections
+
+SHARD_KEYS = {
+    'activities': {'user_name': 'hashed', 'date': 1},
+    'afk': {'username': 'hashed', 'date': 1},
+    'user_idle_times': {'user_name': 'hashed', 'date': 1},
+}
+
+# 每個集合中對應 shard key 使用者欄位的名稱
+USER_FIELDS = {name: next(iter(key)) for name, key in SHARD_KEYS.items()}
+
+TIME_SERIES_SHARD_KEYS = {
+    'activities': {'meta.user_name': 'hashed'},
+    'afk': {'meta.user_name': 'hashed'},
+}
+
+
+def shard_keys():
+    """Shard keys for the configured storage mode"""
+    keys = dict(SHARD_KEYS)
+    if time_series_enabled():
+        keys.update(TIME_SERIES_SHARD_KEYS)
+    return keys
+
+
+def register_agent(db, agent, user_name, workstation_name):
+    """Record that ``user_name`` runs ``agent`` on ``workstation_name`` (once per agent start)"""
+    try:
+        db.agents.update_one(
+            {'user_name': user_name, 'workstation_name': workstation_name, 'agent': agent},
+            {'$set': {'last_started': datetime.now()}},
+            upsert=True
+        )
+    except Exception as e:
+        logging.warning(f"Unable to register agent: {e}")
+
+
+def known_users(db):
+    """All user names that have registered an agent"""
+    return sorted(db.agents.distinct('user_name'))
+
+
+def shard_collections(client, database_name):
+    """
+    Enable sharding on the database and shard the high-volume collections
+    with their documented keys. Must be run against a mongos.
+    """
+    admin = client.admin
+    db = client[database_name]
+    admin.command('enableSharding', database_name)
+    if time_series_enabled():
+        create_time_series_collections(db)
+    for collection, key in shard_keys().items():
+        # 分片前需要有支援 shard key 的索引
+        db[collection].create_index(list(key.items()))
+        try:
+            admin.command('shardCollection', f"{database_name}.{collection}", key=key)
+            logging.info(f"Sharded {database_name}.{collection} on {key}")
+        except Exception as e:
+            if 'already sharded' in str(e) or 'AlreadyInitialized' in str(e):
+                continue
+            raise
+    db.agents.create_index([('user_name', 1), ('workstation_name', 1), ('agent', 1)], unique=True)
+
+
+if __name__ == '__main__':
+    import sys
+    import os
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from database.mongo_config import get_database
+
+    logging.basicConfig(level=logging.INFO)
+    db = get_database()
+    shard_collections(db.client, db.name)
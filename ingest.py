@@ -0,0 +1,367 @@
+"""
+Bulk ingest endpoint for the desktop agents.
+
+    POST /api/ingest
+    Content-Type: application/json          (Content-Encoding: gzip optional)
+    X-Ingest-Token: <INGEST.TOKEN>          (required when a token is configured)
+
+    {"agent": "AFKTracker",
+     "events": [
+        {"key": "<idempotency key>", "collection": "afk", "doc": {...}},
+        {"key": "<idempotency key>", "collection": "presence",
+         "filter": {"user_name": "..."}, "update": {"$set": {...}}, "upsert": true}
+     ]}
+
+The body is MongoDB Extended JSON (``bson.json_util``) so datetimes and
+ObjectIds survive the round trip. Every event carries an idempotency key
+chosen by the agent when the event is created, so an agent can safely resend
+a batch after a timeout:
+
+- an inserted document's ``_id`` is derived from its key (``ingest_id``), so
+  a resent insert fails with a duplicate key error and counts as a duplicate;
+- the keys of the events that were written are recorded in ``ingest_keys``
+  (expired by a TTL index) and events whose key was already recorded are
+  skipped. Keys are recorded after the write, so an event whose write failed
+  or was interrupted is written when it is resent. Upserts only use ``$set``
+  and ``$setOnInsert`` and can be applied again; time-series collections do
+  not enforce a unique ``_id`` and rely on the recorded keys alone.
+
+Inserts are grouped per collection and written with one unordered
+``insert_many``; upserts are limited to a fixed set of collections, filter
+fields and update operators and written with one ``bulk_write``.
+
+When a ``SketchFeed`` (database/analytics.py) is given, the app time of the
+activity intervals in ``sessions`` and the finished AFK periods of each
+batch are added to the daily analytics sketches once the batch is written.
+"""
+import hmac
+import zlib
+import struct
+import hashlib
+import logging
+from datetime import datetime
+
+import api_metrics
+from database.labels import label_id
+
+# 可插入的集合及每筆文件必要欄位
+INSERT_COLLECTIONS = {
+    'activities': ('user_name', 'date', 'created_at'),
+    'afk': ('username', 'date', 'timestamp'),
+    'agent_metrics': ('agent', 'timestamp'),
+}
+
+# 可 upsert 的集合及允許的篩選欄位（必須全部提供）
+UPSERT_COLLECTIONS = {
+    'presence': ('user_name',),
+    'sessions': ('_id',),
+    'agents': ('user_name', 'workstation_name', 'agent'),
+    'user_idle_times': ('user_name', 'date'),
+    'labels': ('_id',),
+}
+
+UPDATE_OPERATORS = ('$set', '$setOnInsert')
+# 標籤只能新增：既有 ID 對應的字串不可改寫，且 ID 必須由字串導出
+COLLECTION_UPDATE_OPERATORS = {'labels': ('$setOnInsert',)}
+
+MAX_KEY_LENGTH = 128
+
+# 重複鍵錯誤
+DUPLICATE_KEY = 11000
+
+INGEST_EVENTS = api_metrics.REGISTRY.counter(
+    'api_ingest_events_total', 'Events received on /api/ingest by collection and result',
+    ('collection', 'result'))
+
+
+class IngestError(Exception):
+    """Raised for a request that cannot be processed at all (bad body, too large)"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def decode_body(data, encoding, max_bytes):
+    """Decompress the request body, refusing anything that inflates beyond ``max_bytes``"""
+    encoding = (encoding or 'identity').lower()
+    if encoding == 'identity':
+        body = data
+    elif encoding == 'gzip':
+        decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+        try:
+            body = decompressor.decompress(data, max_bytes + 1)
+        except zlib.error as e:
+            raise IngestError(f"Invalid gzip body: {e}")
+    else:
+        raise IngestError(f"Unsupported Content-Encoding: {encoding}", 415)
+    if len(body) > max_bytes:
+        raise IngestError("Request body too large", 413)
+    return body
+
+
+def _operator_free(value):
+    """True if no key in a (nested) document starts with '$'"""
+    if isinstance(value, dict):
+        return all(not str(key).startswith('$') and _operator_free(item) for key, item in value.items())
+    if isinstance(value, list):
+        return all(_operator_free(item) for item in value)
+    return True
+
+
+def ingest_id(key, doc):
+    """
+    ``_id`` of an inserted event: an ObjectId whose timestamp is the
+    document's time and whose other bytes come from the idempotency key
+    """
+    from bson import ObjectId
+
+    created = doc.get('created_at') or doc.get('timestamp')
+    seconds = int(created.timestamp()) if isinstance(created, datetime) else 0
+    return ObjectId(struct.pack('>I', seconds & 0xFFFFFFFF) + hashlib.sha1(key.encode('utf-8')).digest()[:8])
+
+
+def validate_event(event):
+    """Return an error message for an invalid event, or None"""
+    if not isinstance(event, dict):
+        return 'event must be an object'
+    key = event.get('key')
+    if not isinstance(key, str) or not key or len(key) > MAX_KEY_LENGTH:
+        return 'key must be a non-empty string'
+    collection = event.get('collection')
+    if collection in INSERT_COLLECTIONS:
+        doc = event.get('doc')
+        if not isinstance(doc, dict):
+            return 'doc must be an object'
+        missing = [field for field in INSERT_COLLECTIONS[collection] if field not in doc]
+        if missing:
+            return f"missing fields: {', '.join(missing)}"
+        if not _operator_free(doc):
+            return 'field names must not start with $'
+        return None
+    if collection in UPSERT_COLLECTIONS:
+        query = event.get('filter')
+        update = event.get('update')
+        if not isinstance(query, dict) or set(query) != set(UPSERT_COLLECTIONS[collection]):
+            return f"filter must contain exactly: {', '.join(UPSERT_COLLECTIONS[collection])}"
+        operators = COLLECTION_UPDATE_OPERATORS.get(collection, UPDATE_OPERATORS)
+        if not isinstance(update, dict) or not update or not set(update) <= set(operators):
+            return f"update may only use {', '.join(operators)}"
+        if not all(isinstance(fields, dict) and _operator_free(fields) for fields in update.values()) \
+                or not _operator_free(query):
+            return 'field names must not start with $'
+        if collection == 'labels':
+            value = update['$setOnInsert'].get('value')
+            if not isinstance(value, str) or query['_id'] != label_id(value):
+                return '_id must be the label ID of value'
+        return None
+    return f"unsupported collection: {collection}"
+
+
+class IngestWriter:
+    """Deduplicates and writes validated event batches"""
+
+    def __init__(self, get_db, config=None, sketches=None):
+        config = config or {}
+        self.get_db = get_db
+        self.sketches = sketches
+        self.dedup_ttl = config.get('DEDUP_TTL_SECONDS', 86400)
+        self._indexes_ready = False
+
+    def _ensure_indexes(self, db):
+        if not self._indexes_ready:
+            db.ingest_keys.create_index('created_at', expireAfterSeconds=self.dedup_ttl)
+            self._indexes_ready = True
+
+    def _seen_keys(self, db, keys):
+        """Keys of ``keys`` whose events were already written"""
+        return {doc['_id'] for doc in db.ingest_keys.find({'_id': {'$in': keys}}, {'_id': 1})}
+
+    def _record_keys(self, db, keys):
+        """Record the idempotency keys of written events (a key recorded concurrently is not an error)"""
+        from pymongo.errors import BulkWriteError
+
+        if not keys:
+            return
+        now = datetime.now()
+        try:
+            db.ingest_keys.insert_many([{'_id': key, 'created_at': now} for key in keys], ordered=False)
+        except BulkWriteError as e:
+            if any(error.get('code') != DUPLICATE_KEY for error in e.details.get('writeErrors', [])):
+                raise
+
+    def _insert(self, db, collection, items):
+        """
+        Insert [(key, doc)]; returns the (key, doc) items that were inserted,
+        those already stored (duplicate ``_id``) and the error of the others
+        (None when nothing else failed)
+        """
+        from pymongo.errors import BulkWriteError
+
+        try:
+            db[collection].insert_many([doc for _, doc in items], ordered=False)
+            return items, [], None
+        except BulkWriteError as e:
+            errors = {error['index']: error.get('code') for error in e.details.get('writeErrors', [])}
+            error = e if any(code != DUPLICATE_KEY for code in errors.values()) else None
+        except Exception as e:
+            # 網路錯誤或逾時：無法得知哪些已寫入，重送時由 _id 判斷
+            return [], [], e
+        inserted = [item for index, item in enumerate(items) if index not in errors]
+        duplicates = [item for index, item in enumerate(items) if errors.get(index) == DUPLICATE_KEY]
+        return inserted, duplicates, error
+
+    def _upsert(self, db, collection, items):
+        """Apply [(key, operation)] in order; returns (applied, failed) key lists and the error"""
+        from pymongo.errors import BulkWriteError
+
+        try:
+            # upsert 依序套用，確保同一文件的較新狀態最後寫入
+            db[collection].bulk_write([operation for _, operation in items], ordered=True)
+            return [key for key, _ in items], [], None
+        except BulkWriteError as e:
+            # 有序寫入在第一個錯誤停止，之前的都已套用
+            stopped = min((error['index'] for error in e.details.get('writeErrors', [])), default=len(items))
+            return [key for key, _ in items[:stopped]], [key for key, _ in items[stopped:]], e
+        except Exception as e:
+            return [], [key for key, _ in items], e
+
+    def write(self, events):
+        """
+        Write already validated events and return per-collection accepted / duplicate counts.
+        Raises the first write error after recording the keys of the events
+        that were written, so a resent batch only writes the rest.
+        """
+        from pymongo import UpdateOne
+
+        db = self.get_db()
+        self._ensure_indexes(db)
+
+        # 同一批次內重複的 key 只保留第一筆
+        unique = {}
+        for event in events:
+            unique.setdefault(event['key'], event)
+        keys = list(unique)
+        seen = self._seen_keys(db, keys)
+        duplicate_count = len(events) - len(keys) + len(seen)
+
+        inserts = {}
+        upserts = {}
+        for key, event in unique.items():
+            if key in seen:
+                INGEST_EVENTS.inc(collection=event['collection'], result='duplicate')
+                continue
+            if event['collection'] in INSERT_COLLECTIONS:
+                doc = dict(event['doc'])
+                doc['_id'] = ingest_id(key, doc)
+                inserts.setdefault(event['collection'], []).append((key, doc))
+            else:
+                upserts.setdefault(event['collection'], []).append(
+                    (key, UpdateOne(event['filter'], event['update'], upsert=bool(event.get('upsert', True)))))
+
+        app_updates = []
+        if self.sketches and upserts.get('sessions'):
+            # 寫入前讀取區段目前的 end，計算本批次延伸的使用時間
+            try:
+                app_updates = self.sketches.session_updates(
+                    db, [unique[key] for key, _ in upserts['sessions']])
+            except Exception as e:
+                logging.warning(f"Unable to read sessions for analytics sketches: {e}")
+
+        accepted = {}
+        written = []
+        inserted_afk = []
+        errors = []
+        for collection, items in inserts.items():
+            inserted, duplicates, error = self._insert(db, collection, items)
+            if inserted:
+                accepted[collection] = len(inserted)
+                INGEST_EVENTS.inc(len(inserted), collection=collection, result='accepted')
+            if duplicates:
+                duplicate_count += len(duplicates)
+                INGEST_EVENTS.inc(len(duplicates), collection=collection, result='duplicate')
+            if collection == 'afk':
+                inserted_afk = [doc for _, doc in inserted]
+            written.extend(key for key, _ in inserted + duplicates)
+            if error is not None:
+                errors.append(error)
+        for collection, items in upserts.items():
+            applied, failed, error = self._upsert(db, collection, items)
+            if applied:
+                accepted[collection] = len(applied)
+                INGEST_EVENTS.inc(len(applied), collection=collection, result='accepted')
+            written.extend(applied)
+            if collection == 'sessions':
+                # 未套用的區段不計入 sketch，重送時再計算
+                app_updates = [update[1:] for update in app_updates if update[0] < len(applied)]
+            if error is not None:
+                errors.append(error)
+        self._record_keys(db, written)
+
+        if self.sketches:
+            try:
+                afk_updates = self.sketches.afk_updates(inserted_afk)
+                self.sketches.apply(db, app_updates, afk_updates)
+            except Exception as e:
+                logging.warning(f"Unable to update analytics sketches: {e}")
+        if errors:
+            raise errors[0]
+        return {'accepted': accepted, 'duplicates': duplicate_count}
+
+
+def init_ingest(app, get_db, config=None, sketches=None):
+    """Register POST /api/ingest on the Flask app"""
+    from flask import request, jsonify
+    from bson import json_util
+
+    config = config or {}
+    token = config.get('TOKEN')
+    max_bytes = config.get('MAX_BYTES', 16 * 1024 * 1024)
+    max_events = config.get('MAX_EVENTS', 10000)
+    writer = IngestWriter(get_db, config, sketches)
+    if not token:
+        logging.warning("INGEST.TOKEN is not set; /api/ingest accepts unauthenticated batches")
+
+    @app.route('/api/ingest', methods=['POST'])
+    def ingest():
+        if token and not hmac.compare_digest(request.headers.get('X-Ingest-Token', ''), token):
+            return jsonify({'error': 'Invalid ingest token'}), 401
+        try:
+            body = decode_body(request.get_data(), request.headers.get('Content-Encoding'), max_bytes)
+            try:
+                payload = json_util.loads(body)
+            except ValueError as e:
+                raise IngestError(f"Invalid JSON body: {e}")
+            events = payload.get('events') if isinstance(payload, dict) else None
+            if not isinstance(events, list):
+                raise IngestError('events must be a list')
+            if len(events) > max_events:
+                raise IngestError(f"At most {max_events} events per batch", 413)
+        except IngestError as e:
+            return jsonify({'error': str(e)}), e.status
+
+        valid = []
+        rejected = []
+        for index, event in enumerate(events):
+            error = validate_event(event)
+            if error:
+                rejected.append({'index': index, 'key': event.get('key') if isinstance(event, dict) else None,
+                                 'error': error})
+                collection = event.get('collection') if isinstance(event, dict) else None
+                if collection not in INSERT_COLLECTIONS and collection not in UPSERT_COLLECTIONS:
+                    collection = 'unknown'
+                INGEST_EVENTS.inc(collection=collection, result='rejected')
+            else:
+                valid.append(event)
+
+        try:
+            result = writer.write(valid) if valid else {'accepted': {}, 'duplicates': 0}
+        except Exception as e:
+            logging.error(f"Ingest write error: {e}")
+            return jsonify({'error': 'Ingest write failed'}), 503
+
+        api_metrics.observe_rows('/api/ingest', len(valid))
+        result['rejected'] = rejected
+        return jsonify(result)
+
+    return writer
@@ -0,0 +1,236 @@
+"""
+HTTP ingest client for the desktop agents.
+
+When mongo_config.json contains an "ingest" section, for example
+
+    "ingest": {"url": "http://api-host:5000/api/ingest", "token": "...",
+               "batch_size": 500, "flush_interval": 5, "max_queue": 50000}
+
+the agents hand their writes to an ``IngestClient`` instead of a MongoDB
+handle. The client buffers them and sends gzip-compressed batches to the
+API's /api/ingest endpoint from a background thread, so mongod only sees the
+API's connection pool and ``insert_many`` batches.
+
+``IngestClient`` exposes the write subset of the pymongo API used by the
+agents (``client.<collection>.insert_one`` / ``update_one``), so the write
+paths work unchanged with either kind of handle. Every event gets its
+idempotency key when it is queued; a batch that times out is resent with
+the same keys and the server skips the events it already stored.
+
+Without an "ingest" section the agents use ``DirectWriter``, which queues
+the same way but applies the writes straight to MongoDB, so capturing a
+sample never waits for the database connection.
+"""
+import gzip
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import deque
+
+
+class _IngestCollection:
+    def __init__(self, client, name):
+        self._client = client
+        self.name = name
+
+    def insert_one(self, doc):
+        self._client.enqueue({'collection': self.name, 'doc': dict(doc)})
+
+    def update_one(self, filter, update, upsert=False):
+        self._client.enqueue({'collection': self.name, 'filter': filter, 'update': update, 'upsert': upsert})
+
+
+class QueuedWriter:
+    """
+    Buffers agent writes in memory and hands them to ``_send`` in batches
+    from a background thread. Subclasses implement ``_send``, which removes
+    the events it applied from the batch; what is left is retried.
+    """
+
+    def __init__(self, agent=None, batch_size=500, flush_interval=5, max_queue=50000, metrics=None):
+        self.agent = agent
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.metrics = metrics
+        self.sent = 0
+        self.dropped = 0
+        self.failed_batches = 0
+        self._queue = deque()
+        self._lock = threading.Lock()
+        # 同時只有一個 flush；呼叫端的 flush 會等背景執行緒送出中的批次完成
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._closed = False
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return _IngestCollection(self, name)
+
+    def __getitem__(self, name):
+        return _IngestCollection(self, name)
+
+    def enqueue(self, event):
+        event['key'] = uuid.uuid4().hex
+        with self._lock:
+            self._queue.append(event)
+            # 佇列滿時丟棄最舊的事件，避免 API 長時間無法連線時耗盡記憶體
+            while len(self._queue) > self.max_queue:
+                self._queue.popleft()
+                self.dropped += 1
+            depth = len(self._queue)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"{self.agent}-ingest", daemon=True)
+                self._thread.start()
+        if self.metrics is not None:
+            self.metrics.set_queue_depth(depth)
+        if depth >= self.batch_size:
+            self._wakeup.set()
+
+    def _send(self, batch):
+        raise NotImplementedError
+
+    def flush(self):
+        """Send queued events until the queue is empty; returns False if a batch failed"""
+        with self._flush_lock:
+            return self._flush()
+
+    def _flush(self):
+        while True:
+            with self._lock:
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            if not batch:
+                return True
+            size = len(batch)
+            try:
+                if self.metrics is not None:
+                    with self.metrics.track_write():
+                        self._send(batch)
+                else:
+                    self._send(batch)
+                self.sent += size
+            except Exception as e:
+                self.sent += size - len(batch)
+                self.failed_batches += 1
+                logging.warning(f"{type(self).__name__}: {len(batch)} of {size} queued writes failed: {e}")
+                with self._lock:
+                    # 放回佇列前端，下次以相同的 key 重送
+                    self._queue.extendleft(reversed(batch))
+                    while len(self._queue) > self.max_queue:
+                        self._queue.popleft()
+                        self.dropped += 1
+                return False
+            finally:
+                if self.metrics is not None:
+                    self.metrics.set_queue_depth(len(self._queue))
+
+    def _run(self):
+        backoff = self.flush_interval
+        while not self._closed:
+            self._wakeup.wait(backoff)
+            self._wakeup.clear()
+            if self.flush():
+                backoff = self.flush_interval
+            else:
+                backoff = min(backoff * 2, 60)
+
+    def close(self):
+        """Stop the background thread and try to send what is still queued"""
+        self._closed = True
+        self._wakeup.set()
+        return self.flush()
+
+    def stats(self):
+        with self._lock:
+            depth = len(self._queue)
+        return {'queued': depth, 'sent': self.sent, 'dropped': self.dropped,
+                'failed_batches': self.failed_batches}
+
+
+class IngestClient(QueuedWriter):
+    """Sends queued agent writes to the API's /api/ingest endpoint in compressed batches"""
+
+    def __init__(self, url, token=None, timeout=10, **kwargs):
+        super().__init__(**kwargs)
+        self.url = url
+        self.token = token
+        self.timeout = timeout
+
+    @classmethod
+    def from_config(cls, agent, metrics=None):
+        """Client configured by the "ingest" section of mongo_config.json, or None if not configured"""
+        from database.mongo_config import load_config
+
+        try:
+            settings = load_config().get('ingest') or {}
+        except Exception:
+            return None
+        if not settings.get('url'):
+            return None
+        return cls(settings['url'], token=settings.get('token'), timeout=settings.get('timeout', 10),
+                   agent=agent, batch_size=settings.get('batch_size', 500),
+                   flush_interval=settings.get('flush_interval', 5),
+                   max_queue=settings.get('max_queue', 50000), metrics=metrics)
+
+    def _send(self, batch):
+        import urllib.request
+        from bson import json_util
+
+        body = gzip.compress(json_util.dumps({'agent': self.agent, 'events': batch}).encode('utf-8'))
+        request = urllib.request.Request(self.url, data=body, method='POST', headers={
+            'Content-Type': 'application/json',
+            'Content-Encoding': 'gzip',
+            'X-Ingest-Token': self.token or '',
+        })
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            result = json.loads(response.read() or b'{}')
+        for rejected in result.get('rejected', []):
+            # 格式錯誤的事件重送也不會成功，記錄後捨棄
+            logging.warning(f"Ingest rejected event {rejected.get('key')}: {rejected.get('error')}")
+        batch.clear()
+
+
+class DirectWriter(QueuedWriter):
+    """
+    Applies queued agent writes directly to MongoDB. The connection is
+    opened by the writer thread on the first flush, so the agent loop can
+    capture its first samples while MongoDB is still being reached.
+    """
+
+    def __init__(self, get_db, flush_interval=1, **kwargs):
+        super().__init__(flush_interval=flush_interval, **kwargs)
+        self.get_db = get_db
+        self._db = None
+
+    def _send(self, batch):
+        from pymongo.errors import BulkWriteError
+
+        if self._db is None:
+            self._db = self.get_db()
+        db = self._db
+        while batch:
+            event = batch[0]
+            if 'doc' in event:
+                # 連續寫入同一集合的插入合併為一次 insert_many
+                count = 1
+                while (count < len(batch) and 'doc' in batch[count]
+                       and batch[count]['collection'] == event['collection']):
+                    count += 1
+                try:
+                    db[event['collection']].insert_many([item['doc'] for item in batch[:count]], ordered=True)
+                except BulkWriteError as e:
+                    inserted = e.details.get('nInserted', 0)
+                    errors = e.details.get('writeErrors', [])
+                    # 重送時已寫入過的文件（相同 _id）視為成功
+                    if errors and errors[0].get('code') == 11000:
+                        inserted += 1
+                    del batch[:inserted]
+                    raise
+                del batch[:count]
+            else:
+                db[event['collection']].update_one(event['filter'], event['update'], upsert=event['upsert'])
+                del batch[0]
@@ -0,0 +1,79 @@
+from datetime import date, datetime, timezone
+
+from bson import ObjectId
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def http_date(value):
+    """
+    RFC 822 date as produced by Flask's default provider (naive values are
+    treated as UTC), without going through email.utils on every value
+    """
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        hour, minute, second = value.hour, value.minute, value.second
+    else:
+        hour = minute = second = 0
+    return (f"{_WEEKDAYS[value.weekday()]}, {value.day:02d} {_MONTHS[value.month - 1]} "
+            f"{value.year:04d} {hour:02d}:{minute:02d}:{second:02d} GMT")
+
+
+def _default(value):
+    """Serialize the MongoDB / datetime types that appear in API payloads"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, date):
+        return http_date(value)
+    return DefaultJSONProvider.default(value)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider backed by orjson when available, falling back to the
+    standard library. ObjectId and datetime values are handled natively, so
+    handlers can pass MongoDB documents straight to jsonify.
+
+    Datetimes keep Flask's RFC 822 format by default; set ``native_datetime``
+    to let orjson emit ISO 8601 directly, which is several times faster on
+    payloads with a datetime per row.
+    """
+
+    default = staticmethod(_default)
+    native_datetime = False
+
+    def _orjson_options(self):
+        option = orjson.OPT_NON_STR_KEYS
+        if not self.native_datetime:
+            option |= orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return option
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=_default, option=self._orjson_options()).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        option = self._orjson_options()
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            option |= orjson.OPT_INDENT_2
+        body = orjson.dumps(obj, default=_default, option=option) + b'\n'
+        return self._app.response_class(body, mimetype=self.mimetype)
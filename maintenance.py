@@ -0,0 +1,100 @@
+"""
+Maintenance jobs run by the API scheduler (see scheduler.py).
+
+    retention   delete raw data older than each collection's retention window
+                (activities / user_idle_times: RAW_DAYS, others: DAYS), rolling each
+                day up into daily_usage / daily_workstations first ("compaction")
+    rollup      keep today's and recent days' rollup rows up to date
+    sketches    rebuild the analytics sketches of days not fed by /api/ingest and
+                close past days (t-digests, heavy-hitter candidates)
+    indexes     create any missing index the API relies on
+
+Each job takes the database handle and returns a small JSON-able summary,
+which the scheduler stores in the run history.
+"""
+from datetime import datetime, timedelta
+
+from database.analytics import SKETCH_COLLECTION, maintain
+from database.mongo_config import ensure_indexes, time_series_enabled
+from database.rollup import (ROLLUP_COLLECTION, WORKSTATION_COLLECTION, ensure_rollup_indexes, rollup_day,
+                             rolled_up_dates)
+from time_codec import date_string
+
+# 依 date 欄位清理的集合及預設保留天數，None 表示不自動刪除。
+# activities / user_idle_times 與原本的 cleanup_old_records 相同（RAW_DAYS）；
+# afk 與 sessions 預設保留，agent_metrics 只是代理程式自身的統計
+DEFAULT_RETENTION_DAYS = {'activities': 7, 'user_idle_times': 7, 'afk': None, 'sessions': None,
+                          'agent_metrics': 30}
+TIME_SERIES_MANAGED = ('activities', 'afk')
+
+
+def retention_days(raw_days=7, overrides=None):
+    """Retention per raw collection: RAW_DAYS for activities / user_idle_times, then per-collection overrides"""
+    days = dict(DEFAULT_RETENTION_DAYS, activities=raw_days, user_idle_times=raw_days)
+    days.update(overrides or {})
+    return days
+
+
+def retention(db, days=None, rollup_days=365):
+    """
+    Delete raw data older than each collection's retention (``retention_days``),
+    rolling activities up before they are deleted; drop rollups older than ``rollup_days``
+    """
+    days = days or retention_days()
+    cutoffs = {name: date_string(datetime.now() - timedelta(days=keep))
+               for name, keep in days.items() if keep is not None}
+    compacted = []
+    if 'activities' in cutoffs and not time_series_enabled():
+        # 刪除前先彙總尚未彙總的日期，彙總資料保留較長時間
+        cutoff = cutoffs['activities']
+        expiring = set(db.activities.distinct('date', {'date': {'$lt': cutoff}}))
+        for date in sorted(expiring - rolled_up_dates(db, min(expiring, default=cutoff))):
+            rollup_day(db, date)
+            compacted.append(date)
+
+    deleted = {}
+    for name, cutoff in cutoffs.items():
+        if name in TIME_SERIES_MANAGED and time_series_enabled():
+            continue
+        deleted[name] = db[name].delete_many({'date': {'$lt': cutoff}}).deleted_count
+    rollup_cutoff = date_string(datetime.now() - timedelta(days=rollup_days))
+    for name in (ROLLUP_COLLECTION, WORKSTATION_COLLECTION, SKETCH_COLLECTION):
+        deleted[name] = db[name].delete_many({'date': {'$lt': rollup_cutoff}}).deleted_count
+    return {'cutoffs': cutoffs, 'compacted_days': compacted, 'deleted': deleted}
+
+
+def rollup(db, backfill_days=7):
+    """Recompute today's and yesterday's rollup and any recent day that has none yet"""
+    now = datetime.now()
+    since = date_string(now - timedelta(days=backfill_days))
+    dates = {date_string(now), date_string(now - timedelta(days=1))}
+    dates |= set(db.activities.distinct('date', {'date': {'$gte': since}})) - rolled_up_dates(db, since)
+    rows = {date: rollup_day(db, date) for date in sorted(dates)}
+    return {'days': rows}
+
+
+def sketches(db, feed, backfill_days=7):
+    """Backfill and close the daily analytics sketches"""
+    return maintain(db, feed, backfill_days)
+
+
+def check_indexes(db):
+    """Create missing indexes; returns the ones that had to be created"""
+    collections = ('users', 'activities', 'afk', 'user_idle_times', 'presence', 'sessions', 'teams', ROLLUP_COLLECTION,
+                   WORKSTATION_COLLECTION, SKETCH_COLLECTION)
+
+    def _index_names():
+        names = {}
+        for name in collections:
+            try:
+                names[name] = set(db[name].index_information())
+            except Exception:
+                names[name] = set()
+        return names
+
+    before = _index_names()
+    ensure_indexes(db)
+    ensure_rollup_indexes(db)
+    after = _index_names()
+    created = {name: sorted(after[name] - before[name]) for name in collections if after[name] - before[name]}
+    return {'created': created}
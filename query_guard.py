@@ -0,0 +1,221 @@
+"""
+Limits on the dashboard's read queries, so one heavy request cannot degrade
+everyone else:
+
+- every MongoDB operation of a guarded request runs under ``pymongo.timeout``
+  (client-side operation timeout), which also sends ``maxTimeMS`` to the
+  server, so a scan is stopped on the server when the budget is spent;
+- each endpoint has its own concurrency limit; a request that cannot get a
+  slot within QUEUE_TIMEOUT_SECONDS is rejected with 503 and Retry-After;
+- date ranges wider than MAX_DATE_SPAN_DAYS are rejected with 400 (``span_error``);
+- when the HTTP client disconnects (waitress with channel_request_lookahead),
+  the request's running operations are killed on the server. Queries are
+  tagged with a per-request ``comment`` so they can be found in $currentOp;
+  on a replica set $currentOp and killOp run on every data-bearing member,
+  since reads may be served by a secondary;
+- a query stopped by the time limit is answered with 504, one killed after
+  the client disconnected with 499 (``stopped_response``).
+
+Configured by the QUERY section of config.py:
+
+    'QUERY': {'MAX_TIME_MS': 15000, 'MAX_DATE_SPAN_DAYS': 31, 'QUEUE_TIMEOUT_SECONDS': 2,
+              'CONCURRENCY': {'default': 8, '/api/activities': 4, '/api/usage': 2}}
+"""
+import uuid
+import logging
+import threading
+from functools import wraps
+from contextlib import nullcontext
+
+import pymongo
+from pymongo.errors import ExecutionTimeout, NetworkTimeout, OperationFailure, ServerSelectionTimeoutError
+
+import api_metrics
+from time_codec import parse_date
+
+logger = logging.getLogger(__name__)
+
+QUERY_IN_FLIGHT = api_metrics.REGISTRY.gauge(
+    'api_query_in_flight', 'Guarded requests currently running', ('endpoint',))
+QUERY_REJECTED = api_metrics.REGISTRY.counter(
+    'api_query_rejected_total', 'Guarded requests rejected or stopped', ('endpoint', 'reason'))
+
+# 連線中斷檢查間隔
+DISCONNECT_POLL_SECONDS = 0.5
+
+
+# 查詢超過時間限制時拋出的例外（伺服器端 maxTimeMS、用戶端逾時，或在 pymongo.timeout
+# 期限內選不到伺服器）
+QUERY_TIMEOUT_ERRORS = (ExecutionTimeout, NetworkTimeout, ServerSelectionTimeoutError)
+# 查詢被 killOp 中止時的錯誤碼（Interrupted）
+INTERRUPTED_CODES = (11601,)
+# 端點以 except QUERY_STOPPED_ERRORS 交給 stopped_response 處理
+QUERY_STOPPED_ERRORS = QUERY_TIMEOUT_ERRORS + (OperationFailure,)
+
+# 用戶端已中斷連線（nginx 慣例）
+CLIENT_CLOSED_REQUEST = 499
+
+
+def _operation_timeout(seconds):
+    # pymongo.timeout 需要 pymongo 4.2 以上
+    if hasattr(pymongo, 'timeout'):
+        return pymongo.timeout(seconds)
+    return nullcontext()
+
+
+def _endpoint():
+    from flask import request
+    return request.url_rule.rule if request.url_rule else request.path
+
+
+class QueryGuard:
+    def __init__(self, get_db, config=None, get_member_client=None):
+        config = config or {}
+        self.get_db = get_db
+        self.get_member_client = get_member_client
+        self.max_time = config.get('MAX_TIME_MS', 15000) / 1000.0
+        self.max_span_days = config.get('MAX_DATE_SPAN_DAYS', 31)
+        self.queue_timeout = config.get('QUEUE_TIMEOUT_SECONDS', 2)
+        self.concurrency = dict(config.get('CONCURRENCY', {}))
+        self.default_concurrency = self.concurrency.pop('default', 8)
+        self._semaphores = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _semaphore(self, endpoint):
+        semaphore = self._semaphores.get(endpoint)
+        if semaphore is None:
+            with self._lock:
+                semaphore = self._semaphores.setdefault(
+                    endpoint, threading.BoundedSemaphore(self.concurrency.get(endpoint, self.default_concurrency)))
+        return semaphore
+
+    def comment(self):
+        """Tag of the current request's queries (None outside a guarded request)"""
+        return getattr(self._local, 'token', None)
+
+    def options(self, db):
+        """
+        Keyword arguments that tag a query on ``db`` with the request's comment.
+        Empty outside a guarded request and for stand-in databases (mongomock,
+        the shard-targeting stand-in), which do not accept ``comment``.
+        """
+        token = self.comment()
+        if token is None or not isinstance(db, pymongo.database.Database):
+            return {}
+        return {'comment': token}
+
+    def span_error(self, start_date, end_date):
+        """Error message when a 'YYYY-MM-DD' range is invalid or wider than MAX_DATE_SPAN_DAYS, else None"""
+        try:
+            days = (parse_date(end_date) - parse_date(start_date)).days + 1
+        except ValueError:
+            return 'Dates must be YYYY-MM-DD'
+        if days < 1:
+            return 'end_date must not be earlier than start_date'
+        return self.days_error(days)
+
+    def days_error(self, days):
+        """Error message when a range of ``days`` days is wider than MAX_DATE_SPAN_DAYS, else None"""
+        if days > self.max_span_days:
+            QUERY_REJECTED.inc(endpoint=_endpoint(), reason='span')
+            return f"Date range of {days} days exceeds the limit of {self.max_span_days} days"
+        return None
+
+    def timeout_response(self, error):
+        """504 for a query stopped by the time limit"""
+        from flask import jsonify, request
+        QUERY_REJECTED.inc(endpoint=_endpoint(), reason='timeout')
+        logger.warning(f"Query timed out on {request.full_path}: {error}")
+        return jsonify({'error': f"Query exceeded the time limit of {self.max_time:g}s"}), 504
+
+    def stopped_response(self, error):
+        """
+        Response for an error in ``QUERY_STOPPED_ERRORS``: 504 when the time
+        limit stopped the query, 499 when it was killed after the client
+        disconnected, otherwise the endpoints' usual 500
+        """
+        from flask import jsonify, request
+        if isinstance(error, QUERY_TIMEOUT_ERRORS) or getattr(error, 'timeout', False):
+            return self.timeout_response(error)
+        if getattr(error, 'code', None) in INTERRUPTED_CODES:
+            logger.info(f"Query of {request.full_path} was cancelled: {error}")
+            return jsonify({'error': 'Query cancelled'}), CLIENT_CLOSED_REQUEST
+        logger.error(f"Query failed on {request.full_path}: {error}")
+        return jsonify({'error': str(error), 'type': type(error).__name__}), 500
+
+    def _admin_databases(self):
+        """(address, admin database, client to close) of each server that has to run $currentOp / killOp"""
+        client = self.get_db().client
+        description = client.topology_description
+        if self.get_member_client is None or description.topology_type_name not in (
+                'ReplicaSetWithPrimary', 'ReplicaSetNoPrimary'):
+            # 單機或 mongos（mongos 的 $currentOp 會列出各 shard 上的操作）
+            return [('server', client.admin, None)]
+        databases = []
+        for address, server in description.server_descriptions().items():
+            if server.is_readable:
+                member = self.get_member_client(address)
+                databases.append((f"{address[0]}:{address[1]}", member.admin, member))
+        return databases
+
+    def _kill(self, token):
+        """Kill the server operations tagged with ``token``"""
+        killed = 0
+        for address, admin, member in self._admin_databases():
+            try:
+                operations = admin.aggregate([
+                    {'$currentOp': {'allUsers': True}},
+                    {'$match': {'$or': [{'command.comment': token},
+                                        {'cursor.originatingCommand.comment': token}]}},
+                ])
+                for op in operations:
+                    admin.command('killOp', op=op['opid'])
+                    killed += 1
+            except Exception as e:
+                logger.error(f"Unable to cancel queries on {address}: {e}")
+            finally:
+                if member is not None:
+                    member.close()
+        return killed
+
+    def _watch_disconnect(self, client_disconnected, token, done, endpoint):
+        while not done.wait(DISCONNECT_POLL_SECONDS):
+            if client_disconnected():
+                QUERY_REJECTED.inc(endpoint=endpoint, reason='cancelled')
+                try:
+                    killed = self._kill(token)
+                    logger.info(f"Client disconnected from {endpoint}, killed {killed} operation(s)")
+                except Exception as e:
+                    logger.error(f"Unable to cancel queries of {endpoint}: {e}")
+                return
+
+    def limit(self, f):
+        """Run the endpoint under its concurrency limit, time limit and disconnect watch"""
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            from flask import request, jsonify
+            endpoint = _endpoint()
+            semaphore = self._semaphore(endpoint)
+            if not semaphore.acquire(timeout=self.queue_timeout):
+                QUERY_REJECTED.inc(endpoint=endpoint, reason='busy')
+                response = jsonify({'error': 'Too many concurrent requests, please retry'})
+                response.headers['Retry-After'] = '1'
+                return response, 503
+            token = f"{endpoint}:{uuid.uuid4().hex}"
+            self._local.token = token
+            done = threading.Event()
+            client_disconnected = request.environ.get('waitress.client_disconnected')
+            if client_disconnected is not None:
+                threading.Thread(target=self._watch_disconnect, args=(client_disconnected, token, done, endpoint),
+                                 name='query-disconnect-watch', daemon=True).start()
+            QUERY_IN_FLIGHT.inc(endpoint=endpoint)
+            try:
+                with _operation_timeout(self.max_time):
+                    return f(*args, **kwargs)
+            finally:
+                done.set()
+                self._local.token = None
+                QUERY_IN_FLIGHT.dec(endpoint=endpoint)
+                semaphore.release()
+        return decorated_function
@@ -0,0 +1,236 @@
+import os
+import io
+import json
+import time
+import pstats
+import cProfile
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+
+import api_metrics
+from time_codec import format_datetime
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+logger = logging.getLogger(__name__)
+
+# explain 時需移除的會話/驅動欄位
+_DRIVER_FIELDS = ('$db', 'lsid', '$clusterTime', '$readPreference', 'txnNumber', 'cursor', 'singleBatch')
+
+
+class SlowRequestLog:
+    """Bounded slow-request log persisted as JSON lines in a local file"""
+
+    def __init__(self, path, max_entries=200):
+        self.path = path
+        self.entries = deque(maxlen=max_entries)
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        self.entries.append(json.loads(line))
+        except Exception as e:
+            logger.warning(f"無法讀取慢請求記錄 {self.path}: {e}")
+
+    def append(self, entry):
+        with self._lock:
+            self.entries.append(entry)
+            tmp_path = self.path + '.tmp'
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    for item in self.entries:
+                        f.write(json.dumps(item, default=str, ensure_ascii=False) + '\n')
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                logger.error(f"寫入慢請求記錄失敗: {e}")
+
+    def recent(self, limit=50):
+        with self._lock:
+            return list(self.entries)[-limit:][::-1]
+
+
+class RequestProfiler:
+    """
+    Opt-in per-request profiling for logged-in admins.
+
+    Profiling is enabled per request with the ``X-Profile: 1`` header (or for
+    every admin request when PROFILING.ENABLED is set). Requests slower than
+    PROFILING.SLOW_THRESHOLD_MS are written to the slow-request log together
+    with their phase timings, a cProfile (or pyinstrument) capture and the
+    MongoDB explain output of the read commands they issued.
+    """
+
+    def __init__(self, get_db, log_dir, config=None):
+        config = config or {}
+        self.get_db = get_db
+        self.always_on = config.get('ENABLED', False)
+        self.header = config.get('HEADER', 'X-Profile')
+        self.threshold = config.get('SLOW_THRESHOLD_MS', 500) / 1000.0
+        self.explain_verbosity = config.get('EXPLAIN_VERBOSITY', 'executionStats')
+        self.use_pyinstrument = config.get('ENGINE', 'cprofile') == 'pyinstrument' and pyinstrument is not None
+        self.top_functions = config.get('TOP_FUNCTIONS', 30)
+        self.log = SlowRequestLog(os.path.join(log_dir, 'slow_requests.jsonl'),
+                                  config.get('MAX_ENTRIES', 200))
+
+    def is_requested(self, request, session):
+        if not session.get('is_admin'):
+            return False
+        return self.always_on or request.headers.get(self.header, '').lower() in ('1', 'true', 'yes')
+
+    def start(self, state):
+        state['phases'] = {}
+        state['commands'] = []
+        api_metrics.capture_commands(state['commands'])
+        try:
+            if self.use_pyinstrument:
+                profiler = pyinstrument.Profiler()
+                profiler.start()
+            else:
+                profiler = cProfile.Profile()
+                profiler.enable()
+        except (ValueError, RuntimeError) as e:
+            # Python 3.12 以上同時只能啟用一個 profiler；另一個請求正在分析時只記錄階段時間與查詢
+            logger.info(f"Profiler unavailable for this request: {e}")
+            profiler = None
+        state['profiler'] = profiler
+        state['started'] = state['last_mark'] = time.perf_counter()
+
+    def stop(self, state):
+        """Stop the request's profiler without recording anything"""
+        api_metrics.capture_commands(None)
+        profiler = state.pop('profiler', None)
+        if profiler is None:
+            return
+        if self.use_pyinstrument:
+            profiler.stop()
+        else:
+            profiler.disable()
+
+    def _profile_text(self, profiler):
+        if profiler is None:
+            return 'Not captured: another request was being profiled'
+        if self.use_pyinstrument:
+            profiler.stop()
+            return profiler.output_text(unicode=True, color=False)
+        profiler.disable()
+        buffer = io.StringIO()
+        pstats.Stats(profiler, stream=buffer).sort_stats('cumulative').print_stats(self.top_functions)
+        return buffer.getvalue()
+
+    def _explain(self, commands):
+        results = []
+        try:
+            db = self.get_db()
+        except Exception as e:
+            return [{'error': f"Unable to connect for explain: {e}"}]
+        for database_name, command in commands:
+            explained = {key: value for key, value in command.items() if key not in _DRIVER_FIELDS}
+            if 'aggregate' in explained:
+                explained['cursor'] = {}
+            try:
+                # 與儀表板查詢相同的讀取偏好，explain 在實際執行查詢的節點上
+                plan = db.client[database_name].command(
+                    {'explain': explained, 'verbosity': self.explain_verbosity},
+                    read_preference=db.read_preference)
+                results.append({'command': explained, 'explain': plan})
+            except Exception as e:
+                results.append({'command': explained, 'error': str(e)})
+        return results
+
+    def finish(self, state, request, response):
+        api_metrics.capture_commands(None)
+        now = time.perf_counter()
+        duration = now - state['started']
+        if state['phases']:
+            # 最後一個 checkpoint 之後的時間主要是 jsonify 序列化
+            state['phases']['serialize'] = now - state['last_mark']
+        profile_text = self._profile_text(state.pop('profiler'))
+        response.headers['Server-Timing'] = ', '.join(
+            f"{name};dur={seconds * 1000:.1f}" for name, seconds in state['phases'].items()
+        ) or f"total;dur={duration * 1000:.1f}"
+
+        if duration < self.threshold:
+            return
+        entry = {
+            'timestamp': format_datetime(datetime.now()),
+            'method': request.method,
+            'path': request.full_path,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 1),
+            'phases_ms': {name: round(seconds * 1000, 1) for name, seconds in state['phases'].items()},
+            'profile': profile_text,
+            'queries': self._explain(state['commands']),
+        }
+        # 確保 explain 結果中的 BSON 型別可被 JSON 序列化
+        self.log.append(json.loads(json.dumps(entry, default=str)))
+        logger.warning(f"Slow request {request.method} {request.full_path}: {entry['duration_ms']}ms")
+
+
+def checkpoint(name):
+    """
+    Record the time since the previous checkpoint (or the start of the request)
+    as a named phase, when the current request is being profiled
+    """
+    from flask import g, has_request_context
+    if not has_request_context():
+        return
+    state = g.get('_profile')
+    if state is None:
+        return
+    now = time.perf_counter()
+    state['phases'][name] = state['phases'].get(name, 0.0) + now - state['last_mark']
+    state['last_mark'] = now
+
+
+def init_profiler(app, get_db, log_dir, config=None):
+    """Register the profiling hooks and the admin slow-log endpoint on the Flask app"""
+    from flask import g, request, session, jsonify
+
+    profiler = RequestProfiler(get_db, log_dir, config)
+
+    @app.before_request
+    def _profile_start():
+        if profiler.is_requested(request, session):
+            state = {}
+            profiler.start(state)
+            g._profile = state
+
+    @app.after_request
+    def _profile_finish(response):
+        state = g.pop('_profile', None)
+        if state is not None:
+            try:
+                profiler.finish(state, request, response)
+            except Exception as e:
+                logger.error(f"Profiling error: {e}")
+        return response
+
+    @app.teardown_request
+    def _profile_cleanup(exception=None):
+        api_metrics.capture_commands(None)
+        # after_request 未執行時（例如例外）停止 profiler，否則之後的請求無法再啟用
+        state = g.pop('_profile', None)
+        if state is not None and state.get('profiler') is not None:
+            profiler.stop(state)
+
+    @app.route('/api/profiling/slow')
+    def get_slow_requests():
+        if not session.get('is_admin'):
+            return jsonify({"error": "Admin privileges required"}), 403
+        limit = request.args.get('limit', default=50, type=int)
+        entries = profiler.log.recent(limit)
+        return jsonify({'total_records': len(entries), 'slow_requests': entries})
+
+    return profiler
@@ -0,0 +1,319 @@
+"""
+In-process scheduler for the API's maintenance jobs.
+
+Every API node runs the scheduler thread, but a job only runs on the node
+that holds its lease. The lease is one document per job in
+``scheduler_leases``:
+
+    { _id: <job>, owner: "<host>:<pid>:<id>", expires_at, next_run_at, last_status }
+
+A node takes the lease with a single findAndModify that only matches when
+the job is due (``next_run_at`` passed) and the lease is free or expired, so
+exactly one node wins; the others get a duplicate key error on the upsert.
+The lease lasts for the job timeout plus a grace period. When the run ends
+the owner releases it and sets ``next_run_at`` to the next interval plus a
+random jitter, so the schedule is shared by all nodes and survives restarts.
+
+Each run executes in its own thread under ``pymongo.timeout`` (the job's
+MongoDB operations fail once the timeout is spent). A run that is still
+going at the timeout is recorded as "timeout"; the node keeps extending its
+lease (and does not start the job again itself) until the run's thread
+exits, so no second run starts while it is still going.
+Runs are recorded in ``scheduler_runs`` (expired after HISTORY_DAYS) and in
+the api_scheduler_* metrics.
+
+Configured by the SCHEDULER section of config.py:
+
+    'SCHEDULER': {'ENABLED': True, 'TICK_SECONDS': 30, 'HISTORY_DAYS': 14,
+                  'RETENTION': {'INTERVAL_SECONDS': 3600, 'JITTER_SECONDS': 300,
+                                'TIMEOUT_SECONDS': 600, 'RAW_DAYS': 7, 'ROLLUP_DAYS': 365,
+                                'DAYS': {'afk': 90, 'sessions': 90, 'agent_metrics': 30}},
+                  'ROLLUP': {'INTERVAL_SECONDS': 900, 'BACKFILL_DAYS': 7, ...},
+                  'INDEXES': {'INTERVAL_SECONDS': 86400, ...}}
+
+RETENTION.RAW_DAYS applies to activities and user_idle_times (as the old
+cleanup did); RETENTION.DAYS sets the retention of any raw collection
+(afk, sessions, agent_metrics, ...) and None keeps it. By default afk and
+sessions are kept and agent_metrics is kept for 30 days.
+"""
+import os
+import time
+import uuid
+import random
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+from contextlib import nullcontext
+
+import api_metrics
+import maintenance
+
+LEASE_COLLECTION = 'scheduler_leases'
+HISTORY_COLLECTION = 'scheduler_runs'
+
+# 逾時後租約再保留的秒數，避免另一個節點在工作仍執行時接手
+LEASE_GRACE_SECONDS = 60
+
+SCHEDULER_RUNS = api_metrics.REGISTRY.counter(
+    'api_scheduler_runs_total', 'Scheduled job runs by job and status', ('job', 'status'))
+SCHEDULER_DURATION = api_metrics.REGISTRY.histogram(
+    'api_scheduler_job_seconds', 'Duration of scheduled job runs', ('job',),
+    buckets=(0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0))
+SCHEDULER_LAST_SUCCESS = api_metrics.REGISTRY.gauge(
+    'api_scheduler_last_success_timestamp', 'Unix time of the last successful run on this node', ('job',))
+
+
+class Job:
+    """A maintenance task run every ``interval`` seconds (plus up to ``jitter``) on one node"""
+
+    def __init__(self, name, func, interval, timeout, jitter=0, enabled=True):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.timeout = timeout
+        self.jitter = jitter
+        self.enabled = enabled
+        self.running = False
+        self.next_check = 0.0
+
+
+def _operation_timeout(seconds):
+    """Client-side timeout for every MongoDB operation of a job run (pymongo 4.2+)"""
+    try:
+        import pymongo
+        return pymongo.timeout(seconds)
+    except (ImportError, AttributeError):
+        return nullcontext()
+
+
+class Scheduler:
+    def __init__(self, get_db, tick=30, history_days=14, owner=None):
+        self.get_db = get_db
+        self.tick = tick
+        self.history_days = history_days
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.jobs = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def add(self, job):
+        self.jobs[job.name] = job
+        return job
+
+    def ensure_indexes(self, db):
+        db[HISTORY_COLLECTION].create_index('started_at', expireAfterSeconds=int(self.history_days * 86400))
+        db[HISTORY_COLLECTION].create_index([('job', 1), ('started_at', -1)])
+
+    def _acquire(self, db, job, now, force=False):
+        """Take the job's lease if it is due (or ``force``) and not held by another node"""
+        from pymongo import ReturnDocument
+        from pymongo.errors import DuplicateKeyError
+
+        conditions = [{'$or': [{'expires_at': {'$lte': now}}, {'expires_at': {'$exists': False}}]}]
+        if not force:
+            conditions.append({'$or': [{'next_run_at': {'$lte': now}}, {'next_run_at': {'$exists': False}}]})
+        try:
+            lease = db[LEASE_COLLECTION].find_one_and_update(
+                {'_id': job.name, '$and': conditions},
+                {'$set': {'owner': self.owner, 'acquired_at': now,
+                          'expires_at': now + timedelta(seconds=job.timeout + LEASE_GRACE_SECONDS)}},
+                upsert=True, return_document=ReturnDocument.AFTER)
+        except DuplicateKeyError:
+            # 租約由其他節點持有，或工作尚未到期
+            return False
+        return lease is not None and lease.get('owner') == self.owner
+
+    def _release(self, db, job, status, finished):
+        next_run = finished + timedelta(seconds=job.interval + random.uniform(0, job.jitter))
+        update = {'next_run_at': next_run, 'last_status': status, 'last_finished_at': finished}
+        if status != 'timeout':
+            update['expires_at'] = finished
+        db[LEASE_COLLECTION].update_one({'_id': job.name, 'owner': self.owner}, {'$set': update})
+
+    def _execute(self, job, trigger):
+        started = datetime.now()
+        clock = time.perf_counter()
+        outcome = {}
+
+        def target():
+            try:
+                with _operation_timeout(job.timeout):
+                    outcome['result'] = job.func(self.get_db())
+            except Exception as e:
+                outcome['error'] = f"{type(e).__name__}: {e}"
+
+        worker = threading.Thread(target=target, name=f"scheduler-{job.name}", daemon=True)
+        worker.start()
+        worker.join(job.timeout)
+        duration = time.perf_counter() - clock
+        if worker.is_alive():
+            status = 'timeout'
+        else:
+            status = 'error' if 'error' in outcome else 'ok'
+
+        SCHEDULER_RUNS.inc(job=job.name, status=status)
+        SCHEDULER_DURATION.observe(duration, job=job.name)
+        if status == 'ok':
+            SCHEDULER_LAST_SUCCESS.set(time.time(), job=job.name)
+            logging.info(f"Scheduled job {job.name} finished in {duration:.1f}s: {outcome.get('result')}")
+        else:
+            logging.error(f"Scheduled job {job.name} {status} after {duration:.1f}s: {outcome.get('error', '')}")
+
+        finished = datetime.now()
+        try:
+            db = self.get_db()
+            db[HISTORY_COLLECTION].insert_one({
+                'job': job.name, 'owner': self.owner, 'trigger': trigger, 'status': status,
+                'started_at': started, 'finished_at': finished, 'duration_seconds': round(duration, 3),
+                'result': outcome.get('result'), 'error': outcome.get('error'),
+            })
+            self._release(db, job, status, finished)
+        except Exception as e:
+            logging.error(f"Unable to record scheduled job {job.name}: {e}")
+        finally:
+            if worker.is_alive():
+                self._wait_timed_out(job, worker)
+            with self._lock:
+                job.running = False
+
+    def _wait_timed_out(self, job, worker):
+        """
+        Keep the job marked as running (and its lease held) until a timed-out
+        run's thread actually exits, so neither this node nor another one
+        starts a second concurrent run
+        """
+        while worker.is_alive():
+            try:
+                self.get_db()[LEASE_COLLECTION].update_one(
+                    {'_id': job.name, 'owner': self.owner},
+                    {'$set': {'expires_at': datetime.now() + timedelta(seconds=LEASE_GRACE_SECONDS)}})
+            except Exception as e:
+                logging.error(f"Unable to extend lease of timed-out job {job.name}: {e}")
+            worker.join(LEASE_GRACE_SECONDS / 2)
+        logging.info(f"Timed-out run of {job.name} finished")
+        try:
+            self.get_db()[LEASE_COLLECTION].update_one(
+                {'_id': job.name, 'owner': self.owner}, {'$set': {'expires_at': datetime.now()}})
+        except Exception as e:
+            logging.error(f"Unable to release lease of {job.name}: {e}")
+
+    def run_now(self, name, trigger='manual'):
+        """
+        Run a job in the background right away if this node can take its lease.
+        Returns False if the job is already running here or on another node.
+        """
+        job = self.jobs[name]
+        with self._lock:
+            if job.running:
+                return False
+            job.running = True
+        try:
+            acquired = self._acquire(self.get_db(), job, datetime.now(), force=trigger == 'manual')
+        except Exception as e:
+            logging.error(f"Unable to acquire lease for {name}: {e}")
+            acquired = False
+        if not acquired:
+            with self._lock:
+                job.running = False
+            return False
+        threading.Thread(target=self._execute, args=(job, trigger), name=f"scheduler-run-{name}",
+                         daemon=True).start()
+        return True
+
+    def _loop(self):
+        try:
+            self.ensure_indexes(self.get_db())
+        except Exception as e:
+            logging.error(f"Unable to create scheduler indexes: {e}")
+        while not self._stop.is_set():
+            now = time.monotonic()
+            for job in self.jobs.values():
+                if job.enabled and now >= job.next_check:
+                    # 多個節點不會在同一時間檢查同一工作
+                    job.next_check = now + self.tick * random.uniform(0.8, 1.2)
+                    self.run_now(job.name, trigger='schedule')
+            self._stop.wait(min(self.tick, 5))
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='api-scheduler', daemon=True)
+            self._thread.start()
+            logging.info(f"Scheduler started as {self.owner} with jobs: {', '.join(self.jobs)}")
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self, history=10):
+        """Jobs with their shared lease state and most recent runs"""
+        db = self.get_db()
+        leases = {doc['_id']: doc for doc in db[LEASE_COLLECTION].find({'_id': {'$in': list(self.jobs)}})}
+        jobs = []
+        for job in self.jobs.values():
+            lease = leases.get(job.name, {})
+            runs = list(db[HISTORY_COLLECTION].find({'job': job.name}, {'_id': 0})
+                        .sort('started_at', -1).limit(history))
+            jobs.append({
+                'name': job.name, 'enabled': job.enabled, 'interval_seconds': job.interval,
+                'timeout_seconds': job.timeout, 'jitter_seconds': job.jitter,
+                'running_here': job.running, 'owner': lease.get('owner'),
+                'lease_expires_at': lease.get('expires_at'), 'next_run_at': lease.get('next_run_at'),
+                'last_status': lease.get('last_status'), 'runs': runs,
+            })
+        return {'node': self.owner, 'jobs': jobs}
+
+
+def _job_settings(config, name, interval, timeout, jitter):
+    settings = config.get(name, {})
+    return {
+        'interval': settings.get('INTERVAL_SECONDS', interval),
+        'timeout': settings.get('TIMEOUT_SECONDS', timeout),
+        'jitter': settings.get('JITTER_SECONDS', jitter),
+        'enabled': settings.get('ENABLED', True),
+    }, settings
+
+
+def init_scheduler(app, get_db, config=None, sketches=None):
+    """Create the scheduler with the maintenance jobs and register its admin endpoints"""
+    from flask import jsonify, session
+
+    config = config or {}
+    scheduler = Scheduler(get_db, tick=config.get('TICK_SECONDS', 30),
+                          history_days=config.get('HISTORY_DAYS', 14))
+
+    timing, settings = _job_settings(config, 'RETENTION', 3600, 600, 300)
+    days = maintenance.retention_days(settings.get('RAW_DAYS', 7), settings.get('DAYS'))
+    scheduler.add(Job('retention', lambda db: maintenance.retention(
+        db, days, settings.get('ROLLUP_DAYS', 365)), **timing))
+    timing, rollup_settings = _job_settings(config, 'ROLLUP', 900, 300, 120)
+    scheduler.add(Job('rollup', lambda db: maintenance.rollup(
+        db, rollup_settings.get('BACKFILL_DAYS', 7)), **timing))
+    if sketches is not None:
+        timing, sketch_settings = _job_settings(config, 'SKETCHES', 900, 300, 120)
+        scheduler.add(Job('sketches', lambda db: maintenance.sketches(
+            db, sketches, sketch_settings.get('BACKFILL_DAYS', 7)), **timing))
+    timing, _ = _job_settings(config, 'INDEXES', 86400, 300, 600)
+    scheduler.add(Job('indexes', maintenance.check_indexes, **timing))
+
+    @app.route('/api/scheduler')
+    def get_scheduler_status():
+        if not session.get('is_admin'):
+            return jsonify({"error": "Admin privileges required"}), 403
+        try:
+            return jsonify(scheduler.status())
+        except Exception as e:
+            logging.error(f"Scheduler status error: {e}")
+            return jsonify({"error": "Unable to read scheduler status"}), 500
+
+    @app.route('/api/scheduler/jobs/<name>/run', methods=['POST'])
+    def run_scheduled_job(name):
+        if not session.get('is_admin'):
+            return jsonify({"error": "Admin privileges required"}), 403
+        if name not in scheduler.jobs:
+            return jsonify({"error": f"Unknown job: {name}"}), 404
+        if not scheduler.run_now(name):
+            return jsonify({"error": f"Job {name} is already running"}), 409
+        return jsonify({"message": f"Job {name} started", "node": scheduler.owner}), 202
+
+    return scheduler
@@ -0,0 +1,121 @@
+"""
+Single-flight coalescing of identical concurrent dashboard requests.
+
+When many dashboards open at the same moment they send the same request
+(same path, query string and Accept header). The first one runs the view;
+the others wait for it and get a copy of its response, so the aggregation
+runs once. Only requests that are in flight at the same time are shared;
+nothing is cached after the response is built.
+
+Put ``@single_flight.coalesce`` above ``@query_guard.limit`` so waiting
+requests do not hold one of the endpoint's query slots. Profiled requests
+(X-Profile) always run on their own.
+
+A response for a cancelled request (499, the leader's client disconnected
+and its queries were killed) is not shared: the waiting requests elect a
+new leader and run the view again.
+"""
+import logging
+import threading
+from functools import wraps
+
+import api_metrics
+from query_guard import CLIENT_CLOSED_REQUEST
+
+logger = logging.getLogger(__name__)
+
+COALESCED_REQUESTS = api_metrics.REGISTRY.counter(
+    'api_coalesced_requests_total', 'Requests answered with the response of an identical in-flight request',
+    ('endpoint',))
+
+
+class Unshared(Exception):
+    """Raised by the function of ``SingleFlight.do`` when its result is for the leader only"""
+
+    def __init__(self, result):
+        super().__init__()
+        self.result = result
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'waiters', 'retry')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+        self.retry = False
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """
+        Run ``fn()`` once for all concurrent callers with the same ``key``.
+        Returns (result, shared); an exception of ``fn`` is raised in every caller.
+        When ``fn`` raises ``Unshared``, the leader returns its result and the
+        waiting callers run again under a new leader.
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                else:
+                    call.waiters += 1
+            if leader:
+                break
+            call.done.wait()
+            if call.retry:
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+        except Unshared as e:
+            call.retry = True
+            return e.result, False
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+    def coalesce(self, f):
+        """Share the response of a view between identical concurrent requests"""
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            from flask import current_app, g, request
+            if g.get('_profile') is not None:
+                return f(*args, **kwargs)
+            key = (request.path, tuple(sorted(request.args.items(multi=True))),
+                   request.headers.get('Accept', ''))
+
+            def render():
+                # 回應在 after_request（壓縮、metrics）之前複製，每個請求各自處理
+                response = current_app.make_response(f(*args, **kwargs))
+                result = response.get_data(), response.status_code, list(response.headers.items())
+                if response.status_code == CLIENT_CLOSED_REQUEST:
+                    # 領頭請求的查詢因用戶端中斷而被終止，其他請求不共用此回應
+                    raise Unshared(result)
+                return result
+
+            (body, status, headers), shared = self.do(key, render)
+            if shared:
+                COALESCED_REQUESTS.inc(endpoint=request.url_rule.rule if request.url_rule else request.path)
+            return current_app.response_class(body, status=status, headers=headers)
+        return decorated_function
+
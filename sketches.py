@@ -0,0 +1,140 @@
+"""
+Mergeable summaries for the analytics endpoints.
+
+``CountMinSketch`` estimates per-key totals (app name -> seconds) in a fixed
+``depth`` x ``width`` table; an estimate is never below the true total and
+exceeds it by at most ``e / width`` of the sketch's grand total with
+probability ``1 - exp(-depth)``. Two sketches with the same dimensions merge
+by adding their tables, so daily sketches can be summed over any range.
+Cells are addressed as (row, column) pairs, which lets the store update them
+with ``$inc`` from several API nodes at once.
+
+``TDigest`` is a merging t-digest (Dunning & Ertl): a sorted list of
+(mean, weight) centroids, small near the tails and large in the middle, so
+extreme quantiles stay accurate with ~``compression`` centroids. Digests
+merge by re-compressing the union of their centroids.
+"""
+import math
+import hashlib
+
+DEFAULT_WIDTH = 2048
+DEFAULT_DEPTH = 4
+DEFAULT_COMPRESSION = 100
+
+
+def sketch_cells(key, width=DEFAULT_WIDTH, depth=DEFAULT_DEPTH):
+    """The (row, column) cell of ``key`` in each row"""
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=4 * depth).digest()
+    return [(row, int.from_bytes(digest[4 * row:4 * row + 4], 'big') % width) for row in range(depth)]
+
+
+class CountMinSketch:
+    def __init__(self, width=DEFAULT_WIDTH, depth=DEFAULT_DEPTH):
+        self.width = width
+        self.depth = depth
+        self.rows = [[0] * width for _ in range(depth)]
+        self.total = 0
+
+    def add(self, key, weight=1):
+        for row, column in sketch_cells(key, self.width, self.depth):
+            self.rows[row][column] += weight
+        self.total += weight
+
+    def estimate(self, key):
+        return min(self.rows[row][column] for row, column in sketch_cells(key, self.width, self.depth))
+
+    def error_bound(self):
+        """Maximum overestimate (with probability 1 - exp(-depth))"""
+        return math.e / self.width * self.total
+
+    def merge(self, other):
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError('Count-Min sketches must have the same dimensions to merge')
+        for mine, theirs in zip(self.rows, other.rows):
+            for column, value in enumerate(theirs):
+                if value:
+                    mine[column] += value
+        self.total += other.total
+        return self
+
+    def add_cells(self, cells, total):
+        """Add sparse cells stored as {row: {column: value}} (string keys, as in MongoDB)"""
+        for row, columns in cells.items():
+            target = self.rows[int(row)]
+            for column, value in columns.items():
+                target[int(column)] += value
+        self.total += total
+        return self
+
+
+class TDigest:
+    def __init__(self, compression=DEFAULT_COMPRESSION, centroids=None):
+        self.compression = compression
+        self.centroids = [list(c) for c in centroids] if centroids else []
+        self._buffer = []
+
+    @property
+    def count(self):
+        self._flush()
+        return sum(weight for _, weight in self.centroids)
+
+    def add(self, value, weight=1):
+        self._buffer.append([float(value), weight])
+        if len(self._buffer) >= 10 * self.compression:
+            self._flush()
+
+    def merge(self, other):
+        other._flush()
+        self._buffer.extend(list(c) for c in other.centroids)
+        self._flush()
+        return self
+
+    def _scale(self, q):
+        return self.compression / (2 * math.pi) * math.asin(2 * min(max(q, 0.0), 1.0) - 1)
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        points = sorted(self.centroids + self._buffer, key=lambda c: c[0])
+        self._buffer = []
+        total = sum(weight for _, weight in points)
+        merged = [list(points[0])]
+        done = 0.0
+        limit = self._scale(0) + 1
+        for mean, weight in points[1:]:
+            current = merged[-1]
+            # 合併後仍在 k 尺度的一個單位內時併入目前的 centroid
+            if self._scale((done + current[1] + weight) / total) <= limit:
+                current[0] += (mean - current[0]) * weight / (current[1] + weight)
+                current[1] += weight
+            else:
+                done += current[1]
+                limit = self._scale(done / total) + 1
+                merged.append([mean, weight])
+        self.centroids = merged
+
+    def quantile(self, q):
+        """Estimated value at quantile ``q`` (0..1); None for an empty digest"""
+        self._flush()
+        if not self.centroids:
+            return None
+        if len(self.centroids) == 1:
+            return self.centroids[0][0]
+        total = sum(weight for _, weight in self.centroids)
+        target = q * total
+        cumulative = 0.0
+        for index, (mean, weight) in enumerate(self.centroids):
+            if cumulative + weight / 2 >= target:
+                if index == 0:
+                    return mean
+                previous_mean, previous_weight = self.centroids[index - 1]
+                # 在相鄰 centroid 的中心之間線性內插
+                left = cumulative - previous_weight / 2
+                span = (previous_weight + weight) / 2
+                return previous_mean + (mean - previous_mean) * (target - left) / span
+            cumulative += weight
+        return self.centroids[-1][0]
+
+    def to_list(self):
+        self._flush()
+        return [[mean, weight] for mean, weight in self.centroids]
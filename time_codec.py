@@ -0,0 +1,135 @@
+"""
+Parsing and formatting of the time strings stored by the agents.
+
+    date       "YYYY-MM-DD"            activities.date, afk.date, ...
+    datetime   "YYYY-MM-DD HH:MM:SS"   activities.logon_time / logoff_time / boot_time
+    clock      "HH:MM:SS"              afk.start_time / end_time
+    duration   "HH:MM:SS"              total_time, sum_time, idle_time, afk.duration
+
+The values are fixed width, so they are parsed by slicing instead of with
+``strptime`` and formatted with f-strings instead of ``strftime``. Date
+strings are memoized per day, since every document written on a day carries
+the same one, and parsed durations are memoized because a day's documents
+repeat a small set of total_time / duration values (heartbeats are all
+"00:00:01").
+
+Durations always use zero-padded hours that keep counting past 24
+("25:00:00", never "1 day, 1:00:00" as ``str(timedelta)`` produces), so they
+compare correctly as strings and split into three fields. The parser still
+accepts the older ``str(timedelta)`` forms ("0:00:31", "1 day, 1:00:00",
+"0:00:31.250000") found in existing documents.
+"""
+from datetime import datetime
+from functools import lru_cache
+
+DATE_FORMAT = '%Y-%m-%d'
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+CLOCK_FORMAT = '%H:%M:%S'
+
+SECONDS_PER_DAY = 86400
+
+
+@lru_cache(maxsize=64)
+def _date_for_ordinal(ordinal):
+    day = datetime.fromordinal(ordinal)
+    return f"{day.year:04d}-{day.month:02d}-{day.day:02d}"
+
+
+def date_string(value=None):
+    """'YYYY-MM-DD' for a datetime / date (default: today)"""
+    return _date_for_ordinal((value or datetime.now()).toordinal())
+
+
+def format_clock(value):
+    """'HH:MM:SS' for a datetime"""
+    return f"{value.hour:02d}:{value.minute:02d}:{value.second:02d}"
+
+
+def format_datetime(value):
+    """'YYYY-MM-DD HH:MM:SS' for a datetime"""
+    return f"{_date_for_ordinal(value.toordinal())} {value.hour:02d}:{value.minute:02d}:{value.second:02d}"
+
+
+def format_timestamp_clock(timestamp):
+    """'HH:MM:SS' (local time) for a ``time.time()`` timestamp"""
+    return format_clock(datetime.fromtimestamp(timestamp))
+
+
+def format_duration(seconds):
+    """'HH:MM:SS' for a number of seconds; hours continue past 24, negative values become 0"""
+    seconds = int(seconds)
+    if seconds <= 0:
+        return '00:00:00'
+    return '%02d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+@lru_cache(maxsize=1024)
+def parse_date(value):
+    """datetime at midnight for 'YYYY-MM-DD'"""
+    if len(value) != 10 or value[4] != '-' or value[7] != '-':
+        raise ValueError(f"time data {value!r} does not match format {DATE_FORMAT!r}")
+    return datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]))
+
+
+def parse_datetime(value):
+    """datetime for 'YYYY-MM-DD HH:MM:SS'"""
+    if len(value) != 19 or value[10] != ' ' or value[13] != ':' or value[16] != ':':
+        raise ValueError(f"time data {value!r} does not match format {DATETIME_FORMAT!r}")
+    return datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                    int(value[11:13]), int(value[14:16]), int(value[17:19]))
+
+
+def parse_clock(value):
+    """Seconds since midnight for 'HH:MM:SS' (single-digit fields are accepted, as with strptime)"""
+    if len(value) == 8 and value[2] == ':' and value[5] == ':':
+        hours, minutes, seconds = int(value[0:2]), int(value[3:5]), int(value[6:8])
+    else:
+        parts = value.split(':')
+        if len(parts) != 3:
+            raise ValueError(f"time data {value!r} does not match format {CLOCK_FORMAT!r}")
+        hours, minutes, seconds = int(parts[0]), int(parts[1]), int(parts[2])
+    if hours > 23 or minutes > 59 or seconds > 59:
+        raise ValueError(f"time data {value!r} is not a valid time of day")
+    return hours * 3600 + minutes * 60 + seconds
+
+
+@lru_cache(maxsize=4096)
+def parse_duration(value):
+    """Seconds for 'HH:MM:SS' (hours may exceed 24) or a ``str(timedelta)`` string"""
+    try:
+        # 常見格式 'HH:MM:SS' 直接轉換，與原本的 split/int 寫法一樣快
+        hours, minutes, seconds = value.split(':')
+        return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+    except ValueError:
+        return _parse_timedelta_string(value)
+
+
+def _parse_timedelta_string(value):
+    # '1 day, 2:03:04'、'2:03:04.500000' 等 str(timedelta) 格式
+    parts = value.split(':')
+    if len(parts) != 3:
+        raise ValueError(f"invalid duration: {value!r}")
+    hours, minutes, seconds = parts
+    days = 0
+    if ',' in hours:
+        # str(timedelta) 超過一天時的格式: '1 day, 2:03:04' / '3 days, 2:03:04'
+        prefix, hours = hours.split(', ')
+        days = int(prefix.split(' ', 1)[0])
+    if '.' in seconds:
+        seconds = seconds.split('.', 1)[0]
+    return days * SECONDS_PER_DAY + int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+def clock_span(start, end):
+    """Seconds from clock ``start`` to clock ``end``; an earlier end is taken to be on the next day"""
+    return (parse_clock(end) - parse_clock(start)) % SECONDS_PER_DAY
+
+
+def time_span(start, end):
+    """
+    Seconds between two logon / logoff strings: full datetimes when both
+    have a date part, otherwise clocks that may wrap past midnight.
+    """
+    if ' ' in start and ' ' in end:
+        return int((parse_datetime(end) - parse_datetime(start)).total_seconds())
+    return clock_span(start, end)
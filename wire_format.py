@@ -0,0 +1,141 @@
+import gzip
+from datetime import datetime, date
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 以字典編碼的重複字串欄位
+DICTIONARY_FIELDS = ('user_name', 'username', 'app_name', 'workstation_name', 'window', 'Status', 'type')
+
+# 小於此大小的回應不壓縮
+MIN_COMPRESS_BYTES = 1024
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/msgpack', 'text/plain')
+
+
+def requested_fields(request):
+    """Return the set of fields requested with ?fields=a,b,c, or None for all fields"""
+    fields = request.args.get('fields')
+    if not fields:
+        return None
+    return {field.strip() for field in fields.split(',') if field.strip()}
+
+
+def mongo_projection(fields, required=()):
+    """MongoDB projection covering the requested fields plus those needed server-side"""
+    if fields is None:
+        return None
+    return {field: 1 for field in set(fields) | set(required)}
+
+
+def project_rows(rows, fields):
+    if fields is None:
+        return rows
+    return [{key: row[key] for key in row if key in fields} for row in rows]
+
+
+def to_columnar(rows, dictionary_fields=DICTIONARY_FIELDS):
+    """
+    Convert a list of row dicts into one array per column. Repeated string
+    columns listed in ``dictionary_fields`` are stored as integer codes into a
+    per-column dictionary.
+    """
+    columns = []
+    seen = set()
+    for row in rows:
+        for key in row:
+            if key not in seen:
+                seen.add(key)
+                columns.append(key)
+
+    data = {}
+    dictionaries = {}
+    for column in columns:
+        values = [row.get(column) for row in rows]
+        if column in dictionary_fields:
+            codes = {}
+            encoded = []
+            for value in values:
+                code = codes.get(value)
+                if code is None:
+                    code = codes[value] = len(codes)
+                encoded.append(code)
+            dictionaries[column] = list(codes)
+            data[column] = encoded
+        else:
+            data[column] = values
+    return {'columns': columns, 'rows': len(rows), 'data': data, 'dictionaries': dictionaries}
+
+
+def _msgpack_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def respond(payload, row_keys=(), status=200):
+    """
+    Build the response for a read endpoint.
+
+    ``row_keys`` names the list-of-row entries in ``payload`` that honour
+    ``?fields=`` projection and the ``?format=columnar`` / ``?format=msgpack``
+    modes; other entries (totals, date ranges) are returned unchanged.
+    """
+    from flask import request, jsonify, current_app
+
+    fields = requested_fields(request)
+    response_format = request.args.get('format', 'json')
+    if response_format == 'json' and 'application/msgpack' in request.headers.get('Accept', ''):
+        response_format = 'msgpack'
+
+    for key in row_keys:
+        rows = payload.get(key)
+        if rows is None:
+            continue
+        rows = project_rows(rows, fields)
+        if response_format in ('columnar', 'msgpack'):
+            rows = to_columnar(rows)
+        payload[key] = rows
+
+    if response_format == 'msgpack':
+        if msgpack is None:
+            return jsonify({'error': 'MessagePack format is not available on this server'}), 406
+        body = msgpack.packb(payload, default=_msgpack_default, use_bin_type=True)
+        return current_app.response_class(body, status=status, mimetype='application/msgpack')
+
+    response = jsonify(payload)
+    response.status_code = status
+    return response
+
+
+def compress_response(response):
+    """after_request hook: brotli/gzip-compress large responses the client accepts"""
+    from flask import request
+
+    if (response.direct_passthrough or response.status_code < 200 or response.status_code >= 300
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    accept = request.headers.get('Accept-Encoding', '').lower()
+    body = response.get_data()
+    if len(body) < MIN_COMPRESS_BYTES:
+        return response
+
+    if brotli is not None and 'br' in accept:
+        response.set_data(brotli.compress(body, quality=5))
+        response.headers['Content-Encoding'] = 'br'
+    elif 'gzip' in accept:
+        response.set_data(gzip.compress(body, compresslevel=5))
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        return response
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response